@@ -0,0 +1,663 @@
+#!/usr/bin/env python3
+"""
+DALI Legal AI - Vector Store Benchmark
+Ingest throughput, query latency, memory and disk size per backend and configuration
+
+Runs fully offline on synthetic Arabic/English legal chunks:
+
+    python benchmarks/vector_store_benchmark.py --sizes 1000,10000
+    python benchmarks/vector_store_benchmark.py --sizes 1000,10000,100000,1000000 --backends sqlite
+    python benchmarks/vector_store_benchmark.py --model ./models/MiniLM --backends sqlite,chroma
+
+Backends:
+    sqlite  MySQL knowledge-base layout (document_chunks rows with codec blobs) in a
+            local SQLite file, searched with the same in-memory indexes MySQLVectorStore
+            uses: exact, IVF (per nprobe) and hybrid BM25 + vector
+    chroma  VectorStore on a local persistent Chroma directory (needs chromadb)
+    mysql   MySQLVectorStore against a real server, in a throwaway database
+            (needs mysql-connector and --mysql-database)
+
+Without --model, embeddings come from a deterministic feature-hashing encoder so
+the suite needs no downloads; pass a local SentenceTransformer directory to
+measure a real model. Results are written as JSON.
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import zlib
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.embedding_codec import encode_embedding, decode_embedding
+from src.core.embedding_index import UserEmbeddingIndex
+from src.core.ann_index import IVFFlatIndex, assign_to_centroids, default_nlist, train_centroids
+from src.core.retrieval import HybridRetriever, tokenize
+
+logger = logging.getLogger("vector_store_benchmark")
+
+DEFAULT_SIZES = [1000, 10000]
+BENCH_USER = 1
+
+EN_LAWS = ["Labor Law", "Companies Law", "Civil Transactions Law", "Commercial Court Law",
+           "Anti-Fraud Regulation", "Arbitration Law", "Bankruptcy Law", "Real Estate Registration Law"]
+EN_PARTIES = ["the employer", "the employee", "the contractor", "the lessee", "the lessor",
+              "the shareholder", "the board of directors", "the guarantor", "the creditor", "the debtor"]
+EN_OBLIGATIONS = ["notify the other party in writing", "pay the outstanding amount", "deliver the goods",
+                  "submit the dispute to arbitration", "register the amendment", "maintain confidentiality",
+                  "provide end-of-service compensation", "refrain from competing activities"]
+EN_EVENTS = ["the termination of the contract", "the date of notification", "the breach",
+             "the court judgment", "the transfer of ownership", "the expiry of the probation period"]
+EN_TEMPLATES = [
+    "Article {n} of the {law} provides that {party} shall {obligation} within {days} days of {event}.",
+    "Where {party} fails to {obligation}, the competent court may award damages under Article {n} of the {law}.",
+    "Subject to the {law}, {party} may not waive the right to {obligation} before {event}.",
+    "The {law} requires {party} to {obligation}; any agreement to the contrary is void (Article {n}).",
+]
+
+AR_LAWS = ["نظام العمل", "نظام الشركات", "نظام المعاملات المدنية", "نظام المحاكم التجارية",
+           "نظام مكافحة الاحتيال", "نظام التحكيم", "نظام الإفلاس", "نظام التسجيل العيني للعقار"]
+AR_PARTIES = ["صاحب العمل", "العامل", "المقاول", "المستأجر", "المؤجر",
+              "الشريك", "مجلس الإدارة", "الكفيل", "الدائن", "المدين"]
+AR_OBLIGATIONS = ["إخطار الطرف الآخر كتابة", "سداد المبلغ المستحق", "تسليم البضاعة",
+                  "إحالة النزاع إلى التحكيم", "تسجيل التعديل", "المحافظة على السرية",
+                  "دفع مكافأة نهاية الخدمة", "الامتناع عن المنافسة"]
+AR_EVENTS = ["انتهاء العقد", "تاريخ الإخطار", "وقوع الإخلال",
+             "صدور الحكم", "نقل الملكية", "انتهاء فترة التجربة"]
+AR_TEMPLATES = [
+    "تنص المادة {n} من {law} على أن يلتزم {party} بـ{obligation} خلال {days} يوماً من {event}.",
+    "إذا أخل {party} بـ{obligation} جاز للمحكمة المختصة الحكم بالتعويض وفقاً للمادة {n} من {law}.",
+    "مع مراعاة أحكام {law} لا يجوز لـ{party} التنازل عن {obligation} قبل {event}.",
+    "يوجب {law} على {party} {obligation} ويقع باطلاً كل اتفاق يخالف ذلك (المادة {n}).",
+]
+
+DOCUMENT_TYPES = ["contract", "law", "regulation", "judgment", "memo"]
+SOURCES = ["upload", "web_research", "legal_database", "scraped"]
+JURISDICTIONS = ["SA", "AE", "EG", "QA"]
+
+
+class HashingEncoder:
+    """
+    Deterministic feature-hashing encoder with the SentenceTransformer encode() interface
+
+    Each word token adds +/-1 to one of `dimension` buckets (CRC32 of the token),
+    so texts sharing legal terms land close together. No model download needed.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.max_seq_length = 128
+        self.tokenizer = None
+        self._features: Dict[str, Tuple[int, float]] = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _feature(self, token: str) -> Tuple[int, float]:
+        feature = self._features.get(token)
+        if feature is None:
+            digest = zlib.crc32(token.encode("utf-8"))
+            feature = (digest % self.dimension, 1.0 if digest & 0x80000000 else -1.0)
+            self._features[token] = feature
+        return feature
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_tensor: bool = False,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                column, sign = self._feature(token)
+                matrix[row, column] += sign
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        return matrix[0] if single else matrix
+
+
+def load_encoder(model: Optional[str], dimension: int):
+    """Local SentenceTransformer when a model path is given, else the hashing encoder"""
+    if not model:
+        return HashingEncoder(dimension), f"hashing-{dimension}"
+    from sentence_transformers import SentenceTransformer
+    encoder = SentenceTransformer(model, device="cpu")
+    return encoder, model
+
+
+def generate_corpus(size: int, seed: int = 13, arabic_ratio: float = 0.5) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield `size` synthetic legal chunks as (text, metadata)
+
+    Chunks are 3-5 templated sentences in Arabic or English. Every chunk is
+    unique (article numbers and day counts vary), so content-hash dedup does
+    not shrink the corpus.
+    """
+    rng = random.Random(seed)
+    for i in range(size):
+        arabic = rng.random() < arabic_ratio
+        if arabic:
+            templates, laws, parties, obligations, events = AR_TEMPLATES, AR_LAWS, AR_PARTIES, AR_OBLIGATIONS, AR_EVENTS
+        else:
+            templates, laws, parties, obligations, events = EN_TEMPLATES, EN_LAWS, EN_PARTIES, EN_OBLIGATIONS, EN_EVENTS
+        sentences = [
+            rng.choice(templates).format(
+                n=rng.randint(1, 250), law=rng.choice(laws), party=rng.choice(parties),
+                obligation=rng.choice(obligations), days=rng.randint(5, 180), event=rng.choice(events)
+            )
+            for _ in range(rng.randint(3, 5))
+        ]
+        sentences.append(f"[{i}]")
+        metadata = {
+            "document_type": DOCUMENT_TYPES[i % len(DOCUMENT_TYPES)],
+            "source": SOURCES[i % len(SOURCES)],
+            "jurisdiction": JURISDICTIONS[i % len(JURISDICTIONS)],
+            "language": "ar" if arabic else "en",
+            "chunk_index": 0,
+        }
+        yield " ".join(sentences), metadata
+
+
+def generate_queries(count: int, seed: int = 29) -> List[str]:
+    """Distinct Arabic and English questions, so query caches never hit"""
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        if i % 2:
+            queries.append(f"ما هي التزامات {rng.choice(AR_PARTIES)} بشأن {rng.choice(AR_OBLIGATIONS)} "
+                           f"وفق {rng.choice(AR_LAWS)} بعد {rng.choice(AR_EVENTS)} ({i})")
+        else:
+            queries.append(f"When must {rng.choice(EN_PARTIES)} {rng.choice(EN_OBLIGATIONS)} under the "
+                           f"{rng.choice(EN_LAWS)} after {rng.choice(EN_EVENTS)}? ({i})")
+    return queries
+
+
+def batched(iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def latency_summary(latencies: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean in milliseconds and single-client queries per second"""
+    if not latencies:
+        return {"count": 0}
+    values = np.asarray(latencies, dtype=np.float64) * 1000.0
+    return {
+        "count": int(values.size),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+        "qps": round(float(1000.0 / values.mean()), 1) if values.mean() > 0 else None,
+    }
+
+
+def time_queries(search, queries: Sequence[str], warmup: int = 5) -> Tuple[Dict[str, float], List[Any]]:
+    """Run search(query) for each query; returns the latency summary and the results"""
+    for query in queries[:warmup]:
+        search(query)
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(search(query))
+        latencies.append(time.perf_counter() - started)
+    return latency_summary(latencies), results
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size in MiB (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+    except ImportError:
+        return None
+
+
+def disk_bytes(path: Path) -> int:
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def recall_at_k(results: Sequence[Sequence[Any]], reference: Sequence[Sequence[Any]]) -> Optional[float]:
+    """Mean overlap of result ids with the exact-search ids"""
+    scores = []
+    for got, expected in zip(results, reference):
+        expected = set(expected)
+        if expected:
+            scores.append(len(expected & set(got)) / len(expected))
+    return round(float(np.mean(scores)), 4) if scores else None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+class SQLiteKnowledgeBase:
+    """
+    Stand-in for the MySQL document_chunks table in a local SQLite file
+
+    Rows hold the same codec blobs MySQLVectorStore writes, and are loaded
+    into the same in-memory index classes it searches with.
+    """
+
+    def __init__(self, path: Path, embedding_format: str, model_name: str):
+        self.path = Path(path)
+        self.embedding_format = embedding_format
+        self.model_name = model_name
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS document_chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                document_type TEXT,
+                source TEXT,
+                jurisdiction TEXT,
+                content TEXT NOT NULL,
+                embedding BLOB NOT NULL
+            )
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_user ON document_chunks (user_id, id)")
+
+    def insert(self, texts: List[str], metadatas: List[Dict[str, Any]], vectors: np.ndarray) -> None:
+        self.conn.executemany(
+            "INSERT INTO document_chunks (user_id, chunk_index, document_type, source, jurisdiction, content, embedding) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (BENCH_USER, metadata["chunk_index"], metadata["document_type"], metadata["source"],
+                 metadata["jurisdiction"], text, encode_embedding(vector, self.embedding_format, self.model_name))
+                for text, metadata, vector in zip(texts, metadatas, vectors)
+            ]
+        )
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def load_embeddings(self) -> Tuple[List[int], np.ndarray]:
+        ids, vectors = [], []
+        for chunk_id, blob in self.conn.execute(
+                "SELECT id, embedding FROM document_chunks WHERE user_id = ? ORDER BY id", (BENCH_USER,)):
+            vector, _ = decode_embedding(blob)
+            ids.append(chunk_id)
+            vectors.append(vector)
+        return ids, np.vstack(vectors).astype(np.float32)
+
+    def texts(self, user_id: int) -> Iterator[Tuple[int, str]]:
+        return iter(self.conn.execute("SELECT id, content FROM document_chunks WHERE user_id = ?", (user_id,)).fetchall())
+
+    def fetch(self, user_id: int, keys: List[int]) -> Dict[int, Dict[str, Any]]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = self.conn.execute(
+            f"SELECT id, content, document_type, source FROM document_chunks WHERE user_id = ? AND id IN ({placeholders})",
+            [user_id, *keys]
+        ).fetchall()
+        return {row[0]: {"id": row[0], "content": row[1], "document_type": row[2], "source": row[3]} for row in rows}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def ingest(write, commit, encoder, size: int, batch_size: int, seed: int) -> Dict[str, Any]:
+    """Encode and write the corpus in batches; returns ingest timings"""
+    encode_seconds = 0.0
+    started = time.perf_counter()
+    for batch in batched(generate_corpus(size, seed), batch_size):
+        texts = [text for text, _ in batch]
+        encode_started = time.perf_counter()
+        vectors = np.asarray(encoder.encode(texts, batch_size=batch_size, convert_to_tensor=False, show_progress_bar=False),
+                             dtype=np.float32)
+        encode_seconds += time.perf_counter() - encode_started
+        write(texts, [metadata for _, metadata in batch], vectors)
+    if commit is not None:
+        commit()
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(size / elapsed, 1) if elapsed > 0 else None,
+        "encode_seconds": round(encode_seconds, 3),
+        "write_seconds": round(elapsed - encode_seconds, 3),
+    }
+
+
+def bench_sqlite(size: int, encoder, model_name: str, queries: List[str], workdir: Path, args) -> List[Dict[str, Any]]:
+    """One ingest per embedding format, then exact, IVF and hybrid search over it"""
+    records = []
+    query_vectors = np.asarray(encoder.encode(queries, batch_size=args.batch_size, convert_to_tensor=False), dtype=np.float32)
+    vector_for = dict(zip(queries, query_vectors))
+
+    def encode_query(query: str) -> np.ndarray:
+        vector = vector_for.get(query)
+        return vector if vector is not None else np.asarray(encoder.encode(query), dtype=np.float32)
+
+    for embedding_format in args.formats:
+        db_path = workdir / f"knowledge_base_{size}_{embedding_format}.sqlite"
+        store = SQLiteKnowledgeBase(db_path, embedding_format, model_name)
+        rss_before = rss_mb()
+        ingest_stats = ingest(store.insert, store.commit, encoder, size, args.batch_size, args.seed)
+        store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        on_disk = disk_bytes(db_path)
+
+        load_started = time.perf_counter()
+        ids, matrix = store.load_embeddings()
+        exact = UserEmbeddingIndex(ids, matrix)
+        load_seconds = time.perf_counter() - load_started
+        del matrix
+        base = {
+            "backend": "sqlite",
+            "chunks": size,
+            "ingest": ingest_stats,
+            "disk_bytes": on_disk,
+        }
+
+        exact_search = lambda q: [doc_id for doc_id, _ in exact.search(encode_query(q), args.top_k)]
+        latency, reference = time_queries(exact_search, queries)
+        if "exact" in args.configs:
+            records.append({
+                **base,
+                "configuration": {"embedding_format": embedding_format, "index": "exact"},
+                "index_build_seconds": round(load_seconds, 3),
+                "query": latency,
+                "recall_at_k": 1.0,
+                "memory": {"index_bytes": exact._matrix.nbytes + exact._ids.nbytes,
+                           "rss_mb": rss_mb(), "rss_delta_mb": _delta(rss_mb(), rss_before)},
+            })
+
+        if "ivf" in args.configs:
+            nlist = default_nlist(len(ids))
+            train_started = time.perf_counter()
+            index = IVFFlatIndex(ids, exact._matrix, exact_threshold=0)
+            snapshot_ids, snapshot_vectors = index.snapshot()
+            centroids = train_centroids(snapshot_vectors, nlist)
+            index.install_training(centroids, snapshot_ids, assign_to_centroids(snapshot_vectors, centroids))
+            del snapshot_vectors
+            train_seconds = time.perf_counter() - train_started
+            for nprobe in args.nprobe:
+                ivf_search = lambda q: [doc_id for doc_id, _ in index.search(encode_query(q), args.top_k, nprobe=nprobe)]
+                latency, results = time_queries(ivf_search, queries)
+                records.append({
+                    **base,
+                    "configuration": {"embedding_format": embedding_format, "index": "ivf", "nlist": nlist, "nprobe": nprobe},
+                    "index_build_seconds": round(load_seconds + train_seconds, 3),
+                    "query": latency,
+                    "recall_at_k": recall_at_k(results, reference),
+                    "memory": {"index_bytes": index._matrix.nbytes + index._ids.nbytes + centroids.nbytes + index._assign.nbytes,
+                               "rss_mb": rss_mb(), "rss_delta_mb": _delta(rss_mb(), rss_before)},
+                })
+            del index
+
+        if "hybrid" in args.configs:
+            retriever = HybridRetriever(
+                text_loader=store.texts,
+                fetch=store.fetch,
+                vector_search=lambda user_id, q, k: exact.search(encode_query(q), k),
+            )
+            build_started = time.perf_counter()
+            retriever.keyword_index(BENCH_USER)
+            build_seconds = time.perf_counter() - build_started
+            hybrid_search = lambda q: [row["id"] for row in retriever.retrieve(BENCH_USER, q, args.top_k)]
+            latency, results = time_queries(hybrid_search, queries)
+            records.append({
+                **base,
+                "configuration": {"embedding_format": embedding_format, "index": "hybrid"},
+                "index_build_seconds": round(load_seconds + build_seconds, 3),
+                "query": latency,
+                "recall_at_k": recall_at_k(results, reference),
+                "memory": {"index_bytes": exact._matrix.nbytes + exact._ids.nbytes,
+                           "rss_mb": rss_mb(), "rss_delta_mb": _delta(rss_mb(), rss_before)},
+            })
+            del retriever
+
+        store.close()
+        del exact
+        gc.collect()
+    return records
+
+
+def bench_chroma(size: int, encoder, model_name: str, queries: List[str], workdir: Path, args) -> List[Dict[str, Any]]:
+    """VectorStore on a fresh persistent Chroma directory"""
+    from src.core.vector_store import VectorStore
+
+    persist_directory = workdir / f"chroma_{size}"
+    store = VectorStore(
+        persist_directory=str(persist_directory),
+        collection_name=f"benchmark_{size}",
+        embedding_model=model_name,
+        embedding_batch_size=args.batch_size,
+        micro_batching=False,
+        chunking="characters",
+    )
+    # Use the benchmark encoder instead of loading from the model registry
+    store._embedding_model = encoder
+    rss_before = rss_mb()
+
+    counter = iter(range(size))
+
+    def write(texts, metadatas, _vectors):
+        store._add_to_collection([f"benchmark-{next(counter)}" for _ in texts], texts, metadatas)
+
+    # Chroma embeds inside _add_to_collection, so encode time is part of write time here
+    ingest_stats = ingest(write, None, _NoopEncoder(), size, args.batch_size, args.seed)
+    latency, _ = time_queries(lambda q: store.search(q, n_results=args.top_k), queries)
+    return [{
+        "backend": "chroma",
+        "chunks": size,
+        "configuration": {"index": "hnsw", "model": model_name},
+        "ingest": ingest_stats,
+        "query": latency,
+        "memory": {"rss_mb": rss_mb(), "rss_delta_mb": _delta(rss_mb(), rss_before)},
+        "disk_bytes": disk_bytes(persist_directory),
+    }]
+
+
+def bench_mysql(size: int, encoder, model_name: str, queries: List[str], workdir: Path, args) -> List[Dict[str, Any]]:
+    """MySQLVectorStore bulk ingest and search in a throwaway database"""
+    import mysql.connector
+    from src.core.vector_store import MySQLVectorStore
+    from src.utils.config import get_mysql_config
+
+    if not args.mysql_database:
+        raise RuntimeError("--mysql-database is required; the database is dropped afterwards")
+    mysql_config = {**get_mysql_config(), "database": args.mysql_database}
+    server = {key: value for key, value in mysql_config.items() if key != "database"}
+    admin = mysql.connector.connect(**server)
+    admin.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{args.mysql_database}`")
+
+    records = []
+    try:
+        for embedding_format in args.formats:
+            store = MySQLVectorStore(
+                mysql_config,
+                embedding_format=embedding_format,
+                embedding_model_name=model_name,
+                query_embedder=lambda q: encoder.encode(q),
+                chunk_embedder=lambda texts: encoder.encode(texts, batch_size=args.batch_size),
+            )
+            user_id = store.add_user(f"benchmark_{size}_{embedding_format}", f"benchmark_{size}_{embedding_format}@example.com", "-")
+            rss_before = rss_mb()
+
+            def write(texts, metadatas, vectors):
+                store.add_documents_bulk(user_id, [
+                    {"title": f"Benchmark {metadata['document_type']}", "document_type": metadata["document_type"],
+                     "source": metadata["source"], "content": text, "embedding": vector, "metadata": metadata}
+                    for text, metadata, vector in zip(texts, metadatas, vectors)
+                ], batch_size=args.batch_size)
+
+            ingest_stats = ingest(write, None, encoder, size, args.batch_size, args.seed)
+            latency, _ = time_queries(
+                lambda q: store.search_documents(user_id, encoder.encode(q), args.top_k), queries
+            )
+            cursor = admin.cursor()
+            cursor.execute(
+                "SELECT COALESCE(SUM(data_length + index_length), 0) FROM information_schema.tables WHERE table_schema = %s",
+                (args.mysql_database,)
+            )
+            on_disk = int(cursor.fetchone()[0])
+            cursor.close()
+            records.append({
+                "backend": "mysql",
+                "chunks": size,
+                "configuration": {"embedding_format": embedding_format, "index": "memory"},
+                "ingest": ingest_stats,
+                "query": latency,
+                "memory": {"rss_mb": rss_mb(), "rss_delta_mb": _delta(rss_mb(), rss_before)},
+                "disk_bytes": on_disk,
+            })
+            store.conn.close()
+    finally:
+        if not args.keep:
+            admin.cursor().execute(f"DROP DATABASE IF EXISTS `{args.mysql_database}`")
+        admin.close()
+    return records
+
+
+class _NoopEncoder:
+    """Placeholder for backends that embed on write"""
+
+    def encode(self, texts, **kwargs):
+        return np.zeros((len(texts), 0), dtype=np.float32)
+
+
+def _delta(after: Optional[float], before: Optional[float]) -> Optional[float]:
+    return round(after - before, 1) if after is not None and before is not None else None
+
+
+BACKENDS = {
+    "sqlite": bench_sqlite,
+    "chroma": bench_chroma,
+    "mysql": bench_mysql,
+}
+
+
+def run(args) -> Dict[str, Any]:
+    encoder, model_name = load_encoder(args.model, args.dimension)
+    queries = generate_queries(args.queries, args.seed + 1)
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="dali-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    results, skipped = [], []
+    try:
+        for size in args.sizes:
+            for backend in args.backends:
+                logger.info(f"Benchmarking {backend} with {size:,} chunks")
+                try:
+                    results.extend(BACKENDS[backend](size, encoder, model_name, queries, workdir, args))
+                except ImportError as e:
+                    skipped.append({"backend": backend, "chunks": size, "reason": f"missing dependency: {e}"})
+                    logger.warning(f"Skipping {backend}: {e}")
+                except Exception as e:
+                    skipped.append({"backend": backend, "chunks": size, "reason": str(e)})
+                    logger.error(f"{backend} benchmark with {size} chunks failed: {e}")
+                gc.collect()
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "environment": environment(),
+        "settings": {
+            "model": model_name,
+            "sizes": args.sizes,
+            "backends": args.backends,
+            "configs": args.configs,
+            "embedding_formats": args.formats,
+            "nprobe": args.nprobe,
+            "queries": args.queries,
+            "top_k": args.top_k,
+            "batch_size": args.batch_size,
+            "seed": args.seed,
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item.replace("_", "")) for item in value.split(",") if item.strip()]
+
+
+def _str_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline vector store throughput and latency benchmark")
+    parser.add_argument("--sizes", type=_int_list, default=DEFAULT_SIZES,
+                        help="Corpus sizes in chunks, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--backends", type=_str_list, default=["sqlite", "chroma"],
+                        help=f"Comma-separated subset of {','.join(BACKENDS)}")
+    parser.add_argument("--configs", type=_str_list, default=["exact", "ivf", "hybrid"],
+                        help="sqlite index configurations: exact, ivf, hybrid")
+    parser.add_argument("--formats", type=_str_list, default=["float32", "float16", "int8"],
+                        help="Embedding storage formats for the sqlite and mysql backends")
+    parser.add_argument("--nprobe", type=_int_list, default=[8, 32], help="IVF lists probed per query")
+    parser.add_argument("--queries", type=int, default=200, help="Timed queries per configuration")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per encode/insert batch")
+    parser.add_argument("--model", default=None, help="Local SentenceTransformer path (default: hashing encoder)")
+    parser.add_argument("--dimension", type=int, default=384, help="Hashing encoder dimension")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--workdir", default=None, help="Where stores are created (default: a temp dir, removed afterwards)")
+    parser.add_argument("--keep", action="store_true", help="Keep the work directory / MySQL database")
+    parser.add_argument("--mysql-database", default=None, help="Throwaway database for the mysql backend")
+    parser.add_argument("--output", default=None,
+                        help="JSON output path (default: ./data/benchmarks/vector_store_<timestamp>.json, '-' for stdout)")
+    args = parser.parse_args(argv)
+
+    unknown = [backend for backend in args.backends if backend not in BACKENDS]
+    if unknown:
+        parser.error(f"Unknown backend(s): {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    report = run(args)
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(payload)
+        return 0
+    output = Path(args.output or f"./data/benchmarks/vector_store_{datetime.now():%Y%m%d_%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(payload, encoding="utf-8")
+    logger.info(f"Wrote {len(report['results'])} results to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,6 +26,8 @@ import tempfile
 from passlib.context import CryptContext
 from urllib.parse import urljoin, urlparse
 import mimetypes
+from src.core.retrieval import HybridRetriever
+from src.core.async_llm_engine import AsyncLLMEngine, ClientDisconnected, cancel_on_disconnect
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -407,6 +409,50 @@ def get_db_connection():
         logger.error(f"Database connection failed: {e}")
         raise HTTPException(status_code=500, detail="Database connection failed")
 
+# Knowledge base keyword retrieval (BM25 over the documents table, no LIKE scans)
+def _load_kb_document_texts(user_id: int):
+    """(document id, title + content) for every document the user owns"""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT id, title, content FROM documents WHERE user_id = ?", (user_id,)).fetchall()
+        return [(row['id'], f"{row['title'] or ''}\n{row['content'] or ''}") for row in rows]
+    finally:
+        conn.close()
+
+def _kb_documents_signature(user_id: int):
+    """(count, max id) of the user's documents, used to detect writes that bypass the index"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "SELECT COUNT(*) AS n, COALESCE(MAX(id), 0) AS max_id FROM documents WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        return (row['n'], row['max_id'])
+    finally:
+        conn.close()
+
+def _fetch_kb_documents(user_id: int, document_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Fetch display columns for the given document ids in one query"""
+    if not document_ids:
+        return {}
+    placeholders = ', '.join('?' * len(document_ids))
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            f"SELECT id, title, content, document_type, source, created_at FROM documents "
+            f"WHERE user_id = ? AND id IN ({placeholders})",
+            (user_id, *document_ids)
+        ).fetchall()
+        return {row['id']: dict(row) for row in rows}
+    finally:
+        conn.close()
+
+kb_retriever = HybridRetriever(
+    text_loader=_load_kb_document_texts,
+    fetch=_fetch_kb_documents,
+    signature_loader=_kb_documents_signature
+)
+
 # Conversation Memory Functions
 def save_conversation_message(user_id: int, session_id: str, message_type: str, message_content: str, context_data: Optional[Dict] = None):
     """Save a conversation message to memory"""
@@ -1366,22 +1412,13 @@ async def analyze_document_with_llm(document_text: str, analysis_type: str, user
         
         if llm_provider == 'openai':
             # Use OpenAI
-            import openai
-            openai.api_key = config.get('openai', {}).get('api_key')
-            
-            if not openai.api_key:
+            if not config.get('openai', {}).get('api_key'):
                 return {"error": "OpenAI API key not configured"}
-        elif llm_provider == 'ollama':
-            # Use Ollama
-            try:
-                from src.core.llm_engine import LLMEngine
-                llm_engine = LLMEngine(model_name=llm_model)
-            except Exception as e:
-                logger.error(f"Failed to initialize Ollama: {e}")
-                return {"error": f"Failed to initialize Ollama model {llm_model}. Please check if Ollama is running and the model is available."}
-        else:
+        elif llm_provider != 'ollama':
             return {"error": f"Unsupported LLM provider: {llm_provider}"}
         
+        llm_engine = AsyncLLMEngine(provider=llm_provider, model_name=llm_model, config=config)
+        
         # Create language-specific prompts
         language_instruction = ""
         if detected_language == "ar":
@@ -1401,7 +1438,7 @@ async def analyze_document_with_llm(document_text: str, analysis_type: str, user
 Please provide a comprehensive summary of the following legal document:
 
 Document Text:
-{document_text}
+{{document_text}}
 
 Please include:
 1. Document overview and main purpose
@@ -1420,7 +1457,7 @@ Format your response in clear, professional language suitable for legal professi
 Please extract and analyze the key points from the following legal document:
 
 Document Text:
-{document_text}
+{{document_text}}
 
 Please provide:
 1. **Main Legal Issues**: Identify the primary legal matters addressed
@@ -1440,7 +1477,7 @@ Focus on the most important elements that require immediate attention.
 Please identify and analyze the legal issues in the following document:
 
 Document Text:
-{document_text}
+{{document_text}}
 
 Please provide:
 1. **Primary Legal Issues**: Main legal matters that need attention
@@ -1461,7 +1498,7 @@ Focus on identifying potential legal problems and their solutions.
 Please perform a compliance check on the following document:
 
 Document Text:
-{document_text}
+{{document_text}}
 
 Please analyze:
 1. **Regulatory Compliance**: Does this comply with relevant laws and regulations?
@@ -1482,7 +1519,7 @@ Focus on ensuring the document meets all applicable requirements.
 Please provide a comprehensive legal analysis of the following document:
 
 Document Text:
-{document_text}
+{{document_text}}
 
 Please provide a complete analysis including:
 
@@ -1527,25 +1564,31 @@ Provide a thorough, professional analysis suitable for legal decision-making.
         
         # Get the appropriate prompt for the analysis type
         prompt = analysis_prompts.get(analysis_type, analysis_prompts["full_analysis"])
+        system_prompt = "You are DALI Legal AI, a specialized legal document analysis assistant."
+        max_tokens = int(user_settings.get('max_tokens', 2000)) if user else 2000
+        
+        # Trim the document to what fits the model's prompt budget
+        document_part = llm_engine.context_packer.fit(
+            document_text,
+            system_prompt=system_prompt,
+            instructions=prompt.replace("{document_text}", ""),
+            max_output_tokens=max_tokens
+        )
+        prompt = prompt.replace("{document_text}", document_part)
         
         # Perform analysis using the selected LLM provider
         if llm_provider == 'openai':
             # Perform analysis using OpenAI
-            client = openai.OpenAI(api_key=openai.api_key)
-            response = client.chat.completions.create(
-                model=llm_model,
-                messages=[
-                    {"role": "system", "content": "You are DALI Legal AI, a specialized legal document analysis assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=int(user_settings.get('max_tokens', 2000)) if user else 2000,
+            return await llm_engine.agenerate(
+                prompt,
+                system_prompt=system_prompt,
+                max_tokens=max_tokens,
                 temperature=float(user_settings.get('temperature', 0.3)) if user else 0.3
             )
-            return response.choices[0].message.content
         elif llm_provider == 'ollama':
             # Perform analysis using Ollama
             try:
-                response = llm_engine.generate_response(prompt)
+                response = await llm_engine.agenerate(prompt)
                 return response
             except Exception as e:
                 logger.error(f"Ollama analysis failed: {e}")
@@ -1593,6 +1636,7 @@ async def add_document_to_kb(user_id: int, filename: str, analysis_type: str, co
         conn.commit()
         cursor.close()
         conn.close()
+        kb_retriever.add(user_id, document_id, f"{filename}\n{content}")
         
         logger.info(f"Successfully added document to knowledge base: {filename} (ID: {document_id})")
         return True
@@ -2349,7 +2393,14 @@ async def legal_research_post(
         
         # Generate AI-powered legal research response with conversation context
         try:
-            research_result = await generate_legal_research_with_memory(query, user, jurisdiction, include_web_search, formatted_history, detected_language)
+            research_result = await cancel_on_disconnect(
+                request,
+                generate_legal_research_with_memory(query, user, jurisdiction, include_web_search, formatted_history, detected_language)
+            )
+        except ClientDisconnected:
+            # Nobody is waiting for the answer; don't spend more tokens or store an apology
+            logger.info(f"Client disconnected during legal research for session {session_id}")
+            return {"success": False, "error": "Client disconnected", "session_id": session_id}
         except Exception as e:
             logger.error(f"Error in generate_legal_research_with_memory: {str(e)}")
             logger.error(f"Error type: {type(e)}")
@@ -2839,8 +2890,7 @@ async def generate_key_insights(user: User = Depends(require_auth)):
         conn.close()
         
         # Generate AI insights
-        import openai
-        openai.api_key = config.get('openai', {}).get('api_key')
+        llm_engine = AsyncLLMEngine(provider='openai', model_name="gpt-4o", config=config)
         
         insights_prompt = f"""
         Based on the following document statistics from a legal knowledge base, provide key insights and recommendations:
@@ -2857,19 +2907,14 @@ async def generate_key_insights(user: User = Depends(require_auth)):
         Format the response in HTML with proper styling.
         """
         
-        response = openai.ChatCompletion.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": insights_prompt}],
-            max_tokens=1000,
-            temperature=0.7
-        )
+        insights = await llm_engine.agenerate(insights_prompt, system_prompt="", max_tokens=1000, temperature=0.7)
         
         analysis_html = f"""
         <div class="row">
             <div class="col-12">
                 <h5><i class="fas fa-lightbulb me-2"></i>AI-Generated Insights</h5>
                 <div class="alert alert-success">
-                    {response.choices[0].message.content}
+                    {insights}
                 </div>
             </div>
         </div>
@@ -3086,6 +3131,47 @@ async def get_user_llm_settings(user: User) -> dict:
             'max_tokens': '2000'
         }
 
+def fill_prompt_context(
+    llm_engine: AsyncLLMEngine,
+    prompt: str,
+    system_prompt: str,
+    max_tokens: int,
+    history: Optional[List[Dict]] = None,
+    kb_results: Optional[List[Dict]] = None,
+    history_heading: str = "\n\nPrevious conversation context:\n"
+) -> str:
+    """Fill a prompt's {context_summary} / {knowledge_base_context} placeholders within the model's token budget"""
+    kb_chunks = [
+        f"{i}. Document: {result.get('title')} (Type: {result.get('document_type')})\n"
+        f"Content: {result.get('content') or 'No content available'}"
+        for i, result in enumerate(kb_results or [], 1)
+    ]
+    history = [msg for msg in history or [] if isinstance(msg, dict) and msg.get('role') in ('user', 'assistant')]
+    # Oldest turns and lowest-ranked documents are trimmed or dropped first
+    packed = llm_engine.context_packer.pack(
+        "",
+        system_prompt=system_prompt,
+        history=history,
+        chunks=kb_chunks,
+        max_output_tokens=max_tokens,
+        instructions=prompt
+    )
+    
+    context_summary = ""
+    if packed.history:
+        context_summary = history_heading
+        for msg in packed.history:
+            role_label = "User" if msg['role'] == 'user' else "Assistant"
+            context_summary += f"{role_label}: {msg.get('content', '')}\n"
+    
+    knowledge_base_context = ""
+    if packed.chunks:
+        knowledge_base_context = "\n\nRELEVANT DOCUMENTS FROM YOUR KNOWLEDGE BASE:\n"
+        knowledge_base_context += "".join(f"\n{chunk}\n" for chunk in packed.chunks)
+        knowledge_base_context += "\nUse this information from your uploaded documents to provide more accurate and specific answers.\n"
+    
+    return prompt.replace("{context_summary}", context_summary).replace("{knowledge_base_context}", knowledge_base_context)
+
 async def generate_legal_research_with_memory(query: str, user: User, jurisdiction: str = "Saudi Arabia", include_web_search: str = "false", conversation_history: List[Dict] = None, language: str = "en") -> str:
     """Generate comprehensive legal research using AI with conversation memory and knowledge base access"""
     try:
@@ -3106,89 +3192,27 @@ async def generate_legal_research_with_memory(query: str, user: User, jurisdicti
         
         if llm_provider == 'openai':
             # Use OpenAI
-            import openai
-            openai.api_key = config.get('openai', {}).get('api_key')
-            
-            if not openai.api_key:
+            if not config.get('openai', {}).get('api_key'):
                 return "OpenAI API key not configured. Please contact administrator."
-        elif llm_provider == 'ollama':
-            # Use Ollama
-            try:
-                from src.core.llm_engine import LLMEngine
-                llm_engine = LLMEngine(model_name=llm_model)
-            except Exception as e:
-                logger.error(f"Failed to initialize Ollama: {e}")
-                return f"Failed to initialize Ollama model {llm_model}. Please check if Ollama is running and the model is available."
-        else:
+        elif llm_provider != 'ollama':
             return f"Unsupported LLM provider: {llm_provider}"
         
+        llm_engine = AsyncLLMEngine(provider=llm_provider, model_name=llm_model, config=config)
+        
         # Search knowledge base for relevant documents
-        knowledge_base_context = ""
+        kb_results = []
         try:
-            # Search documents directly from SQLite database
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Search for documents containing query keywords
-            search_terms = query.lower().split()
-            search_conditions = []
-            search_params = []
-            
-            for term in search_terms:
-                if len(term) > 2:  # Only search for terms longer than 2 characters
-                    search_conditions.append("(LOWER(title) LIKE ? OR LOWER(content) LIKE ?)")
-                    search_params.extend([f"%{term}%", f"%{term}%"])
+            # BM25 keyword retrieval over the user's documents (index kept in memory)
+            kb_results = kb_retriever.retrieve(user.id, query, k=5)
             
-            if search_conditions:
-                search_query = f"""
-                    SELECT id, title, content, document_type, created_at
-                    FROM documents 
-                    WHERE user_id = ? AND ({' OR '.join(search_conditions)})
-                    ORDER BY created_at DESC
-                    LIMIT 5
-                """
-                search_params.insert(0, user.id)
-                
-                cursor.execute(search_query, search_params)
-                kb_results = cursor.fetchall()
-                
-                if kb_results:
-                    knowledge_base_context = "\n\nRELEVANT DOCUMENTS FROM YOUR KNOWLEDGE BASE:\n"
-                    for i, result in enumerate(kb_results[:3], 1):  # Top 3 results
-                        doc_id, title, content, doc_type, created_at = result
-                        content_preview = content[:500] if content else "No content available"
-                        knowledge_base_context += f"\n{i}. Document: {title} (Type: {doc_type})\n"
-                        knowledge_base_context += f"Content Preview: {content_preview}...\n"
-                    
-                    knowledge_base_context += "\nUse this information from your uploaded documents to provide more accurate and specific answers.\n"
-                    logger.info(f"Found {len(kb_results)} relevant documents in knowledge base")
-                else:
-                    logger.info("No relevant documents found in knowledge base")
+            if kb_results:
+                logger.info(f"Found {len(kb_results)} relevant documents in knowledge base")
             else:
-                logger.info("Query too short for meaningful search")
-            
-            cursor.close()
-            conn.close()
+                logger.info("No relevant documents found in knowledge base")
                 
         except Exception as e:
             logger.error(f"Knowledge base search failed: {e}")
-            knowledge_base_context = ""
-        
-        # Build conversation context
-        context_summary = ""
-        if conversation_history and len(conversation_history) > 1:
-            try:
-                context_summary = "\n\nPrevious conversation context:\n"
-                for msg in conversation_history[:-1]:  # Exclude the current message
-                    if isinstance(msg, dict):
-                        if msg.get('role') == 'user':
-                            context_summary += f"User: {msg.get('content', '')}\n"
-                        elif msg.get('role') == 'assistant':
-                            content = msg.get('content', '')
-                            context_summary += f"Assistant: {content[:200]}...\n"  # Truncate for context
-            except Exception as e:
-                logger.error(f"Error processing conversation history: {e}")
-                context_summary = ""
+            kb_results = []
         
         # Create comprehensive legal research prompt with memory and language awareness
         language_instruction = ""
@@ -3207,8 +3231,8 @@ async def generate_legal_research_with_memory(query: str, user: User, jurisdicti
 
         Current Query: "{query}"
         Jurisdiction: {jurisdiction}
-        {context_summary}
-        {knowledge_base_context}
+        {{context_summary}}
+        {{knowledge_base_context}}
 
         CONVERSATION CONTEXT ANALYSIS:
         - If the user is asking for a chart after you've already suggested one, DON'T repeat the suggestion
@@ -3238,20 +3262,21 @@ async def generate_legal_research_with_memory(query: str, user: User, jurisdicti
         Provide a comprehensive legal analysis that addresses the user's query using both general legal knowledge and specific information from their uploaded documents when available.
         """
         
-        # Generate response using OpenAI
-        client = openai.OpenAI(api_key=openai.api_key)
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are DALI Legal AI, a specialized legal research assistant."},
-                {"role": "user", "content": research_prompt}
-            ],
+        system_prompt = "You are DALI Legal AI, a specialized legal research assistant."
+        # Previous turns exclude the current message
+        research_prompt = fill_prompt_context(
+            llm_engine, research_prompt, system_prompt, 2000,
+            history=(conversation_history or [])[:-1], kb_results=kb_results[:3]
+        )
+        
+        # Generate response with the user's provider
+        return await llm_engine.agenerate(
+            research_prompt,
+            system_prompt=system_prompt,
             max_tokens=2000,
             temperature=0.3
         )
         
-        return response.choices[0].message.content
-        
     except Exception as e:
         logger.error(f"Error in generate_legal_research_with_memory: {str(e)}")
         logger.error(f"Error type: {type(e)}")
@@ -3273,80 +3298,34 @@ async def generate_legal_research(query: str, user: User, jurisdiction: str = "S
         
         if llm_provider == 'openai':
             # Use OpenAI
-            import openai
-            openai.api_key = config.get('openai', {}).get('api_key')
-            
-            if not openai.api_key:
+            if not config.get('openai', {}).get('api_key'):
                 return "OpenAI API key not configured. Please contact administrator."
-        elif llm_provider == 'ollama':
-            # Use Ollama
-            try:
-                from src.core.llm_engine import LLMEngine
-                llm_engine = LLMEngine(model_name=llm_model)
-            except Exception as e:
-                logger.error(f"Failed to initialize Ollama: {e}")
-                return f"Failed to initialize Ollama model {llm_model}. Please check if Ollama is running and the model is available."
-        else:
+        elif llm_provider != 'ollama':
             return f"Unsupported LLM provider: {llm_provider}"
         
+        llm_engine = AsyncLLMEngine(provider=llm_provider, model_name=llm_model, config=config)
+        
         # Search knowledge base for relevant documents
-        knowledge_base_context = ""
+        kb_results = []
         try:
-            # Search documents directly from SQLite database
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Search for documents containing query keywords
-            search_terms = query.lower().split()
-            search_conditions = []
-            search_params = []
-            
-            for term in search_terms:
-                if len(term) > 2:  # Only search for terms longer than 2 characters
-                    search_conditions.append("(LOWER(title) LIKE ? OR LOWER(content) LIKE ?)")
-                    search_params.extend([f"%{term}%", f"%{term}%"])
+            # BM25 keyword retrieval over the user's documents (index kept in memory)
+            kb_results = kb_retriever.retrieve(user.id, query, k=5)
             
-            if search_conditions:
-                search_query = f"""
-                    SELECT id, title, content, document_type, created_at
-                    FROM documents 
-                    WHERE user_id = ? AND ({' OR '.join(search_conditions)})
-                    ORDER BY created_at DESC
-                    LIMIT 5
-                """
-                search_params.insert(0, user.id)
-                
-                cursor.execute(search_query, search_params)
-                kb_results = cursor.fetchall()
-                
-                if kb_results:
-                    knowledge_base_context = "\n\nRELEVANT DOCUMENTS FROM YOUR KNOWLEDGE BASE:\n"
-                    for i, result in enumerate(kb_results[:3], 1):  # Top 3 results
-                        doc_id, title, content, doc_type, created_at = result
-                        content_preview = content[:500] if content else "No content available"
-                        knowledge_base_context += f"\n{i}. Document: {title} (Type: {doc_type})\n"
-                        knowledge_base_context += f"Content Preview: {content_preview}...\n"
-                    
-                    knowledge_base_context += "\nUse this information from your uploaded documents to provide more accurate and specific answers.\n"
-                    logger.info(f"Found {len(kb_results)} relevant documents in knowledge base")
-                else:
-                    logger.info("No relevant documents found in knowledge base")
+            if kb_results:
+                logger.info(f"Found {len(kb_results)} relevant documents in knowledge base")
             else:
-                logger.info("Query too short for meaningful search")
-            
-            cursor.close()
-            conn.close()
+                logger.info("No relevant documents found in knowledge base")
                 
         except Exception as e:
             logger.error(f"Knowledge base search failed: {e}")
-            knowledge_base_context = ""
+            kb_results = []
         
         # Create comprehensive legal research prompt
         research_prompt = f"""
         As a conversational legal research assistant, please provide a comprehensive analysis of the following legal query:
 
         Query: "{query}"
-        {knowledge_base_context}
+        {{knowledge_base_context}}
 
         IMPORTANT INSTRUCTIONS:
         1. Be conversational and engaging in your response
@@ -3391,24 +3370,23 @@ async def generate_legal_research(query: str, user: User, jurisdiction: str = "S
         Format your response with clear headings, numbered lists, and bullet points. Use **bold** for important terms and concepts. Make it professional, conversational, and easy to read for legal professionals.
         """
         
+        system_prompt = "You are DALI Legal AI, a specialized legal research assistant."
+        max_tokens = int(user_settings.get('max_tokens', 2000))
+        research_prompt = fill_prompt_context(llm_engine, research_prompt, system_prompt, max_tokens, kb_results=kb_results[:3])
+        
         # Generate response using the selected LLM provider
         if llm_provider == 'openai':
             # Generate response using OpenAI
-            client = openai.OpenAI(api_key=openai.api_key)
-            response = client.chat.completions.create(
-                model=llm_model,
-                messages=[
-                    {"role": "system", "content": "You are DALI Legal AI, a specialized legal research assistant."},
-                    {"role": "user", "content": research_prompt}
-                ],
-                max_tokens=int(user_settings.get('max_tokens', 2000)),
+            return await llm_engine.agenerate(
+                research_prompt,
+                system_prompt=system_prompt,
+                max_tokens=max_tokens,
                 temperature=float(user_settings.get('temperature', 0.7))
             )
-            return response.choices[0].message.content
         elif llm_provider == 'ollama':
             # Generate response using Ollama
             try:
-                response = llm_engine.generate_response(research_prompt)
+                response = await llm_engine.agenerate(research_prompt)
                 return response
             except Exception as e:
                 logger.error(f"Ollama generation failed: {e}")
@@ -4035,17 +4013,14 @@ async def knowledge_base_query(
 ):
     """Knowledge base query endpoint - search documents using vector store"""
     try:
-        from src.core.vector_store import VectorStore
-        from src.web.app import user_store
-        
-        # Initialize vector store
-        vector_store = VectorStore()
+        # Reuse the app-wide stores (one shared encoder and Chroma client per process)
+        from src.web.app import user_store, vector_store
         
-        # Generate query embedding
-        query_embedding = vector_store._generate_embedding(query)
+        # Generate query embedding (micro-batched off the event loop)
+        query_embedding = await vector_store.agenerate_embedding(query)
         
         # Search for similar documents
-        results = user_store.search_documents(
+        results = user_store.search_chunks(
             user.id,
             query_embedding,
             top_k=num_results
@@ -4099,6 +4074,25 @@ async def knowledge_base_query(
             "timestamp": datetime.now().isoformat()
         }
 
+@app.get("/api/knowledge-base/stats")
+async def knowledge_base_stats(user: User = Depends(require_auth)):
+    """Exact knowledge base statistics from the maintained counters (no table scans)"""
+    try:
+        from src.web.app import get_knowledge_base_stats, vector_store
+        return {
+            "success": True,
+            "user": get_knowledge_base_stats(user.id),
+            "collection": vector_store.get_collection_stats(),
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Knowledge base stats failed: {str(e)}")
+        return {
+            "success": False,
+            "error": f"Knowledge base stats failed: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }
+
 @app.post("/api/knowledge-base/generate-chart")
 async def generate_chart(request: Request, user: User = Depends(require_auth)):
     """Generate chart from query results"""
@@ -4262,9 +4256,7 @@ async def health_check():
             openai_config = config.get('openai', {})
             if openai_config.get('api_key'):
                 # Quick test
-                from src.core.llm_engine import LLMEngine
-                llm_engine = LLMEngine()
-                llm_engine.analyze_document("Test", "summary")
+                await AsyncLLMEngine(config=config).aanalyze_document("Test", "summary")
                 openai_status = "working"
             else:
                 openai_status = "not_configured"
@@ -4323,11 +4315,8 @@ async def health_check():
 async def test_openai():
     """Test OpenAI connection"""
     try:
-        from src.core.llm_engine import LLMEngine
-        
         # Test OpenAI
-        llm_engine = LLMEngine()
-        result = llm_engine.analyze_document("Test", "summary")
+        result = await AsyncLLMEngine(config=config).aanalyze_document("Test", "summary")
         
         return {
             "success": True,
@@ -4549,7 +4538,12 @@ async def send_message(conversation_id: int, request: Request, user: User = Depe
         # Generate AI response if it's a user message
         ai_response = ""
         if role == "user":
-            ai_response = await generate_enhanced_ai_response(content, user, conversation_id)
+            try:
+                ai_response = await cancel_on_disconnect(request, generate_enhanced_ai_response(content, user, conversation_id))
+            except ClientDisconnected:
+                # Keep the user's message, skip the abandoned reply
+                logger.info(f"Client disconnected while generating reply for conversation {conversation_id}")
+                ai_response = ""
             if ai_response:
                 cursor.execute("""
                     INSERT INTO messages (conversation_id, user_id, role, content, timestamp, is_read)
@@ -4607,22 +4601,13 @@ async def generate_enhanced_ai_response(user_message: str, user: User, conversat
         
         if llm_provider == 'openai':
             # Use OpenAI
-            import openai
-            openai.api_key = config.get('openai', {}).get('api_key')
-            
-            if not openai.api_key:
+            if not config.get('openai', {}).get('api_key'):
                 return "OpenAI API key not configured. Please contact administrator."
-        elif llm_provider == 'ollama':
-            # Use Ollama
-            try:
-                from src.core.llm_engine import LLMEngine
-                llm_engine = LLMEngine(model_name=llm_model)
-            except Exception as e:
-                logger.error(f"Failed to initialize Ollama: {e}")
-                return f"Failed to initialize Ollama model {llm_model}. Please check if Ollama is running and the model is available."
-        else:
+        elif llm_provider != 'ollama':
             return f"Unsupported LLM provider: {llm_provider}"
         
+        llm_engine = AsyncLLMEngine(provider=llm_provider, model_name=llm_model, config=config)
+        
         # Get conversation history for context
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -4638,19 +4623,14 @@ async def generate_enhanced_ai_response(user_message: str, user: User, conversat
         cursor.close()
         conn.close()
         
-        # Build context from recent messages
-        context = ""
-        if recent_messages:
-            context = "Recent conversation context:\n"
-            for msg in reversed(recent_messages[-5:]):  # Last 5 messages for context
-                role_label = "User" if msg['role'] == 'user' else "Assistant"
-                context += f"{role_label}: {msg['content']}\n"
+        # Recent messages for context
+        history = [{'role': msg['role'], 'content': msg['content']} for msg in reversed(recent_messages[-5:])]
         
         # Enhanced prompt with context
         enhanced_prompt = f"""
 You are DALI Legal AI, a specialized legal assistant. You help users with legal research, document analysis, and legal questions.
 
-{context}
+{{context_summary}}
 
 Current user question: "{user_message}"
 
@@ -4664,24 +4644,26 @@ Please provide a comprehensive, helpful response that:
 If this is a legal question, provide specific guidance while noting that this is for informational purposes and users should consult qualified legal professionals for specific legal advice.
 """
         
+        system_prompt = "You are DALI Legal AI, a specialized legal assistant."
+        max_tokens = int(user_settings.get('max_tokens', 2000))
+        enhanced_prompt = fill_prompt_context(
+            llm_engine, enhanced_prompt, system_prompt, max_tokens,
+            history=history, history_heading="Recent conversation context:\n"
+        )
+        
         # Generate response using the selected LLM provider
         if llm_provider == 'openai':
             # Generate response using OpenAI
-            client = openai.OpenAI(api_key=openai.api_key)
-            response = client.chat.completions.create(
-                model=llm_model,
-                messages=[
-                    {"role": "system", "content": "You are DALI Legal AI, a specialized legal assistant."},
-                    {"role": "user", "content": enhanced_prompt}
-                ],
-                max_tokens=int(user_settings.get('max_tokens', 2000)),
+            return await llm_engine.agenerate(
+                enhanced_prompt,
+                system_prompt=system_prompt,
+                max_tokens=max_tokens,
                 temperature=float(user_settings.get('temperature', 0.7))
             )
-            return response.choices[0].message.content
         elif llm_provider == 'ollama':
             # Generate response using Ollama
             try:
-                response = llm_engine.generate_response(enhanced_prompt)
+                response = await llm_engine.agenerate(enhanced_prompt)
                 return response
             except Exception as e:
                 logger.error(f"Ollama generation failed: {e}")
@@ -6652,8 +6634,7 @@ async def delete_document(document_id: int, user: User = Depends(require_auth)):
         
         # Delete from vector store
         try:
-            from src.core.vector_store import VectorStore
-            vector_store = VectorStore()
+            from src.web.app import vector_store
             vector_store.delete_document(document_id)
         except Exception as e:
             logger.warning(f"Could not delete from vector store: {e}")
@@ -6664,6 +6645,7 @@ async def delete_document(document_id: int, user: User = Depends(require_auth)):
         conn.commit()
         cursor.close()
         conn.close()
+        kb_retriever.remove(user.id, [document_id])
         
         return {"success": True, "message": f"Document '{result['title']}' deleted successfully"}
         
@@ -8073,25 +8055,16 @@ async def generate_llm_response(prompt: str, llm_settings: dict) -> str:
     
     if llm_provider == 'openai':
         try:
-            import openai
-            config = load_config()
-            openai.api_key = config.get('openai', {}).get('api_key')
-            
-            response = openai.chat.completions.create(
-                model=llm_model,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=300,
-                temperature=0.7
-            )
-            return response.choices[0].message.content.strip()
+            llm_engine = AsyncLLMEngine(provider='openai', model_name=llm_model, config=load_config())
+            response = await llm_engine.agenerate(prompt, system_prompt="", max_tokens=300, temperature=0.7)
+            return response.strip()
         except Exception as e:
             logger.error(f"OpenAI error: {e}")
             return "The court acknowledges your statement. Please continue."
     else:
         try:
-            from src.core.llm_engine import LLMEngine
-            llm_engine = LLMEngine(model_name=llm_model)
-            response = llm_engine.generate_response(prompt)
+            llm_engine = AsyncLLMEngine(provider='ollama', model_name=llm_model, config=load_config())
+            response = await llm_engine.agenerate(prompt)
             return response.strip()
         except Exception as e:
             logger.error(f"Ollama error: {e}")
@@ -8146,27 +8119,17 @@ async def generate_judge_response(
     
     if llm_provider == 'openai':
         try:
-            import openai
-            # Set the API key from config
-            config = load_config()
-            openai.api_key = config.get('openai', {}).get('api_key')
-            
-            response = openai.chat.completions.create(
-                model=llm_model,
-                messages=[{"role": "user", "content": judge_prompt}],
-                max_tokens=200,
-                temperature=0.7
-            )
-            return response.choices[0].message.content.strip()
+            llm_engine = AsyncLLMEngine(provider='openai', model_name=llm_model, config=load_config())
+            response = await llm_engine.agenerate(judge_prompt, system_prompt="", max_tokens=200, temperature=0.7)
+            return response.strip()
         except Exception as e:
             logger.error(f"OpenAI error in judge response: {e}")
             return "Your Honor acknowledges your statement. Please continue with your argument."
     else:
         # Use Ollama
         try:
-            from src.core.llm_engine import LLMEngine
-            llm_engine = LLMEngine(model_name=llm_model)
-            response = llm_engine.generate_response(judge_prompt)
+            llm_engine = AsyncLLMEngine(provider='ollama', model_name=llm_model, config=load_config())
+            response = await llm_engine.agenerate(judge_prompt)
             return response.strip()
         except Exception as e:
             logger.error(f"Ollama error in judge response: {e}")
@@ -8221,27 +8184,17 @@ async def generate_prosecutor_response(
     
     if llm_provider == 'openai':
         try:
-            import openai
-            # Set the API key from config
-            config = load_config()
-            openai.api_key = config.get('openai', {}).get('api_key')
-            
-            response = openai.chat.completions.create(
-                model=llm_model,
-                messages=[{"role": "user", "content": prosecutor_prompt}],
-                max_tokens=200,
-                temperature=0.7
-            )
-            return response.choices[0].message.content.strip()
+            llm_engine = AsyncLLMEngine(provider='openai', model_name=llm_model, config=load_config())
+            response = await llm_engine.agenerate(prosecutor_prompt, system_prompt="", max_tokens=200, temperature=0.7)
+            return response.strip()
         except Exception as e:
             logger.error(f"OpenAI error in prosecutor response: {e}")
             return "The prosecution challenges that argument. Can you provide evidence to support your claim?"
     else:
         # Use Ollama
         try:
-            from src.core.llm_engine import LLMEngine
-            llm_engine = LLMEngine(model_name=llm_model)
-            response = llm_engine.generate_response(prosecutor_prompt)
+            llm_engine = AsyncLLMEngine(provider='ollama', model_name=llm_model, config=load_config())
+            response = await llm_engine.agenerate(prosecutor_prompt)
             return response.strip()
         except Exception as e:
             logger.error(f"Ollama error in prosecutor response: {e}")
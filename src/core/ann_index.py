@@ -0,0 +1,380 @@
+"""
+DALI Legal AI - ANN Index Module
+Persistent per-user IVF-flat approximate nearest neighbour index built on NumPy
+"""
+
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .embedding_index import UserEmbeddingIndex, normalize_vectors
+
+logger = logging.getLogger(__name__)
+
+ANN_FORMAT_VERSION = 1
+
+
+def default_nlist(n: int) -> int:
+    """Number of inverted lists for n vectors (~2*sqrt(n), at least 32 vectors per list)"""
+    return max(1, min(int(np.sqrt(n) * 2), n // 32))
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 8192) -> np.ndarray:
+    """Nearest (max inner product) centroid for each row, computed in blocks to bound memory"""
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 10, sample_per_list: int = 64, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of unit vectors"""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    nlist = max(1, min(nlist, n))
+    sample_size = min(n, nlist * sample_per_list)
+    sample = vectors[rng.choice(n, sample_size, replace=False)] if sample_size < n else vectors
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = assign_to_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists from random sample points
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_vectors(sums)
+    return np.ascontiguousarray(centroids, dtype=np.float32)
+
+
+class IVFFlatIndex(UserEmbeddingIndex):
+    """
+    Inverted-file index over a user's pre-normalised embeddings.
+
+    Vectors are assigned to the nearest of nlist centroids; a query scores
+    only the vectors in its nprobe closest lists. Corpora at or below
+    exact_threshold vectors, or not yet trained, are searched exactly.
+    """
+
+    def __init__(
+        self,
+        ids,
+        vectors: Optional[np.ndarray] = None,
+        dimension: Optional[int] = None,
+        nprobe: int = 8,
+        exact_threshold: int = 2048,
+        rebuild_threshold: float = 0.25
+    ):
+        super().__init__(ids, vectors, dimension)
+        self.nprobe = nprobe
+        self.exact_threshold = exact_threshold
+        self.rebuild_threshold = rebuild_threshold
+        self.centroids: Optional[np.ndarray] = None
+        self._assign = np.full(self._size, -1, dtype=np.int32)
+        self.trained_size = 0
+        self.changes_since_training = 0
+        self.changes_since_save = 0
+        self.on_change: Optional[Callable[["IVFFlatIndex"], None]] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def needs_training(self) -> bool:
+        """True when the corpus outgrew exact search or drifted since the last training"""
+        if self._size <= self.exact_threshold:
+            return False
+        if not self.is_trained:
+            return True
+        return self.changes_since_training > self.rebuild_threshold * max(self.trained_size, 1)
+
+    def search(self, query_embedding, top_k: int = 10, allowed_ids=None, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Return (document_id, cosine similarity) pairs, probing nprobe lists
+
+        With allowed_ids, a filtered subset small enough for exact search is
+        scanned directly; otherwise probed candidates are intersected with it.
+        """
+        with self._lock:
+            n = self._size
+            if n == 0 or top_k <= 0:
+                return []
+            query = normalize_vectors(np.asarray(query_embedding, dtype=np.float32).ravel())
+            if query.shape[0] != self.dimension:
+                logger.warning(
+                    f"Query dimension {query.shape[0]} does not match index dimension {self.dimension}"
+                )
+                return []
+
+            rows = self._allowed_rows(allowed_ids)
+            if rows is not None and (not self.is_trained or len(rows) <= self.exact_threshold):
+                scores = self._matrix[rows] @ query
+                ids = self._ids[rows]
+            elif not self.is_trained or n <= self.exact_threshold:
+                scores = self._matrix[:n] @ query
+                ids = self._ids[:n]
+            else:
+                nlist = len(self.centroids)
+                probe = max(1, min(nprobe or self.nprobe, nlist))
+                centroid_scores = self.centroids @ query
+                if probe < nlist:
+                    lists = np.argpartition(-centroid_scores, probe - 1)[:probe]
+                else:
+                    lists = np.arange(nlist)
+                assign = self._assign[:n]
+                # Unassigned rows (-1) are always scanned
+                probed = np.isin(assign, lists) | (assign < 0)
+                if rows is not None:
+                    mask = np.zeros(n, dtype=bool)
+                    mask[rows] = True
+                    probed &= mask
+                candidates = np.flatnonzero(probed)
+                scores = self._matrix[candidates] @ query
+                ids = self._ids[candidates]
+
+        return self._top_k(scores, ids, top_k)
+
+    def search_many(self, query_embeddings, top_k: int = 10, allowed_ids=None, nprobe: Optional[int] = None) -> List[List[Tuple[int, float]]]:
+        """Batch search; exact corpora use one matrix product, trained ones probe per query"""
+        if not self.is_trained or self._size <= self.exact_threshold or (
+            allowed_ids is not None and len(allowed_ids) <= self.exact_threshold
+        ):
+            return super().search_many(query_embeddings, top_k, allowed_ids)
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        return [self.search(query, top_k, allowed_ids, nprobe) for query in queries]
+
+    def add(self, doc_id: int, vector) -> bool:
+        """Append a vector and assign it to its nearest list"""
+        with self._lock:
+            if not super().add(doc_id, vector):
+                return False
+            if len(self._assign) < self._matrix.shape[0]:
+                grown = np.full(self._matrix.shape[0], -1, dtype=np.int32)
+                grown[:len(self._assign)] = self._assign
+                self._assign = grown
+            row = self._size - 1
+            if self.is_trained:
+                self._assign[row] = int(np.argmax(self.centroids @ self._matrix[row]))
+            else:
+                self._assign[row] = -1
+            self.changes_since_training += 1
+            self.changes_since_save += 1
+        self._notify()
+        return True
+
+    def remove(self, doc_ids: Iterable[int]) -> int:
+        """Drop rows for the given document ids"""
+        doc_ids = list(doc_ids)
+        with self._lock:
+            if self._size:
+                keep = ~np.isin(self._ids[:self._size], np.asarray(doc_ids, dtype=np.int64))
+                assign = self._assign[:self._size][keep]
+            removed = super().remove(doc_ids)
+            if removed:
+                self._assign = assign
+                self.changes_since_training += removed
+                self.changes_since_save += removed
+        if removed:
+            self._notify()
+        return removed
+
+    def _notify(self) -> None:
+        if self.on_change is not None:
+            try:
+                self.on_change(self)
+            except Exception as e:
+                logger.warning(f"ANN index change hook failed: {e}")
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Copy of (ids, vectors) for training outside the lock"""
+        with self._lock:
+            return self._ids[:self._size].copy(), self._matrix[:self._size].copy()
+
+    def install_training(self, centroids: Optional[np.ndarray], snapshot_ids: np.ndarray, snapshot_assign: np.ndarray) -> None:
+        """
+        Swap in new centroids. Rows present in the training snapshot reuse their
+        computed assignment; rows added since are assigned here.
+        """
+        with self._lock:
+            n = self._size
+            if centroids is None:
+                self.centroids = None
+                self._assign = np.full(self._matrix.shape[0], -1, dtype=np.int32)
+            else:
+                assign = np.full(self._matrix.shape[0], -1, dtype=np.int32)
+                current_ids = self._ids[:n]
+                order = np.argsort(snapshot_ids)
+                sorted_ids = snapshot_ids[order]
+                pos = np.searchsorted(sorted_ids, current_ids)
+                pos = np.clip(pos, 0, max(len(sorted_ids) - 1, 0))
+                found = (sorted_ids[pos] == current_ids) if len(sorted_ids) else np.zeros(n, dtype=bool)
+                assign[:n][found] = snapshot_assign[order][pos[found]]
+                missing = np.flatnonzero(~found)
+                if len(missing):
+                    assign[missing] = assign_to_centroids(self._matrix[missing], centroids)
+                self.centroids = centroids
+                self._assign = assign
+            self.trained_size = n
+            self.changes_since_training = 0
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Arrays needed to persist the index"""
+        with self._lock:
+            n = self._size
+            return {
+                "ids": self._ids[:n].copy(),
+                "vectors": self._matrix[:n].astype(np.float16),
+                "assign": self._assign[:n].copy(),
+                "centroids": self.centroids.copy() if self.is_trained else np.zeros((0, self.dimension or 0), dtype=np.float32),
+                "signature": np.asarray(self.signature, dtype=np.int64),
+                "trained_size": np.asarray(self.trained_size, dtype=np.int64),
+            }
+
+
+class AnnIndexManager:
+    """
+    Builds, persists and maintains per-user IVFFlatIndex objects.
+
+    Indexes are stored as user_<id>.npz under directory. Training and
+    persistence run on a single background worker so request threads only
+    ever do an exact scan or an nprobe lookup.
+    """
+
+    def __init__(
+        self,
+        directory: str = "./data/embeddings/ann_index",
+        nprobe: int = 8,
+        exact_threshold: int = 2048,
+        rebuild_threshold: float = 0.25,
+        persist_every: int = 256,
+        model_name: Optional[str] = None
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.nprobe = nprobe
+        self.exact_threshold = exact_threshold
+        self.rebuild_threshold = rebuild_threshold
+        self.persist_every = persist_every
+        self.model_name = model_name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ann-index")
+        self._pending: set = set()
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: int) -> Path:
+        return self.directory / f"user_{user_id}.npz"
+
+    def _new_index(self, ids, vectors, dimension) -> IVFFlatIndex:
+        return IVFFlatIndex(
+            ids, vectors, dimension,
+            nprobe=self.nprobe,
+            exact_threshold=self.exact_threshold,
+            rebuild_threshold=self.rebuild_threshold
+        )
+
+    def _attach(self, user_id: int, index: IVFFlatIndex) -> IVFFlatIndex:
+        index.on_change = lambda idx: self._on_change(user_id, idx)
+        return index
+
+    def build(self, user_id: int, ids: List[int], vectors: Optional[np.ndarray], dimension: Optional[int]) -> IVFFlatIndex:
+        """Cold build from database rows; searches exactly until background training finishes"""
+        return self._attach(user_id, self._new_index(ids, vectors, dimension))
+
+    def after_build(self, user_id: int, index: IVFFlatIndex) -> None:
+        """Schedule training (and a save) for a freshly loaded index"""
+        if index.needs_training():
+            self._schedule(user_id, index, retrain=True)
+        else:
+            self._schedule(user_id, index, retrain=False)
+
+    def restore(self, user_id: int, signature: Tuple[int, int]) -> Optional[IVFFlatIndex]:
+        """Load a persisted index if it matches the database signature and model"""
+        path = self._path(user_id)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("version") != ANN_FORMAT_VERSION or meta.get("model_name") != self.model_name:
+                    return None
+                if tuple(int(x) for x in data["signature"]) != tuple(signature):
+                    return None
+                ids = data["ids"]
+                vectors = data["vectors"].astype(np.float32)
+                index = self._new_index(ids, vectors if len(ids) else None, meta.get("dimension"))
+                index.install_training(
+                    data["centroids"] if len(data["centroids"]) else None,
+                    ids,
+                    data["assign"]
+                )
+                index.trained_size = int(data["trained_size"])
+            return self._attach(user_id, index)
+        except Exception as e:
+            logger.warning(f"Could not restore ANN index for user {user_id}: {e}")
+            return None
+
+    def save(self, user_id: int, index: IVFFlatIndex) -> None:
+        """Atomically persist the index to disk"""
+        state = index.state()
+        meta = {
+            "version": ANN_FORMAT_VERSION,
+            "model_name": self.model_name,
+            "dimension": index.dimension,
+        }
+        path = self._path(user_id)
+        tmp_path = path.with_suffix(".tmp.npz")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, meta=np.asarray(json.dumps(meta)), **state)
+        os.replace(tmp_path, path)
+        index.changes_since_save = 0
+
+    def delete(self, user_id: int) -> None:
+        """Remove a user's persisted index"""
+        try:
+            self._path(user_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _on_change(self, user_id: int, index: IVFFlatIndex) -> None:
+        if index.needs_training():
+            self._schedule(user_id, index, retrain=True)
+        elif index.changes_since_save >= self.persist_every:
+            self._schedule(user_id, index, retrain=False)
+
+    def _schedule(self, user_id: int, index: IVFFlatIndex, retrain: bool) -> None:
+        key = (user_id, retrain)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._run, user_id, index, retrain)
+
+    def _run(self, user_id: int, index: IVFFlatIndex, retrain: bool) -> None:
+        try:
+            if retrain:
+                self.train(user_id, index)
+            self.save(user_id, index)
+        except Exception as e:
+            logger.error(f"ANN index maintenance failed for user {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard((user_id, retrain))
+
+    def train(self, user_id: int, index: IVFFlatIndex) -> None:
+        """(Re)train centroids from a snapshot and install them without blocking searches"""
+        ids, vectors = index.snapshot()
+        if len(ids) <= index.exact_threshold:
+            index.install_training(None, ids, np.zeros(0, dtype=np.int32))
+            return
+        centroids = train_centroids(vectors, default_nlist(len(ids)))
+        assign = assign_to_centroids(vectors, centroids)
+        index.install_training(centroids, ids, assign)
+        logger.info(f"Trained ANN index for user {user_id}: {len(ids)} vectors in {len(centroids)} lists")
@@ -0,0 +1,254 @@
+"""
+DALI Legal AI - Async LLM Engine Module
+Non-blocking OpenAI/Ollama generation for async FastAPI handlers
+"""
+
+import asyncio
+import logging
+from contextlib import suppress
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, TypeVar
+
+from src.utils.config import load_config, get_llm_client_config
+from .llm_clients import get_async_openai_client, get_async_ollama_client
+from .llm_engine import LEGAL_SYSTEM_PROMPT, build_analysis_prompt, build_messages
+from .context_packer import ContextPacker, ContextInput
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away before the LLM call finished"""
+
+
+async def cancel_on_disconnect(request, awaitable: Awaitable[T], poll_interval: float = 0.5) -> T:
+    """
+    Await an LLM call, cancelling it if the HTTP client disconnects first
+
+    Args:
+        request: Starlette/FastAPI Request (anything with async is_disconnected())
+        awaitable: Coroutine or task to run
+        poll_interval: Seconds between disconnect checks
+
+    Raises:
+        ClientDisconnected: The client disconnected and the call was cancelled
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                with suppress(asyncio.CancelledError, Exception):
+                    await task
+                raise ClientDisconnected()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+
+class AsyncLLMEngine:
+    """
+    Async counterpart of LLMEngine.
+
+    Calls go through pooled AsyncOpenAI / ollama.AsyncClient instances, so a
+    single event loop can keep hundreds of completions in flight without
+    blocking other requests. Every call has a timeout (asyncio.TimeoutError
+    when exceeded) and is cancelled cleanly when its task is cancelled.
+    """
+
+    def __init__(
+        self,
+        provider: str = "openai",
+        model_name: Optional[str] = None,
+        config: Optional[Dict] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 2048,
+        timeout: Optional[float] = None
+    ):
+        self.config = config or load_config()
+        openai_cfg = self.config.get('openai', {})
+        ollama_cfg = self.config.get('ollama', {})
+        self.provider = provider if provider in ("openai", "ollama") else "openai"
+        if provider not in ("openai", "ollama"):
+            logger.warning(f"Unsupported LLM provider: {provider}, using OpenAI")
+        default_model = openai_cfg.get('model', 'gpt-4o') if self.provider == "openai" else ollama_cfg.get('model', 'llama3.2:1b')
+        self.model_name = model_name or default_model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.openai_api_key = openai_cfg.get('api_key')
+        self.openai_base_url = openai_cfg.get('base_url')
+        host = str(ollama_cfg.get('host', 'localhost')).split(':')[0]
+        self.ollama_url = f"http://{host}:{ollama_cfg.get('port', 11434)}"
+        self.client_options = get_llm_client_config()
+        self.timeout = float(timeout if timeout is not None else self.client_options['timeout'])
+        self.legal_system_prompt = LEGAL_SYSTEM_PROMPT
+        self.context_packer = ContextPacker(self.model_name, self.provider)
+
+    @staticmethod
+    def from_user_settings(user_settings: Optional[Dict], config: Optional[Dict] = None, timeout: Optional[float] = None) -> "AsyncLLMEngine":
+        """Engine for a user's llm_provider / llm_model / temperature / max_tokens settings"""
+        user_settings = user_settings or {}
+        return AsyncLLMEngine(
+            provider=user_settings.get('llm_provider', 'openai'),
+            model_name=user_settings.get('llm_model') or None,
+            config=config,
+            temperature=float(user_settings.get('temperature', 0.3)),
+            max_tokens=int(user_settings.get('max_tokens', 2048)),
+            timeout=timeout
+        )
+
+    def _build_messages(self, prompt, context, conversation_history, max_tokens, system_prompt) -> List[Dict]:
+        """Same packing as LLMEngine; system_prompt=None uses the legal prompt"""
+        return build_messages(
+            self.context_packer,
+            prompt,
+            context,
+            conversation_history,
+            max_tokens,
+            self.legal_system_prompt if system_prompt is None else system_prompt
+        )
+
+    def _sampling(self, max_tokens: Optional[int], temperature: Optional[float]):
+        return (
+            self.max_tokens if max_tokens is None else int(max_tokens),
+            self.temperature if temperature is None else float(temperature)
+        )
+
+    async def _complete(self, messages: List[Dict], max_tokens: int, temperature: float) -> str:
+        if self.provider == "ollama":
+            client = get_async_ollama_client(self.ollama_url, self.client_options)
+            response = await client.chat(
+                model=self.model_name,
+                messages=messages,
+                options={"temperature": temperature, "top_p": 0.9, "num_predict": max_tokens}
+            )
+            return response['message']['content']
+        client = get_async_openai_client(self.openai_api_key, self.openai_base_url, self.client_options)
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    async def agenerate(
+        self,
+        prompt: str,
+        context: ContextInput = None,
+        conversation_history: Optional[List[Dict]] = None,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        timeout: Optional[float] = None
+    ) -> str:
+        """
+        Generate a complete response without blocking the event loop
+
+        Args:
+            prompt: The user's question or instruction
+            context: Optional document context (text, or chunks best first)
+            conversation_history: Previous {"role", "content"} messages
+                (context and history are packed into the model's token budget)
+            system_prompt: Replaces the DALI legal system prompt when given ("" sends none)
+            max_tokens: Response limit (engine default when None)
+            temperature: Sampling temperature (engine default when None)
+            timeout: Seconds before asyncio.TimeoutError (engine default when None)
+
+        Returns:
+            Generated response text
+        """
+        max_tokens, temperature = self._sampling(max_tokens, temperature)
+        messages = self._build_messages(prompt, context, conversation_history, max_tokens, system_prompt)
+        return await asyncio.wait_for(
+            self._complete(messages, max_tokens, temperature),
+            self.timeout if timeout is None else timeout
+        )
+
+    async def _open_stream(self, messages: List[Dict], max_tokens: int, temperature: float):
+        if self.provider == "ollama":
+            client = get_async_ollama_client(self.ollama_url, self.client_options)
+            return await client.chat(
+                model=self.model_name,
+                messages=messages,
+                stream=True,
+                options={"temperature": temperature, "top_p": 0.9, "num_predict": max_tokens}
+            )
+        client = get_async_openai_client(self.openai_api_key, self.openai_base_url, self.client_options)
+        return await client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+
+    def _chunk_text(self, chunk) -> str:
+        if self.provider == "ollama":
+            return (chunk.get('message') or {}).get('content') or ""
+        if not chunk.choices:
+            return ""
+        return chunk.choices[0].delta.content or ""
+
+    async def astream(
+        self,
+        prompt: str,
+        context: ContextInput = None,
+        conversation_history: Optional[List[Dict]] = None,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """
+        Yield response fragments as they are generated
+
+        Takes the same arguments as agenerate(); timeout bounds the whole
+        stream. Closing the iterator (or cancelling its task) closes the
+        upstream HTTP stream.
+        """
+        max_tokens, temperature = self._sampling(max_tokens, temperature)
+        messages = self._build_messages(prompt, context, conversation_history, max_tokens, system_prompt)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.timeout if timeout is None else timeout)
+
+        stream = await asyncio.wait_for(self._open_stream(messages, max_tokens, temperature), deadline - loop.time())
+        iterator = stream.__aiter__()
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                text = self._chunk_text(chunk)
+                if text:
+                    yield text
+        finally:
+            close = getattr(stream, 'close', None) or getattr(stream, 'aclose', None)
+            if close is not None:
+                with suppress(Exception):
+                    result = close()
+                    if asyncio.iscoroutine(result):
+                        await result
+
+    async def aanalyze_document(self, document_text: str, analysis_type: str = "general", timeout: Optional[float] = None) -> str:
+        """
+        Analyze a legal document (async version of LLMEngine.analyze_document)
+
+        Args:
+            document_text: The text content of the document
+            analysis_type: Type of analysis (general, contract, litigation, compliance)
+            timeout: Seconds before asyncio.TimeoutError
+
+        Returns:
+            Analysis results
+        """
+        prompt = build_analysis_prompt(document_text, analysis_type, self.context_packer, self.legal_system_prompt, self.max_tokens)
+        return await self.agenerate(prompt, timeout=timeout)
@@ -0,0 +1,115 @@
+"""
+DALI Legal AI - Chunking Module
+Token-aware text chunking sized to the embedding model's sequence limit
+"""
+
+import re
+import logging
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Sentence ends for English and Arabic (؟ question mark, ؛ semicolon, ۔ full stop),
+# followed by whitespace; blank lines always end a sentence.
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?؟؛۔])\s+|\n\s*\n")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences, keeping punctuation and dropping empty pieces"""
+    return [piece.strip() for piece in _SENTENCE_END_RE.split(text or "") if piece and piece.strip()]
+
+
+class TokenAwareChunker:
+    """
+    Packs whole sentences into chunks that fit the encoder window.
+
+    Length is measured in the model's own word-pieces, so Arabic and English
+    chunks both use the full window rather than a fixed character count.
+    Sentences are tokenised in one batch call per document. A sentence that
+    is longer than the window on its own is cut on token boundaries using the
+    tokenizer's offset mapping. Consecutive chunks share up to overlap_tokens
+    of trailing sentences.
+
+    Exposes split_text() like the LangChain splitters it replaces.
+    """
+
+    def __init__(self, tokenizer, max_tokens: int = 128, overlap_tokens: int = 16, special_tokens: int = 2):
+        self.tokenizer = tokenizer
+        # Leave room for [CLS]/[SEP] (or <s>/</s>) added at encode time
+        self.budget = max(8, int(max_tokens) - int(special_tokens))
+        self.overlap_tokens = max(0, min(int(overlap_tokens), self.budget // 2))
+
+    def _token_lengths(self, sentences: List[str]) -> List[int]:
+        encoded = self.tokenizer(sentences, add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def _split_long_sentence(self, sentence: str) -> List[Tuple[str, int]]:
+        """Cut one over-long sentence into overlapping token windows"""
+        try:
+            encoded = self.tokenizer(sentence, add_special_tokens=False, return_offsets_mapping=True)
+            offsets = encoded["offset_mapping"]
+        except NotImplementedError:
+            # Slow tokenizers have no offsets; approximate with proportional character spans
+            length = len(self.tokenizer(sentence, add_special_tokens=False)["input_ids"]) or 1
+            per_token = len(sentence) / length
+            offsets = [(int(i * per_token), int((i + 1) * per_token)) for i in range(length)]
+        step = max(1, self.budget - self.overlap_tokens)
+        pieces = []
+        for start in range(0, len(offsets), step):
+            window = offsets[start:start + self.budget]
+            if not window:
+                break
+            piece = sentence[window[0][0]:window[-1][1]].strip()
+            if piece:
+                pieces.append((piece, len(window)))
+            if start + self.budget >= len(offsets):
+                break
+        return pieces
+
+    def split_text(self, text: str) -> List[str]:
+        """Split text into chunks of at most the token budget"""
+        sentences = split_sentences(text)
+        if not sentences:
+            return []
+
+        units: List[Tuple[str, int]] = []
+        for sentence, length in zip(sentences, self._token_lengths(sentences)):
+            if length > self.budget:
+                units.extend(self._split_long_sentence(sentence))
+            else:
+                units.append((sentence, length))
+
+        chunks: List[str] = []
+        current: List[Tuple[str, int]] = []
+        current_len = 0
+        for sentence, length in units:
+            if current and current_len + length > self.budget:
+                chunks.append(" ".join(s for s, _ in current))
+                # Carry trailing sentences into the next chunk as overlap
+                carried: List[Tuple[str, int]] = []
+                carried_len = 0
+                for prev in reversed(current):
+                    if carried_len + prev[1] > self.overlap_tokens or carried_len + prev[1] + length > self.budget:
+                        break
+                    carried.insert(0, prev)
+                    carried_len += prev[1]
+                current, current_len = carried, carried_len
+            current.append((sentence, length))
+            current_len += length
+        if current:
+            chunks.append(" ".join(s for s, _ in current))
+        return chunks
+
+
+def create_token_chunker(encoder, overlap_tokens: int = 16, max_tokens: Optional[int] = None) -> Optional[TokenAwareChunker]:
+    """
+    Build a chunker from a SentenceTransformer or ONNX encoder
+
+    Returns None when the encoder exposes no tokenizer, so callers can fall
+    back to character-based splitting.
+    """
+    tokenizer = getattr(encoder, "tokenizer", None)
+    if tokenizer is None:
+        return None
+    max_tokens = max_tokens or getattr(encoder, "max_seq_length", None) or 128
+    return TokenAwareChunker(tokenizer, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
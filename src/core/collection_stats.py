@@ -0,0 +1,205 @@
+"""
+DALI Legal AI - Collection Stats Module
+Maintained document/chunk/byte counters for a Chroma collection
+"""
+
+import os
+import json
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionStats:
+    """
+    Exact counters for a collection, updated on every add and delete.
+
+    Each Chroma entry is a chunk; an entry with chunk_index 0 (or none)
+    counts as a document. Type and source distributions count documents.
+    Counters are saved to a small JSON file so they survive restarts
+    without rescanning the collection. Several processes may share the
+    file: each update takes an exclusive lock on "<file>.lock", re-reads the
+    file, applies its change on top and writes it back, so concurrent
+    writers never overwrite each other's counts.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.document_types: Counter = Counter()
+        self.sources: Counter = Counter()
+        # Values as of the last read/write of the file; the difference is not saved yet
+        self._saved = self._snapshot()
+
+    @staticmethod
+    def _is_document(metadata: Dict[str, Any]) -> bool:
+        return int(metadata.get('chunk_index', 0) or 0) == 0
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {
+            'total_documents': self.documents,
+            'total_chunks': self.chunks,
+            'total_bytes': self.bytes,
+            'document_types': dict(self.document_types),
+            'sources': dict(self.sources),
+        }
+
+    def _set(self, data: Dict[str, Any]) -> None:
+        self.documents = int(data.get('total_documents', 0))
+        self.chunks = int(data.get('total_chunks', 0))
+        self.bytes = int(data.get('total_bytes', 0))
+        self.document_types = Counter(data.get('document_types', {}))
+        self.sources = Counter(data.get('sources', {}))
+
+    def _apply(self, metadatas: Sequence[Optional[Dict]], contents: Sequence[Optional[str]], sign: int) -> None:
+        for metadata, content in zip(metadatas, contents):
+            metadata = metadata or {}
+            self.chunks += sign
+            self.bytes += sign * len((content or '').encode('utf-8'))
+            if self._is_document(metadata):
+                self.documents += sign
+                self.document_types[metadata.get('document_type', 'unknown')] += sign
+                self.sources[metadata.get('source', 'unknown')] += sign
+        # Counter arithmetic drops zero and negative entries
+        self.document_types = +self.document_types
+        self.sources = +self.sources
+
+    def apply(self, metadatas: Sequence[Optional[Dict]], contents: Sequence[Optional[str]], sign: int = 1) -> None:
+        """Add (sign=1) or subtract (sign=-1) a set of entries"""
+        with self._lock:
+            self._update(lambda: self._apply(metadatas, contents, sign))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._update(lambda: self._set({}), replace=True)
+
+    def rebuild(self, pages: Iterable[Dict[str, Any]]) -> None:
+        """Recount from Chroma get() pages holding metadatas and documents, replacing the saved counters"""
+        def recount():
+            self._set({})
+            for page in pages:
+                self._apply(page.get('metadatas') or [], page.get('documents') or [], 1)
+
+        with self._lock:
+            self._update(recount, replace=True)
+
+    def is_consistent(self) -> bool:
+        """Whether the distributions add up to the document count (a cheap check for drift)"""
+        with self._lock:
+            return (
+                0 <= self.documents <= self.chunks and self.bytes >= 0
+                and sum(self.document_types.values()) == self.documents
+                and sum(self.sources.values()) == self.documents
+            )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Current counters, including changes saved by other processes"""
+        with self._lock:
+            self._refresh()
+            return self._snapshot()
+
+    def _refresh(self) -> None:
+        """Pick up the file's counters, keeping any unsaved changes of this process"""
+        on_disk = self._read(self.path) if self.path else None
+        if on_disk is None:
+            return
+        merged = self._merge(on_disk, self._snapshot(), self._saved)
+        self._set(on_disk)
+        self._saved = self._snapshot()
+        self._set(merged)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared with other processes using the same file (no-op without fcntl)"""
+        if not FCNTL_AVAILABLE:
+            yield
+            return
+        with open(self.path.with_suffix('.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _update(self, change, replace: bool = False) -> None:
+        """
+        Apply change() to the counters and write them atomically under the file lock
+
+        Unless replace is set, the file's current values (other processes'
+        changes) are read first, so change() applies on top of them.
+        """
+        if self.path is None:
+            change()
+            return
+        applied = False
+        try:
+            with self._file_lock():
+                if not replace:
+                    self._refresh()
+                change()
+                applied = True
+                self._write()
+        except Exception as e:
+            logger.warning(f"Could not save collection stats to {self.path}: {e}")
+            if not applied:
+                change()
+
+    def _write(self) -> None:
+        data = self._snapshot()
+        tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps(data))
+        os.replace(tmp_path, self.path)
+        self._saved = data
+
+    def save(self) -> None:
+        """Write the counters, merged with the file's (no-op without a path)"""
+        with self._lock:
+            self._update(lambda: None)
+
+    @staticmethod
+    def _merge(on_disk: Dict[str, Any], current: Dict[str, Any], saved: Dict[str, Any]) -> Dict[str, Any]:
+        """on_disk plus (current - saved), field by field"""
+        merged = {}
+        for key in ('total_documents', 'total_chunks', 'total_bytes'):
+            merged[key] = int(on_disk.get(key, 0)) + current[key] - saved[key]
+        for key in ('document_types', 'sources'):
+            counts = Counter(on_disk.get(key, {}))
+            counts.update(current[key])
+            counts.subtract(saved[key])
+            merged[key] = dict(+counts)
+        return merged
+
+    @staticmethod
+    def _read(path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(Path(path).read_text())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable collection stats {path}: {e}")
+            return None
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["CollectionStats"]:
+        """Counters saved by save(), or None if missing or unreadable"""
+        data = cls._read(path)
+        if data is None:
+            return None
+        stats = cls(path)
+        stats._set(data)
+        stats._saved = stats._snapshot()
+        return stats
@@ -0,0 +1,334 @@
+"""
+DALI Legal AI - Context Packer Module
+Fits system prompt, conversation history, retrieved chunks and the question into a per-model token budget
+"""
+
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from src.utils.config import get_context_budget_config
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Context windows by model-name prefix (longest prefix wins)
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4o': 128000,
+    'gpt-4.1': 1047576,
+    'gpt-4-turbo': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'o1': 200000,
+    'o3': 200000,
+    'o4': 200000,
+    'llama3.1': 131072,
+    'llama3.2': 131072,
+    'llama3': 8192,
+    'llama2': 4096,
+    'mistral': 32768,
+}
+
+# Chat formats add a few tokens per message for role markers
+MESSAGE_OVERHEAD_TOKENS = 4
+TRIM_MARKER = " …"
+
+ContextInput = Union[None, str, Sequence[Union[str, Dict[str, Any]]]]
+
+
+@lru_cache(maxsize=16)
+def _encoding(model_name: str):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base" if model_name.startswith(("gpt-4o", "gpt-4.1", "o")) else "cl100k_base")
+
+
+def approximate_tokens(text: str) -> int:
+    """
+    Fast token estimate without a tokenizer
+
+    About four characters per token for Latin script and two for Arabic
+    (non-ASCII characters are counted from the UTF-8 length), which errs
+    on the high side for BPE tokenizers.
+    """
+    if not text:
+        return 0
+    non_ascii = min(len(text.encode('utf-8')) - len(text), len(text))
+    return int((len(text) - non_ascii) / 4 + non_ascii / 2) + 1
+
+
+@dataclass
+class PackedContext:
+    """Result of ContextPacker.pack()"""
+    question: str
+    history: List[Dict[str, Any]]
+    chunks: List[Union[str, Dict[str, Any]]]
+    tokens: int
+    budget: int
+    dropped: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def context(self) -> str:
+        """Kept chunks joined into one context string"""
+        return "\n\n".join(_chunk_text(chunk) for chunk in self.chunks)
+
+    def summary(self) -> str:
+        """One-line description of what was dropped or trimmed"""
+        if not self.dropped:
+            return f"{self.tokens}/{self.budget} tokens, nothing dropped"
+        parts = []
+        for kind in ("history", "chunk", "question"):
+            for action in ("dropped", "trimmed"):
+                items = [d for d in self.dropped if d['kind'] == kind and d['action'] == action]
+                if items:
+                    saved = sum(d['tokens'] - d['kept_tokens'] for d in items)
+                    parts.append(f"{action} {len(items)} {kind} item(s) (-{saved} tokens)")
+        return f"{self.tokens}/{self.budget} tokens, " + ", ".join(parts)
+
+
+def _chunk_text(chunk: Union[str, Dict[str, Any]]) -> str:
+    return chunk if isinstance(chunk, str) else str(chunk.get('content') or '')
+
+
+def _with_text(chunk: Union[str, Dict[str, Any]], text: str) -> Union[str, Dict[str, Any]]:
+    return text if isinstance(chunk, str) else {**chunk, 'content': text}
+
+
+class ContextPacker:
+    """
+    Token-budgeted prompt assembly for one model.
+
+    The prompt budget is the model's context window minus the response
+    allowance, capped at max_prompt_tokens. The system prompt, fixed
+    instructions, leading system messages in the history (such as a
+    conversation summary) and the question are always kept (the question is
+    trimmed in the middle only if it alone overflows). What is left is shared
+    between history (history_share) and retrieved chunks; either side's
+    unused share goes to the other. Lowest-value items go first: the oldest
+    history messages and the lowest-ranked chunks. Chunks are also capped
+    at max_chunk_tokens each. Everything dropped or trimmed is reported in
+    PackedContext.dropped.
+    """
+
+    def __init__(self, model_name: str, provider: Optional[str] = None, options: Optional[Dict[str, Any]] = None):
+        self.model_name = model_name or ''
+        self.provider = provider or ('openai' if self.model_name.startswith(('gpt', 'o1', 'o3', 'o4')) else 'ollama')
+        self.options = options or get_context_budget_config()
+        self._tokenizer = _encoding(self.model_name) if TIKTOKEN_AVAILABLE and self.provider == 'openai' else None
+
+    @property
+    def context_window(self) -> int:
+        windows = {**MODEL_CONTEXT_WINDOWS, **self.options['model_context_windows']}
+        matches = [prefix for prefix in windows if self.model_name.startswith(prefix)]
+        window = windows[max(matches, key=len)] if matches else self.options['default_context_window']
+        if self.provider == 'ollama':
+            # Ollama truncates at num_ctx whatever the model supports
+            window = min(window, self.options['ollama_context_window'])
+        return int(window)
+
+    def prompt_budget(self, max_output_tokens: int = 2048) -> int:
+        """Tokens available for the prompt when max_output_tokens are reserved for the answer"""
+        window_budget = self.context_window - int(max_output_tokens)
+        return max(min(window_budget, self.options['max_prompt_tokens']), self.options['min_item_tokens'])
+
+    def count(self, text: str) -> int:
+        """Token count of text (model tokenizer when available, otherwise an estimate)"""
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, disallowed_special=()))
+        return approximate_tokens(text)
+
+    def trim(self, text: str, max_tokens: int, keep: str = "head") -> str:
+        """
+        Cut text to at most max_tokens
+
+        Args:
+            text: Text to shorten
+            max_tokens: Token limit, including the trim marker
+            keep: "head" keeps the beginning, "middle" keeps both ends
+        """
+        if self.count(text) <= max_tokens:
+            return text
+        limit = max(max_tokens - self.count(TRIM_MARKER), 0)
+        if self._tokenizer is not None:
+            tokens = self._tokenizer.encode(text, disallowed_special=())
+            if keep == "middle":
+                head = limit // 2
+                return self._tokenizer.decode(tokens[:head]) + TRIM_MARKER + self._tokenizer.decode(tokens[len(tokens) - (limit - head):])
+            return self._tokenizer.decode(tokens[:limit]) + TRIM_MARKER
+
+        # Estimate the cut from the token density, then shrink until it fits
+        chars = int(len(text) * limit / max(self.count(text), 1))
+        while chars > 0:
+            if keep == "middle":
+                candidate = text[:chars // 2] + TRIM_MARKER + text[len(text) - (chars - chars // 2):]
+            else:
+                candidate = text[:chars] + TRIM_MARKER
+            if self.count(candidate) <= max_tokens:
+                return candidate
+            chars = int(chars * 0.9)
+        return ""
+
+    def fit(self, text: str, system_prompt: str = "", instructions: str = "", max_output_tokens: int = 2048) -> str:
+        """
+        Trim a document to the room left once system prompt and instructions are counted
+
+        Args:
+            text: Document text placed inside the instructions
+            system_prompt: System message text sent with the prompt
+            instructions: The rest of the prompt around the document
+            max_output_tokens: Tokens reserved for the answer
+        """
+        messages = 2 if system_prompt else 1
+        room = (self.prompt_budget(max_output_tokens) - self.count(system_prompt)
+                - self.count(instructions) - messages * MESSAGE_OVERHEAD_TOKENS)
+        fitted = self.trim(text, max(room, self.options['min_item_tokens']))
+        if fitted is not text:
+            logger.info(f"Context packed for {self.model_name}: trimmed document from {self.count(text)} to {self.count(fitted)} tokens")
+        return fitted
+
+    def pack(
+        self,
+        question: str,
+        system_prompt: str = "",
+        history: Optional[Sequence[Dict[str, Any]]] = None,
+        chunks: ContextInput = None,
+        max_output_tokens: int = 2048,
+        instructions: str = ""
+    ) -> PackedContext:
+        """
+        Select and trim history and chunks so the whole prompt fits the budget
+
+        Args:
+            question: The user's question (always kept)
+            system_prompt: System message text (always kept)
+            history: Previous {"role", "content"} messages, oldest first;
+                leading "system" messages are pinned (never dropped)
+            chunks: Retrieved context, best first - a string or a list of
+                strings / dicts with a "content" key
+            max_output_tokens: Tokens reserved for the answer
+            instructions: Fixed prompt text the caller adds around the
+                packed parts (counted, not returned)
+
+        Returns:
+            PackedContext with the kept history and chunks, the token total
+            and the list of dropped/trimmed items
+        """
+        budget = self.prompt_budget(max_output_tokens)
+        history = list(history or [])
+        if chunks is None:
+            chunks = []
+        elif isinstance(chunks, str):
+            chunks = [chunks] if chunks else []
+        else:
+            chunks = [chunk for chunk in chunks if _chunk_text(chunk)]
+        dropped: List[Dict[str, Any]] = []
+
+        # Leading system messages (e.g. the conversation summary) are pinned like the system prompt
+        pinned_count = 0
+        while pinned_count < len(history) and history[pinned_count].get('role') == 'system':
+            pinned_count += 1
+        pinned, history = history[:pinned_count], history[pinned_count:]
+
+        # Mandatory parts: system prompt, pinned history, instructions, question
+        messages = (2 if system_prompt else 1) + len(pinned)
+        fixed = self.count(system_prompt) + self.count(instructions) + messages * MESSAGE_OVERHEAD_TOKENS
+        fixed += sum(self.count(str(msg.get('content') or '')) for msg in pinned)
+        question_tokens = self.count(question)
+        if fixed + question_tokens > budget:
+            allowed = max(budget - fixed, self.options['min_item_tokens'])
+            question = self.trim(question, allowed, keep="middle")
+            kept = self.count(question)
+            dropped.append({'kind': 'question', 'index': 0, 'action': 'trimmed', 'tokens': question_tokens, 'kept_tokens': kept})
+            question_tokens = kept
+        free = max(budget - fixed - question_tokens, 0)
+
+        history_costs = [self.count(str(msg.get('content') or '')) + MESSAGE_OVERHEAD_TOKENS for msg in history]
+        chunk_costs = [self.count(_chunk_text(chunk)) for chunk in chunks]
+        history_need = sum(history_costs)
+        chunk_need = sum(min(cost, self.options['max_chunk_tokens']) for cost in chunk_costs)
+
+        history_allowance = int(free * self.options['history_share'])
+        chunk_allowance = free - history_allowance
+        if history_need < history_allowance:
+            chunk_allowance += history_allowance - history_need
+            history_allowance = history_need
+        elif chunk_need < chunk_allowance:
+            history_allowance += chunk_allowance - chunk_need
+            chunk_allowance = chunk_need
+
+        kept_chunks, chunk_used = self._pack_chunks(chunks, chunk_costs, chunk_allowance, dropped)
+        # Chunks that came in under their allowance leave room for history
+        history_allowance += max(chunk_allowance - chunk_used, 0)
+        kept_history, history_used = self._pack_history(history, history_costs, history_allowance, dropped)
+        for report in dropped:
+            if report['kind'] == 'history':
+                report['index'] += pinned_count
+        kept_history = pinned + kept_history
+
+        packed = PackedContext(
+            question=question,
+            history=kept_history,
+            chunks=kept_chunks,
+            tokens=fixed + question_tokens + chunk_used + history_used,
+            budget=budget,
+            dropped=dropped
+        )
+        if dropped:
+            logger.info(f"Context packed for {self.model_name}: {packed.summary()}")
+        return packed
+
+    def _pack_chunks(self, chunks, costs, allowance: int, dropped: List[Dict[str, Any]]):
+        kept, used = [], 0
+        cap = self.options['max_chunk_tokens']
+        separator = self.count("\n\n")
+        for index, (chunk, cost) in enumerate(zip(chunks, costs)):
+            room = min(allowance - used - (separator if kept else 0), cap)
+            if cost <= room:
+                kept.append(chunk)
+                used += cost + (separator if kept[:-1] else 0)
+                continue
+            report = {'kind': 'chunk', 'index': index, 'tokens': cost}
+            if isinstance(chunk, dict) and chunk.get('title'):
+                report['title'] = chunk['title']
+            if room >= self.options['min_item_tokens']:
+                text = self.trim(_chunk_text(chunk), room)
+                kept_tokens = self.count(text)
+                kept.append(_with_text(chunk, text))
+                used += kept_tokens + (separator if kept[:-1] else 0)
+                dropped.append({**report, 'action': 'trimmed', 'kept_tokens': kept_tokens})
+            else:
+                dropped.append({**report, 'action': 'dropped', 'kept_tokens': 0})
+        return kept, used
+
+    def _pack_history(self, history, costs, allowance: int, dropped: List[Dict[str, Any]]):
+        # Newest messages are worth most; walk backwards and stop at the first one that does not fit
+        kept, used = [], 0
+        exhausted = False
+        for index in range(len(history) - 1, -1, -1):
+            message, cost = history[index], costs[index]
+            report = {'kind': 'history', 'index': index, 'role': message.get('role'), 'tokens': cost}
+            room = allowance - used
+            if not exhausted and cost <= room:
+                kept.append(message)
+                used += cost
+                continue
+            if not exhausted and room - MESSAGE_OVERHEAD_TOKENS >= self.options['min_item_tokens']:
+                text = self.trim(str(message.get('content') or ''), room - MESSAGE_OVERHEAD_TOKENS)
+                kept_tokens = self.count(text) + MESSAGE_OVERHEAD_TOKENS
+                kept.append({**message, 'content': text})
+                used += kept_tokens
+                dropped.append({**report, 'action': 'trimmed', 'kept_tokens': kept_tokens})
+            else:
+                dropped.append({**report, 'action': 'dropped', 'kept_tokens': 0})
+            exhausted = True
+        kept.reverse()
+        return kept, used
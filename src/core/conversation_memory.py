@@ -0,0 +1,139 @@
+"""
+DALI Legal AI - Conversation Memory Module
+Rolling per-conversation summary plus the most recent turns, updated in the background
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain the running memory of a legal research conversation. "
+    "Merge the new messages into the existing summary. Keep facts, parties, dates, amounts, "
+    "jurisdictions, documents referred to, the user's goals, conclusions reached and open questions. "
+    "Drop greetings and repetition. Write in the language of the conversation and output only the summary."
+)
+SUMMARY_HEADING = "Summary of the earlier conversation:"
+
+
+def build_summary_prompt(summary: str, messages: List[Dict[str, Any]], max_words: int) -> str:
+    """Prompt asking for summary updated with messages (conversation_messages rows)"""
+    transcript = "\n".join(
+        f"{'User' if m['sender_type'] == 'user' else 'Assistant'}: {m['message']}" for m in messages
+    )
+    return (
+        f"Current summary:\n{summary or '(none yet)'}\n\n"
+        f"New messages:\n{transcript}\n\n"
+        f"Return the updated summary in at most {max_words} words."
+    )
+
+
+class ConversationMemory:
+    """
+    Prompt history for long conversations: a stored summary plus recent turns.
+
+    The newest recent_messages messages are always sent verbatim. Once
+    summarize_threshold older messages are not yet summarized, schedule()
+    folds them (at most max_fold_messages per LLM call) into the summary
+    stored on the conversation, on a background thread. history() returns
+    the summary and at most recent_messages + summarize_threshold messages,
+    so per-turn prompt size stays flat however long the conversation gets.
+
+    store is a MySQLVectorStore (get_conversation_memory,
+    get_unsummarized_messages, update_conversation_summary); the engine
+    passed to schedule() needs complete(prompt, system_prompt, max_tokens).
+    """
+
+    def __init__(
+        self,
+        store,
+        recent_messages: int = 6,
+        summarize_threshold: int = 6,
+        max_fold_messages: int = 20,
+        summary_max_tokens: int = 500,
+        max_workers: int = 1
+    ):
+        self.store = store
+        self.recent_messages = max(1, int(recent_messages))
+        self.summarize_threshold = max(1, int(summarize_threshold))
+        self.max_fold_messages = max(self.summarize_threshold, int(max_fold_messages))
+        self.summary_max_tokens = int(summary_max_tokens)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="conversation-memory")
+        self._pending: set = set()
+        self._lock = threading.Lock()
+
+    def history(self, conversation_id: int, skip_latest: int = 0) -> List[Dict[str, str]]:
+        """
+        Conversation history for the prompt
+
+        Args:
+            conversation_id: Conversation to read
+            skip_latest: Newest messages to leave out (e.g. the question just saved)
+
+        Returns:
+            {"role", "content"} messages: the summary (as a leading system
+            message, which ContextPacker pins) when there is one, then the
+            unsummarized messages, oldest first
+        """
+        memory = self.store.get_conversation_memory(
+            conversation_id, self.recent_messages + self.summarize_threshold, skip_latest
+        )
+        history = []
+        if memory['summary']:
+            history.append({"role": "system", "content": f"{SUMMARY_HEADING}\n{memory['summary']}"})
+        history.extend({"role": m['sender_type'], "content": m['message']} for m in memory['messages'])
+        return history
+
+    def schedule(self, conversation_id: int, llm_engine) -> Optional[Future]:
+        """Update the summary in the background; None if an update is already queued"""
+        with self._lock:
+            if conversation_id in self._pending:
+                return None
+            self._pending.add(conversation_id)
+        try:
+            return self._executor.submit(self._run, conversation_id, llm_engine)
+        except RuntimeError:
+            # Executor shut down
+            with self._lock:
+                self._pending.discard(conversation_id)
+            return None
+
+    def _run(self, conversation_id: int, llm_engine) -> int:
+        try:
+            return self.update(conversation_id, llm_engine)
+        except Exception as e:
+            logger.warning(f"Conversation {conversation_id} summary update failed: {e}")
+            return 0
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+    def update(self, conversation_id: int, llm_engine) -> int:
+        """
+        Fold older messages into the summary until fewer than summarize_threshold remain
+
+        Returns:
+            Number of messages folded
+        """
+        folded = 0
+        while True:
+            state = self.store.get_unsummarized_messages(conversation_id, self.recent_messages, self.max_fold_messages)
+            messages = state['messages']
+            if len(messages) < self.summarize_threshold:
+                return folded
+            prompt = build_summary_prompt(state['summary'], messages, max(self.summary_max_tokens * 3 // 4, 50))
+            summary = llm_engine.complete(prompt, system_prompt=SUMMARY_SYSTEM_PROMPT, max_tokens=self.summary_max_tokens)
+            if not summary:
+                return folded
+            if not self.store.update_conversation_summary(conversation_id, summary, messages[-1]['id'], state['summary_through_id']):
+                # Another worker moved the summary on; its result stands
+                return folded
+            folded += len(messages)
+            logger.info(f"Conversation {conversation_id}: folded {len(messages)} messages into the summary")
+
+    def close(self, wait: bool = False) -> None:
+        """Stop the background worker (queued updates are dropped unless wait is True)"""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,128 @@
+"""
+DALI Legal AI - Query Embedding Cache Module
+Thread-safe LRU cache of query embeddings keyed by (model name, normalised text)
+"""
+
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query_text(text: str) -> str:
+    """NFC-normalise and collapse whitespace; case is kept because the encoders are cased"""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def content_hash(text: str, model_name: Optional[str] = None) -> str:
+    """SHA-256 of the normalised text and the model it is embedded with (content-addressed chunk key)"""
+    key = f"{model_name or ''}\x00{normalize_query_text(text)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class QueryEmbeddingCache:
+    """
+    Size-bounded LRU cache of embeddings with an optional TTL.
+
+    Entries are stored as tuples so a cached vector can never be mutated by
+    a caller; lookups return a fresh list.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Tuple[float, ...]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(model_name: str, text: str) -> Tuple[str, str]:
+        return (model_name, normalize_query_text(text))
+
+    def get(self, model_name: str, text: str) -> Optional[List[float]]:
+        """Return the cached embedding, or None on a miss or expired entry"""
+        key = self._key(model_name, text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, vector = entry
+                if self.ttl_seconds is None or time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return list(vector)
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, model_name: str, text: str, embedding) -> None:
+        """Store an embedding, evicting the least recently used entries"""
+        key = self._key(model_name, text)
+        vector = tuple(float(x) for x in embedding)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, model_name: str, text: str, compute: Callable[[str], Any]) -> List[float]:
+        """
+        Return the cached embedding or compute, cache and return it
+
+        Args:
+            model_name: Embedding model the vector belongs to
+            text: Query text (normalised for the key only; compute sees the original)
+            compute: Callable producing the embedding on a miss
+
+        Returns:
+            Embedding as a list of floats
+        """
+        cached = self.get(model_name, text)
+        if cached is not None:
+            return cached
+        embedding = compute(text)
+        embedding = embedding.tolist() if hasattr(embedding, "tolist") else list(embedding)
+        self.put(model_name, text, embedding)
+        return embedding
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+_shared_cache: Optional[QueryEmbeddingCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_query_embedding_cache(max_entries: int = 1024, ttl_seconds: Optional[float] = None) -> QueryEmbeddingCache:
+    """
+    Process-wide cache shared by every VectorStore.
+
+    The size and TTL of the first call win; later calls return the same instance.
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = QueryEmbeddingCache(max_entries, ttl_seconds)
+        return _shared_cache
@@ -0,0 +1,107 @@
+"""
+DALI Legal AI - Embedding Codec Module
+Versioned, pre-normalised and optionally quantised embedding blobs for MySQL storage
+"""
+
+import struct
+import logging
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Blob layout (little-endian):
+#   MAGIC | version:u8 | dtype:u8 | model_len:u16 | dimension:u32 | model name (utf-8)
+#   | [scale:f32 for int8] | payload
+# Rows written before this format are raw float32 bytes with no header.
+MAGIC = b"DALV"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sBBHI")
+_SCALE = struct.Struct("<f")
+
+DTYPE_CODES = {"float32": 0, "float16": 1, "int8": 2}
+_CODE_DTYPES = {code: name for name, code in DTYPE_CODES.items()}
+_NUMPY_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+@dataclass
+class EmbeddingHeader:
+    """Metadata decoded from an embedding blob"""
+    version: int
+    dtype: str
+    dimension: int
+    model_name: Optional[str]
+    normalized: bool
+
+
+def encode_embedding(embedding, dtype: str = "float16", model_name: Optional[str] = None) -> bytes:
+    """
+    L2-normalise an embedding and pack it with a versioned header
+
+    Args:
+        embedding: Vector to store
+        dtype: Storage precision - float32, float16 or int8 (scalar quantised)
+        model_name: Embedding model tag recorded in the header
+
+    Returns:
+        Blob suitable for the documents.embedding column
+    """
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(vector))
+    if norm > 0 and np.isfinite(norm):
+        vector = vector / norm
+
+    model_bytes = (model_name or "").encode("utf-8")[:65535]
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], len(model_bytes), vector.shape[0])
+
+    if dtype == "int8":
+        # Symmetric per-vector scale; unit vectors keep every component in [-1, 1]
+        max_abs = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = max_abs / 127.0 if max_abs > 0 else 1.0
+        payload = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8).tobytes()
+        return header + model_bytes + _SCALE.pack(scale) + payload
+
+    return header + model_bytes + vector.astype(_NUMPY_DTYPES[dtype]).tobytes()
+
+
+def decode_embedding(blob: bytes) -> Tuple[np.ndarray, EmbeddingHeader]:
+    """
+    Decode an embedding blob into a float32 vector
+
+    Legacy raw float32 rows (no header) are decoded transparently and
+    reported as version 0, un-normalised.
+    """
+    blob = bytes(blob)
+    if len(blob) >= _HEADER.size and blob[:4] == MAGIC:
+        _, version, dtype_code, model_len, dimension = _HEADER.unpack_from(blob, 0)
+        dtype = _CODE_DTYPES.get(dtype_code)
+        if dtype is None:
+            raise ValueError(f"Unknown embedding dtype code: {dtype_code}")
+        offset = _HEADER.size
+        model_name = blob[offset:offset + model_len].decode("utf-8") or None
+        offset += model_len
+
+        if dtype == "int8":
+            (scale,) = _SCALE.unpack_from(blob, offset)
+            offset += _SCALE.size
+            values = np.frombuffer(blob, dtype=np.int8, count=dimension, offset=offset)
+            vector = values.astype(np.float32) * scale
+        else:
+            vector = np.frombuffer(blob, dtype=_NUMPY_DTYPES[dtype], count=dimension, offset=offset).astype(np.float32)
+
+        return vector, EmbeddingHeader(version, dtype, dimension, model_name, True)
+
+    if len(blob) % 4:
+        raise ValueError(f"Malformed legacy embedding blob of {len(blob)} bytes")
+    vector = np.frombuffer(blob, dtype=np.float32)
+    return vector, EmbeddingHeader(0, "float32", vector.shape[0], None, False)
+
+
+def is_legacy_blob(blob: bytes) -> bool:
+    """True for raw float32 rows written before the versioned format"""
+    return not bytes(blob[:4]) == MAGIC
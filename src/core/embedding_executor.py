@@ -0,0 +1,117 @@
+"""
+DALI Legal AI - Embedding Executor Module
+Dynamic micro-batching of embedding requests on a dedicated worker thread
+"""
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class EmbeddingExecutor:
+    """
+    Coalesces single-text embedding requests into micro-batches.
+
+    Requests queue up and a worker thread drains them: once the first one
+    arrives it waits at most max_wait_ms for more, up to max_batch_size,
+    then encodes the whole batch in one call. Callers get a
+    concurrent.futures.Future (submit), a blocking result (embed) or an
+    awaitable (aembed), so async handlers never run the encoder on the
+    event loop.
+    """
+
+    def __init__(
+        self,
+        encode_batch: Callable[[List[str]], Any],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "embedding-executor"
+    ):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a text; the future resolves to its embedding as a list of floats"""
+        if self._closed:
+            raise RuntimeError("EmbeddingExecutor is closed")
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        """Blocking helper for threaded callers"""
+        return self.submit(text).result(timeout=timeout)
+
+    async def aembed(self, text: str) -> List[float]:
+        """Awaitable helper for async callers"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self, first: Tuple[str, Future]) -> List[Tuple[str, Future]]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)  # let the outer loop see it after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [(text, future) for text, future in self._collect(item) if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                vectors = self.encode_batch([text for text, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector.tolist() if hasattr(vector, "tolist") else list(vector))
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch counters; mean_batch_size shows how much coalescing happens"""
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+                "queued": self._queue.qsize(),
+            }
+
+    def close(self, wait: bool = True) -> None:
+        """Stop the worker after the queued requests are served"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        if wait:
+            self._worker.join()
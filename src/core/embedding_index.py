@@ -0,0 +1,323 @@
+"""
+DALI Legal AI - Embedding Index Module
+In-memory, per-user embedding matrices for fast knowledge base search
+"""
+
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_vectors(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise rows of a float32 matrix (zero rows stay zero)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        norm = float(np.linalg.norm(vectors))
+        return vectors / norm if norm > 0 and np.isfinite(norm) else np.zeros_like(vectors)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[~np.isfinite(norms) | (norms == 0)] = 1.0
+    normalized = vectors / norms
+    normalized[~np.isfinite(normalized)] = 0.0
+    return normalized
+
+
+class UserEmbeddingIndex:
+    """
+    Contiguous, pre-normalised float32 embedding matrix for one user's documents
+    with a parallel array of document ids. Scoring is a single matrix-vector
+    product followed by an argpartition top-k.
+    """
+
+    def __init__(self, ids: Sequence[int], vectors: Optional[np.ndarray] = None, dimension: Optional[int] = None):
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if vectors is None or len(ids) == 0:
+            self.dimension = dimension
+            width = dimension or 0
+            self._matrix = np.zeros((0, width), dtype=np.float32)
+            self._ids = np.zeros(0, dtype=np.int64)
+        else:
+            matrix = normalize_vectors(np.asarray(vectors, dtype=np.float32))
+            self.dimension = matrix.shape[1]
+            self._matrix = np.ascontiguousarray(matrix)
+            self._ids = ids
+        self._size = len(self._ids)
+        self._lock = threading.RLock()
+        # (row count, max document id) as seen in the database when loaded
+        self.signature: Tuple[int, int] = (self._size, int(self._ids.max()) if self._size else 0)
+        self.checked_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _allowed_rows(self, allowed_ids) -> Optional[np.ndarray]:
+        """Row positions whose id is in allowed_ids (a pre-filter bitmap); None means all rows"""
+        if allowed_ids is None:
+            return None
+        allowed = np.asarray(allowed_ids, dtype=np.int64)
+        return np.flatnonzero(np.isin(self._ids[:self._size], allowed))
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, ids: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        n = len(scores)
+        if n == 0:
+            return []
+        k = min(top_k, n)
+        if k < n:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(n)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def search(self, query_embedding, top_k: int = 10, allowed_ids=None) -> List[Tuple[int, float]]:
+        """
+        Return (document_id, cosine similarity) pairs for the best top_k rows
+
+        allowed_ids restricts scoring to those ids, so a narrow filter only
+        touches the matching rows.
+        """
+        with self._lock:
+            n = self._size
+            if n == 0 or top_k <= 0:
+                return []
+            query = normalize_vectors(np.asarray(query_embedding, dtype=np.float32).ravel())
+            if query.shape[0] != self.dimension:
+                logger.warning(
+                    f"Query dimension {query.shape[0]} does not match index dimension {self.dimension}"
+                )
+                return []
+            rows = self._allowed_rows(allowed_ids)
+            if rows is None:
+                scores = self._matrix[:n] @ query
+                ids = self._ids[:n]
+            else:
+                scores = self._matrix[rows] @ query
+                ids = self._ids[rows]
+        return self._top_k(scores, ids, top_k)
+
+    def search_many(self, query_embeddings, top_k: int = 10, allowed_ids=None) -> List[List[Tuple[int, float]]]:
+        """Score several queries with one matrix-matrix product; results align with the queries"""
+        queries = normalize_vectors(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        with self._lock:
+            n = self._size
+            if n == 0 or top_k <= 0 or len(queries) == 0:
+                return [[] for _ in range(len(queries))]
+            if queries.shape[1] != self.dimension:
+                logger.warning(
+                    f"Query dimension {queries.shape[1]} does not match index dimension {self.dimension}"
+                )
+                return [[] for _ in range(len(queries))]
+            rows = self._allowed_rows(allowed_ids)
+            if rows is None:
+                scores = queries @ self._matrix[:n].T
+                ids = self._ids[:n].copy()
+            else:
+                scores = queries @ self._matrix[rows].T
+                ids = self._ids[rows]
+
+        n = scores.shape[1]
+        if n == 0:
+            return [[] for _ in range(len(queries))]
+        k = min(top_k, n)
+        if k < n:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(n), (len(queries), 1))
+        results = []
+        for row, candidates in zip(scores, top):
+            ordered = candidates[np.argsort(-row[candidates], kind="stable")]
+            results.append([(int(ids[i]), float(row[i])) for i in ordered])
+        return results
+
+    def add(self, doc_id: int, vector) -> bool:
+        """Append one document vector, growing the buffer geometrically"""
+        vector = normalize_vectors(np.asarray(vector, dtype=np.float32).ravel())
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vector.shape[0]
+                self._matrix = np.zeros((0, self.dimension), dtype=np.float32)
+            if vector.shape[0] != self.dimension:
+                logger.warning(f"Skipping document {doc_id}: dimension {vector.shape[0]} != {self.dimension}")
+                return False
+            if self._size == self._matrix.shape[0]:
+                capacity = max(16, self._matrix.shape[0] * 2)
+                matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+                matrix[:self._size] = self._matrix[:self._size]
+                ids = np.zeros(capacity, dtype=np.int64)
+                ids[:self._size] = self._ids[:self._size]
+                self._matrix, self._ids = matrix, ids
+            self._matrix[self._size] = vector
+            self._ids[self._size] = int(doc_id)
+            self._size += 1
+            count, max_id = self.signature
+            self.signature = (count + 1, max(max_id, int(doc_id)))
+            return True
+
+    def remove(self, doc_ids: Iterable[int]) -> int:
+        """Drop rows for the given document ids; returns the number removed"""
+        doc_ids = np.asarray(list(doc_ids), dtype=np.int64)
+        with self._lock:
+            if self._size == 0 or len(doc_ids) == 0:
+                return 0
+            keep = ~np.isin(self._ids[:self._size], doc_ids)
+            removed = int(self._size - keep.sum())
+            if removed:
+                self._matrix = np.ascontiguousarray(self._matrix[:self._size][keep])
+                self._ids = self._ids[:self._size][keep]
+                self._size = len(self._ids)
+                count, max_id = self.signature
+                if np.isin(max_id, doc_ids):
+                    max_id = int(self._ids.max()) if self._size else 0
+                self.signature = (count - removed, max_id)
+            return removed
+
+
+class EmbeddingIndexCache:
+    """
+    Thread-safe cache of UserEmbeddingIndex objects, loaded lazily per user.
+
+    The loader returns (ids, vectors) for a user. A cheap signature callback
+    (row count and max id) is consulted at most every refresh_interval seconds
+    so that writes from other workers are picked up without a full reload on
+    every query.
+
+    builder, restore and after_build let another index type (for example the
+    persistent ANN index) plug in without changing the load/refresh logic.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[int], Tuple[List[int], List[np.ndarray]]],
+        signature_loader: Optional[Callable[[int], Tuple[int, int]]] = None,
+        max_users: int = 256,
+        refresh_interval: float = 2.0,
+        builder: Optional[Callable[[int, List[int], Optional[np.ndarray], Optional[int]], UserEmbeddingIndex]] = None,
+        restore: Optional[Callable[[int, Tuple[int, int]], Optional[UserEmbeddingIndex]]] = None,
+        after_build: Optional[Callable[[int, UserEmbeddingIndex], None]] = None
+    ):
+        self.loader = loader
+        self.signature_loader = signature_loader
+        self.max_users = max_users
+        self.refresh_interval = refresh_interval
+        self.builder = builder or (lambda user_id, ids, vectors, dimension: UserEmbeddingIndex(ids, vectors, dimension))
+        self.restore = restore
+        self.after_build = after_build
+        self._indexes: "OrderedDict[int, UserEmbeddingIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._load_locks: Dict[int, threading.Lock] = {}
+
+    def _build(self, user_id: int) -> UserEmbeddingIndex:
+        started = time.perf_counter()
+        # Read the signature first so writes racing with the load trigger a reload
+        signature = None
+        if self.signature_loader is not None:
+            try:
+                signature = tuple(self.signature_loader(user_id))
+            except Exception as e:
+                logger.warning(f"Could not read embedding signature for user {user_id}: {e}")
+
+        if self.restore is not None and signature is not None:
+            index = self.restore(user_id, signature)
+            if index is not None:
+                index.signature = signature
+                logger.info(
+                    f"Restored embedding index for user {user_id}: {len(index)} vectors "
+                    f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+                )
+                return index
+
+        ids, vectors = self.loader(user_id)
+        if not ids:
+            index = self.builder(user_id, [], None, None)
+        else:
+            # Keep only the dominant dimension (rows from an older model are skipped)
+            dims = Counter(len(v) for v in vectors)
+            dimension = dims.most_common(1)[0][0]
+            keep = [i for i, v in enumerate(vectors) if len(v) == dimension]
+            if len(keep) != len(ids):
+                logger.warning(
+                    f"User {user_id}: skipped {len(ids) - len(keep)} embeddings with dimension != {dimension}"
+                )
+            index = self.builder(
+                user_id,
+                [ids[i] for i in keep],
+                np.vstack([vectors[i] for i in keep]) if keep else None,
+                dimension
+            )
+            index.signature = (len(ids), int(max(ids)))
+        if signature is not None:
+            # Must reflect the database, not just the rows we kept
+            index.signature = signature
+        logger.info(
+            f"Loaded embedding index for user {user_id}: {len(index)} vectors "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+        if self.after_build is not None:
+            self.after_build(user_id, index)
+        return index
+
+    def _is_stale(self, user_id: int, index: UserEmbeddingIndex) -> bool:
+        if self.signature_loader is None:
+            return False
+        now = time.monotonic()
+        if now - index.checked_at < self.refresh_interval:
+            return False
+        index.checked_at = now
+        try:
+            return tuple(self.signature_loader(user_id)) != tuple(index.signature)
+        except Exception as e:
+            logger.warning(f"Could not verify embedding index for user {user_id}: {e}")
+            return False
+
+    def get(self, user_id: int) -> UserEmbeddingIndex:
+        """Return the user's index, loading or reloading it if needed"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+            load_lock = self._load_locks.setdefault(user_id, threading.Lock())
+
+        if index is not None and not self._is_stale(user_id, index):
+            return index
+
+        with load_lock:
+            with self._lock:
+                current = self._indexes.get(user_id)
+            if current is not None and current is not index:
+                return current  # another thread reloaded it while we waited
+            index = self._build(user_id)
+            with self._lock:
+                self._indexes[user_id] = index
+                self._indexes.move_to_end(user_id)
+                while len(self._indexes) > self.max_users:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._load_locks.pop(evicted, None)
+            return index
+
+    def add(self, user_id: int, doc_id: int, vector) -> None:
+        """Patch a loaded index with a new document (no-op if not loaded)"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None and not index.add(doc_id, vector):
+            self.invalidate(user_id)
+
+    def remove(self, user_id: int, doc_ids: Iterable[int]) -> None:
+        """Remove documents from a loaded index (no-op if not loaded)"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            index.remove(doc_ids)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """Drop one user's index, or every index when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(user_id, None)
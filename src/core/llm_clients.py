@@ -0,0 +1,273 @@
+"""
+DALI Legal AI - LLM Client Pool Module
+Process-wide OpenAI and Ollama clients with keep-alive connection pools
+"""
+
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLIENT_OPTIONS = {
+    'max_connections': 20,
+    'max_keepalive_connections': 10,
+    'keepalive_expiry': 30.0,
+    'timeout': 120.0,
+    'connect_timeout': 10.0,
+    'max_retries': 2,
+    'model_list_ttl': 60.0,
+    'async_max_connections': 256,
+    'async_max_keepalive_connections': 64,
+}
+
+
+class LLMClientPool:
+    """
+    Get-or-create map of LLM clients keyed by (provider, base URL, API key).
+
+    Each client owns one httpx connection pool, so TCP/TLS connections are
+    reused across requests and across LLMEngine instances. Async clients
+    are also keyed by event loop, since their connections belong to it.
+    API keys are hashed before being used as keys so they never appear in
+    logs.
+    Ollama model lists are cached per host for model_list_ttl seconds.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+        self._model_lists: Dict[str, Tuple[float, Any]] = {}
+
+    @staticmethod
+    def _key(provider: str, base_url: Optional[str], api_key: Optional[str]) -> Tuple[str, str, str]:
+        key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16] if api_key else ''
+        return provider, base_url or '', key_hash
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = factory()
+                self._clients[key] = client
+                logger.info(f"Created pooled {key[0]} client for {key[1] or 'default endpoint'}")
+            return client
+
+    def cached_model_list(self, host_url: str, loader: Callable[[], Any], ttl: float, refresh: bool = False) -> Any:
+        """Return loader() for host_url, reusing a result younger than ttl seconds"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._model_lists.get(host_url)
+        if cached is not None and not refresh and now - cached[0] < ttl:
+            return cached[1]
+        response = loader()
+        with self._lock:
+            self._model_lists[host_url] = (now, response)
+        return response
+
+    def invalidate_model_list(self, host_url: Optional[str] = None) -> None:
+        with self._lock:
+            if host_url is None:
+                self._model_lists.clear()
+            else:
+                self._model_lists.pop(host_url, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'clients': [f"{key[0]}:{key[1] or 'default'}" for key in self._clients],
+                'cached_model_lists': list(self._model_lists),
+            }
+
+    def close(self) -> None:
+        """Close every pooled client (for application shutdown)"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._model_lists.clear()
+        for client in clients:
+            close = getattr(client, 'close', None) or getattr(getattr(client, '_client', None), 'close', None)
+            if close is not None:
+                try:
+                    result = close()
+                    if asyncio.iscoroutine(result):
+                        # Async clients are closed by aclose(); drop the coroutine
+                        result.close()
+                except Exception as e:
+                    logger.warning(f"Error closing LLM client: {e}")
+
+    async def aclose(self) -> None:
+        """Close every pooled client, awaiting async ones"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._model_lists.clear()
+        for client in clients:
+            close = getattr(client, 'close', None) or getattr(getattr(client, '_client', None), 'aclose', None)
+            if close is not None:
+                try:
+                    result = close()
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    logger.warning(f"Error closing LLM client: {e}")
+
+
+_pool = LLMClientPool()
+
+
+def _options(options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {**DEFAULT_CLIENT_OPTIONS, **(options or {})}
+
+
+def _http_settings(options: Dict[str, Any], asynchronous: bool = False) -> Dict[str, Any]:
+    """httpx limits/timeout keyword arguments, or {} without httpx"""
+    if not HTTPX_AVAILABLE:
+        return {}
+    prefix = 'async_' if asynchronous else ''
+    return {
+        'limits': httpx.Limits(
+            max_connections=int(options[f'{prefix}max_connections']),
+            max_keepalive_connections=int(options[f'{prefix}max_keepalive_connections']),
+            keepalive_expiry=float(options['keepalive_expiry'])
+        ),
+        'timeout': httpx.Timeout(float(options['timeout']), connect=float(options['connect_timeout'])),
+    }
+
+
+def get_openai_client(api_key: Optional[str], base_url: Optional[str] = None, options: Optional[Dict[str, Any]] = None):
+    """
+    Shared openai.OpenAI client for an API key and endpoint
+
+    Args:
+        api_key: OpenAI API key (None uses OPENAI_API_KEY)
+        base_url: Optional API base URL (Azure/OpenAI-compatible servers)
+        options: Connection settings overriding DEFAULT_CLIENT_OPTIONS
+    """
+    import openai
+    options = _options(options)
+
+    def create():
+        kwargs: Dict[str, Any] = {'api_key': api_key, 'max_retries': int(options['max_retries'])}
+        if base_url:
+            kwargs['base_url'] = base_url
+        http = _http_settings(options)
+        if http:
+            kwargs['http_client'] = httpx.Client(**http)
+            kwargs['timeout'] = http['timeout']
+        return openai.OpenAI(**kwargs)
+
+    return _pool.get(LLMClientPool._key('openai', base_url, api_key), create)
+
+
+def get_ollama_client(host_url: str, options: Optional[Dict[str, Any]] = None):
+    """Shared ollama.Client for a host URL such as http://localhost:11434"""
+    import ollama
+    options = _options(options)
+
+    def create():
+        http = _http_settings(options)
+        try:
+            return ollama.Client(host=host_url, **http)
+        except TypeError:
+            # Older clients do not forward httpx settings
+            return ollama.Client(host=host_url)
+
+    return _pool.get(LLMClientPool._key('ollama', host_url, None), create)
+
+
+def get_async_openai_client(api_key: Optional[str], base_url: Optional[str] = None, options: Optional[Dict[str, Any]] = None):
+    """Shared openai.AsyncOpenAI client for the running event loop"""
+    import openai
+    options = _options(options)
+    loop = asyncio.get_running_loop()
+
+    def create():
+        kwargs: Dict[str, Any] = {'api_key': api_key, 'max_retries': int(options['max_retries'])}
+        if base_url:
+            kwargs['base_url'] = base_url
+        http = _http_settings(options, asynchronous=True)
+        if http:
+            kwargs['http_client'] = httpx.AsyncClient(**http)
+            kwargs['timeout'] = http['timeout']
+        return openai.AsyncOpenAI(**kwargs)
+
+    return _pool.get(LLMClientPool._key('openai-async', base_url, api_key) + (id(loop),), create)
+
+
+def get_async_ollama_client(host_url: str, options: Optional[Dict[str, Any]] = None):
+    """Shared ollama.AsyncClient for a host URL and the running event loop"""
+    import ollama
+    options = _options(options)
+    loop = asyncio.get_running_loop()
+
+    def create():
+        http = _http_settings(options, asynchronous=True)
+        try:
+            return ollama.AsyncClient(host=host_url, **http)
+        except TypeError:
+            return ollama.AsyncClient(host=host_url)
+
+    return _pool.get(LLMClientPool._key('ollama-async', host_url, None) + (id(loop),), create)
+
+
+def list_ollama_models(host_url: str, options: Optional[Dict[str, Any]] = None, refresh: bool = False) -> Any:
+    """Raw ollama list() response for a host, cached for model_list_ttl seconds"""
+    options = _options(options)
+    client = get_ollama_client(host_url, options)
+    return _pool.cached_model_list(host_url, client.list, float(options['model_list_ttl']), refresh)
+
+
+def extract_model_names(list_response: Any) -> List[str]:
+    """Extract model names from an ollama list() response safely."""
+    try:
+        models = list_response
+        # Some client versions return {'models': [...]} while others may return a list directly
+        if isinstance(models, dict):
+            models = models.get('models', [])
+        elif hasattr(models, 'models'):
+            models = models.models
+        if not isinstance(models, list):
+            return []
+        names: List[str] = []
+        for item in models:
+            if isinstance(item, dict):
+                name = item.get('name') or item.get('model')
+            elif isinstance(item, str):
+                name = item
+            else:
+                name = getattr(item, 'model', None) or getattr(item, 'name', None)
+            if isinstance(name, str):
+                names.append(name)
+        return names
+    except Exception as exc:
+        logger.error(f"Failed to parse ollama model list: {exc}")
+        return []
+
+
+def invalidate_ollama_models(host_url: Optional[str] = None) -> None:
+    """Forget cached model lists (e.g. after pulling a model)"""
+    _pool.invalidate_model_list(host_url)
+
+
+def get_client_pool() -> LLMClientPool:
+    return _pool
+
+
+def close_llm_clients() -> None:
+    """Close all pooled connections"""
+    _pool.close()
+
+
+async def aclose_llm_clients() -> None:
+    """Close all pooled connections from async code (e.g. a FastAPI shutdown hook)"""
+    await _pool.aclose()
@@ -7,14 +7,117 @@ import os
 import json
 import logging
 from typing import List, Dict, Optional, Generator
-import ollama
-import openai
 from langchain.schema import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain.callbacks.base import BaseCallbackHandler
-from src.utils.config import load_config
+from src.utils.config import load_config, get_llm_client_config
+from .llm_clients import get_openai_client, get_ollama_client, list_ollama_models, extract_model_names, invalidate_ollama_models
+from .context_packer import ContextPacker, ContextInput
 
 logger = logging.getLogger(__name__)
 
+ANALYSIS_PROMPTS = {
+    "general": "Please analyze this legal document and provide a summary of key points, potential issues, and recommendations.",
+    "contract": "Analyze this contract for key terms, obligations, risks, and any unusual or problematic clauses.",
+    "litigation": "Review this litigation document and identify key legal arguments, evidence, and strategic considerations.",
+    "compliance": "Examine this document for compliance issues and regulatory requirements."
+}
+
+# Response allowance sent with every generate/stream request (and reserved when packing)
+DEFAULT_MAX_TOKENS = 2048
+
+# Legal-specific system prompt (very explicit about answer language)
+LEGAL_SYSTEM_PROMPT = (
+    "System Prompt: DALI (Test-Ready)\n\n"
+    "Identity / الهوية\n"
+    "You are DALI, an AI legal assistant created by Siyada Tech. You assist legal professionals with:\n"
+    "أنت دالي، مساعد قانوني ذكي تم تطويره بواسطة شركة سيادة تك. تساعد المتخصصين القانونيين في:\n\n"
+    "Research / البحث\n"
+    "Document analysis / تحليل المستندات\n"
+    "Legal reasoning / الاستدلال القانوني\n\n"
+    "Core Rules / القواعد الأساسية\n"
+    "Confidentiality / السرية\n"
+    "Always treat user inputs as confidential.\n"
+    "تعامل دائمًا مع مدخلات المستخدم بسرية تامة.\n\n"
+    "Document Context Usage / استخدام سياق المستندات\n"
+    "When provided with document context, ALWAYS use it to answer the user's question.\n"
+    "If context is provided, base your answer primarily on that information.\n"
+    "عند توفير سياق المستندات، استخدمه دائمًا للإجابة على سؤال المستخدم.\n"
+    "إذا تم توفير السياق، اعتمد إجابتك بشكل أساسي على تلك المعلومات.\n\n"
+    "Separation of Sources / فصل المصادر\n"
+    "Always split your output into:\n"
+    "قم دائمًا بتقسيم إجابتك إلى:\n"
+    "From Knowledge Base → Information found in uploaded documents and user's knowledge base.\n"
+    "من قاعدة المعرفة → المعلومات الموجودة في المستندات المرفوعة وقاعدة معرفة المستخدم.\n"
+    "Cite the document: / اذكر المستند:\n"
+    "From Web → Information from real-time searches.\n"
+    "من الويب → المعلومات من عمليات البحث في الوقت الفعلي.\n"
+    "Cite with web format: 【web†SourceName†L8-L15】\n"
+    "اذكر المصدر بهذا الشكل: 【web†اسم_المصدر†L8-L15】\n\n"
+    "Language / اللغة:\n"
+    "Always answer in the language of the user's question, regardless of the context or document language.\n"
+    "If the question is in English, your answer must be in English, even if the context is in Arabic.\n"
+    "If the question is in Arabic, your answer must be in Arabic, even if the context is in English.\n"
+    "أجب دائمًا بلغة سؤال المستخدم بغض النظر عن لغة السياق أو المستندات.\n"
+    "إذا كان السؤال بالإنجليزية، يجب أن تكون الإجابة بالإنجليزية حتى لو كان السياق أو المستندات بالعربية.\n"
+    "إذا كان السؤال بالعربية، يجب أن تكون الإجابة بالعربية حتى لو كان السياق أو المستندات بالإنجليزية.\n"
+)
+
+
+def build_analysis_prompt(
+    document_text: str,
+    analysis_type: str = "general",
+    packer: Optional[ContextPacker] = None,
+    system_prompt: str = "",
+    max_output_tokens: int = 2048
+) -> str:
+    """Analysis instruction for analysis_type followed by the document, trimmed to packer's budget when given"""
+    prompt = ANALYSIS_PROMPTS.get(analysis_type, ANALYSIS_PROMPTS["general"])
+    if packer is not None:
+        document_text = packer.fit(
+            document_text,
+            system_prompt=system_prompt,
+            instructions=f"{prompt}\n\nDocument:\n",
+            max_output_tokens=max_output_tokens
+        )
+    return f"{prompt}\n\nDocument:\n{document_text}"
+
+
+def build_messages(
+    packer: ContextPacker,
+    query: str,
+    context: ContextInput = None,
+    conversation_history: Optional[List[Dict]] = None,
+    max_tokens: int = 2048,
+    system_prompt: str = LEGAL_SYSTEM_PROMPT
+) -> List[Dict]:
+    """
+    Build the chat message list for an LLM call, packed into packer's token budget
+
+    Older history and lower-ranked context chunks are trimmed or dropped
+    first (see ContextPacker). system_prompt "" sends no system message.
+    Shared by LLMEngine and AsyncLLMEngine.
+    """
+    packed = packer.pack(
+        query,
+        system_prompt=system_prompt,
+        history=conversation_history,
+        chunks=context,
+        max_output_tokens=max_tokens,
+        instructions="Context: \n\nQuestion: " if context else ""
+    )
+    messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    
+    # Add conversation history
+    messages.extend(packed.history)
+    
+    # Add context if provided
+    user_message = packed.question
+    if packed.chunks:
+        user_message = f"Context: {packed.context}\n\nQuestion: {packed.question}"
+    
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
 
 class StreamingCallbackHandler(BaseCallbackHandler):
     """Callback handler for streaming LLM responses"""
@@ -31,9 +134,13 @@ class LLMEngine:
     """
     Core LLM Engine for DALI Legal AI System
     Manages Ollama models and provides legal-specific prompting
+
+    Engines are cheap per-request views: OpenAI and Ollama clients (and their
+    keep-alive connections) come from the process-wide pool in llm_clients,
+    and Ollama model lists are cached there.
     """
-    def __init__(self, model_name: str = None, host: str = None, port: int = None):
-        self.config = load_config()
+    def __init__(self, model_name: str = None, host: str = None, port: int = None, config: Optional[Dict] = None):
+        self.config = config or load_config()
         # Only use Ollama model as default if no model_name is provided AND we're specifically using Ollama
         # Otherwise, default to OpenAI to avoid slow loading
         if model_name is None:
@@ -46,15 +153,18 @@ class LLMEngine:
         self.port = port or self.config.get('ollama', {}).get('port', 11434)
         self.openai_api_key = self.config.get('openai', {}).get('api_key', None)
         self.openai_model = self.config.get('openai', {}).get('model', 'gpt-4o')
+        self.openai_base_url = self.config.get('openai', {}).get('base_url')
+        self.client_options = get_llm_client_config()
         
         # Handle case where host already contains port
         if ':' in self.host:
             # Extract just the host part if port is included
             self.host = self.host.split(':')[0]
         
-        # Initialize Ollama client with error handling
+        # Pooled Ollama client, shared by every engine on the same host
+        self.ollama_url = f"http://{self.host}:{self.port}"
         try:
-            self.client = ollama.Client(host=f"http://{self.host}:{self.port}")
+            self.client = get_ollama_client(self.ollama_url, self.client_options)
             self.ollama_available = True
         except Exception as e:
             logger.warning(f"Failed to initialize Ollama client: {e}")
@@ -62,38 +172,29 @@ class LLMEngine:
             self.ollama_available = False
         
         self.legal_system_prompt = self._get_legal_system_prompt()
+        # Budget for the model requests actually go to: the Ollama model when it is served, else openai_model
+        if self._uses_ollama():
+            self.context_packer = ContextPacker(self.model_name, 'ollama')
+        else:
+            self.context_packer = ContextPacker(self.openai_model, 'openai')
         
         # Verify model availability (only for Ollama models and if Ollama is available)
         # Only check availability, don't auto-pull models to avoid slow loading
         if self.ollama_available and (self.model_name.startswith('llama') or self.model_name == 'mistral'):
             self._check_model_availability()
     
+    def _uses_ollama(self) -> bool:
+        """Whether requests go to the Ollama model (otherwise to openai_model)"""
+        return bool((self.model_name.startswith('llama') or self.model_name == 'mistral') and self.ollama_available and self.client)
+
     def _extract_model_names(self, list_response: Dict) -> List[str]:
         """Extract model names from ollama list() response safely."""
-        try:
-            models = list_response
-            # Some client versions return {'models': [...]} while others may return a list directly
-            if isinstance(models, dict):
-                models = models.get('models', [])
-            if not isinstance(models, list):
-                return []
-            names: List[str] = []
-            for item in models:
-                if isinstance(item, dict):
-                    name = item.get('name') or item.get('model')
-                    if isinstance(name, str):
-                        names.append(name)
-                elif isinstance(item, str):
-                    names.append(item)
-            return names
-        except Exception as exc:
-            logger.error(f"Failed to parse ollama model list: {exc}")
-            return []
+        return extract_model_names(list_response)
     
     def _check_model_availability(self) -> None:
         """Check if the specified model is available locally (without auto-pulling)"""
         try:
-            models_response = self.client.list()
+            models_response = list_ollama_models(self.ollama_url, self.client_options)
             available_models = self._extract_model_names(models_response)
             
             if self.model_name not in available_models:
@@ -107,46 +208,12 @@ class LLMEngine:
     
     def _get_legal_system_prompt(self) -> str:
         """Get the legal-specific system prompt (very explicit about answer language)"""
-        return (
-            "System Prompt: DALI (Test-Ready)\n\n"
-            "Identity / الهوية\n"
-            "You are DALI, an AI legal assistant created by Siyada Tech. You assist legal professionals with:\n"
-            "أنت دالي، مساعد قانوني ذكي تم تطويره بواسطة شركة سيادة تك. تساعد المتخصصين القانونيين في:\n\n"
-            "Research / البحث\n"
-            "Document analysis / تحليل المستندات\n"
-            "Legal reasoning / الاستدلال القانوني\n\n"
-            "Core Rules / القواعد الأساسية\n"
-            "Confidentiality / السرية\n"
-            "Always treat user inputs as confidential.\n"
-            "تعامل دائمًا مع مدخلات المستخدم بسرية تامة.\n\n"
-            "Document Context Usage / استخدام سياق المستندات\n"
-            "When provided with document context, ALWAYS use it to answer the user's question.\n"
-            "If context is provided, base your answer primarily on that information.\n"
-            "عند توفير سياق المستندات، استخدمه دائمًا للإجابة على سؤال المستخدم.\n"
-            "إذا تم توفير السياق، اعتمد إجابتك بشكل أساسي على تلك المعلومات.\n\n"
-            "Separation of Sources / فصل المصادر\n"
-            "Always split your output into:\n"
-            "قم دائمًا بتقسيم إجابتك إلى:\n"
-            "From Knowledge Base → Information found in uploaded documents and user's knowledge base.\n"
-            "من قاعدة المعرفة → المعلومات الموجودة في المستندات المرفوعة وقاعدة معرفة المستخدم.\n"
-            "Cite the document: / اذكر المستند:\n"
-            "From Web → Information from real-time searches.\n"
-            "من الويب → المعلومات من عمليات البحث في الوقت الفعلي.\n"
-            "Cite with web format: 【web†SourceName†L8-L15】\n"
-            "اذكر المصدر بهذا الشكل: 【web†اسم_المصدر†L8-L15】\n\n"
-            "Language / اللغة:\n"
-            "Always answer in the language of the user's question, regardless of the context or document language.\n"
-            "If the question is in English, your answer must be in English, even if the context is in Arabic.\n"
-            "If the question is in Arabic, your answer must be in Arabic, even if the context is in English.\n"
-            "أجب دائمًا بلغة سؤال المستخدم بغض النظر عن لغة السياق أو المستندات.\n"
-            "إذا كان السؤال بالإنجليزية، يجب أن تكون الإجابة بالإنجليزية حتى لو كان السياق أو المستندات بالعربية.\n"
-            "إذا كان السؤال بالعربية، يجب أن تكون الإجابة بالعربية حتى لو كان السياق أو المستندات بالإنجليزية.\n"
-        )
+        return LEGAL_SYSTEM_PROMPT
     
     def generate_response(
         self, 
         query: str, 
-        context: Optional[str] = None,
+        context: ContextInput = None,
         conversation_history: Optional[List[Dict]] = None,
         stream: bool = False
     ) -> str:
@@ -155,7 +222,7 @@ class LLMEngine:
         
         Args:
             query: The user's legal question or request
-            context: Additional context from documents or research
+            context: Additional context from documents or research (text, or chunks best first)
             conversation_history: Previous conversation messages
             stream: Whether to stream the response
             
@@ -163,46 +230,99 @@ class LLMEngine:
             Generated response string
         """
         try:
-            # Build the prompt
-            messages = self._build_messages(query, context, conversation_history)
-            
             if self.model_name.startswith('gpt'):
-                return self._generate_openai_response(query, context)
+                return self._generate_openai_response(query, context, conversation_history)
             elif self.model_name.startswith('llama') or self.model_name == 'mistral':
                 # Check if Ollama is available before trying to use it
                 if not self.ollama_available or not self.client:
                     logger.warning(f"Ollama not available, falling back to OpenAI for model: {self.model_name}")
-                    return self._generate_openai_response(query, context)
-                return self._generate_ollama_response(query, context)
+                    return self._generate_openai_response(query, context, conversation_history)
+                return self._generate_ollama_response(query, context, conversation_history)
             else:
                 # Default to OpenAI if model is not recognized
                 logger.warning(f"Unrecognized model: {self.model_name}, falling back to OpenAI")
-                return self._generate_openai_response(query, context)
+                return self._generate_openai_response(query, context, conversation_history)
                 
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             return f"I apologize, but I encountered an error processing your request: {str(e)}"
     
+    def stream_response(
+        self,
+        query: str,
+        context: ContextInput = None,
+        conversation_history: Optional[List[Dict]] = None
+    ) -> Generator[str, None, None]:
+        """
+        Yield the response to a legal query as it is generated
+
+        Args:
+            query: The user's legal question or request
+            context: Additional context from documents or research (text, or chunks best first)
+            conversation_history: Previous conversation messages
+
+        Yields:
+            Text fragments in order; joined they form the full answer
+        """
+        messages = self._build_messages(query, context, conversation_history, max_tokens=DEFAULT_MAX_TOKENS)
+        if self._uses_ollama():
+            yield from self._generate_streaming_response(messages)
+            return
+        if not self.model_name.startswith('gpt'):
+            logger.warning(f"Streaming not available for model: {self.model_name}, falling back to OpenAI")
+        yield from self._generate_openai_streaming_response(messages)
+
+    def complete(self, prompt: str, system_prompt: str = "", max_tokens: int = 512, temperature: float = 0.3) -> str:
+        """
+        Single completion with a caller-supplied system prompt
+
+        Unlike generate_response, errors are raised instead of being
+        returned as an apology, so background jobs can tell failure from
+        output.
+
+        Args:
+            prompt: The instruction and its input
+            system_prompt: System message ("" sends none)
+            max_tokens: Response limit
+            temperature: Sampling temperature
+
+        Returns:
+            Generated text
+        """
+        messages = self._build_messages(prompt, max_tokens=max_tokens, system_prompt=system_prompt)
+        if self._uses_ollama():
+            response = self.client.chat(
+                model=self.model_name,
+                messages=messages,
+                options={"temperature": temperature, "top_p": 0.9, "num_predict": max_tokens}
+            )
+            return response['message']['content'].strip()
+        client = get_openai_client(self.openai_api_key, self.openai_base_url, self.client_options)
+        response = client.chat.completions.create(
+            model=self.openai_model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return (response.choices[0].message.content or "").strip()
+
     def _build_messages(
-        self, 
+        self,
         query: str, 
-        context: Optional[str] = None,
-        conversation_history: Optional[List[Dict]] = None
+        context: ContextInput = None,
+        conversation_history: Optional[List[Dict]] = None,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        system_prompt: Optional[str] = None
     ) -> List[Dict]:
-        """Build the message list for the LLM"""
-        messages = [{"role": "system", "content": self.legal_system_prompt}]
-        
-        # Add conversation history
-        if conversation_history:
-            messages.extend(conversation_history)
-        
-        # Add context if provided
-        user_message = query
-        if context:
-            user_message = f"Context: {context}\n\nQuestion: {query}"
-        
-        messages.append({"role": "user", "content": user_message})
-        return messages
+        """Build the message list for the LLM (see build_messages); system_prompt=None uses the legal prompt"""
+        return build_messages(
+            self.context_packer,
+            query,
+            context,
+            conversation_history,
+            max_tokens,
+            self.legal_system_prompt if system_prompt is None else system_prompt
+        )
     
     def _generate_complete_response(self, messages: List[Dict]) -> str:
         """Generate a complete response (non-streaming)"""
@@ -213,7 +333,7 @@ class LLMEngine:
                 options={
                     "temperature": 0.3,  # Lower temperature for more consistent legal responses
                     "top_p": 0.9,
-                    "max_tokens": 2048
+                    "max_tokens": DEFAULT_MAX_TOKENS
                 }
             )
             return response['message']['content']
@@ -232,7 +352,7 @@ class LLMEngine:
                 options={
                     "temperature": 0.3,
                     "top_p": 0.9,
-                    "max_tokens": 2048
+                    "max_tokens": DEFAULT_MAX_TOKENS
                 }
             )
             
@@ -244,25 +364,44 @@ class LLMEngine:
             logger.error(f"Error in streaming response generation: {e}")
             yield f"Error: {str(e)}"
     
-    def _generate_openai_response(self, query, context=None):
-        # Use OpenAI v1+ API
-        client = openai.OpenAI(api_key=self.openai_api_key)
-        messages = []
-        if context:
-            messages.append({"role": "system", "content": context})
-        messages.append({"role": "user", "content": query})
+    def _generate_openai_response(self, query, context=None, conversation_history=None):
+        # Use OpenAI v1+ API through the pooled client
+        client = get_openai_client(self.openai_api_key, self.openai_base_url, self.client_options)
+        # Same messages as stream_response and the Ollama path (legal system prompt, context in the user turn)
+        messages = self._build_messages(query, context, conversation_history, max_tokens=DEFAULT_MAX_TOKENS)
         response = client.chat.completions.create(
             model=self.openai_model,
             messages=messages,
             temperature=0.3,
-            max_tokens=2048
+            max_tokens=DEFAULT_MAX_TOKENS
         )
         return response.choices[0].message.content.strip()
 
-    def _generate_ollama_response(self, query, context=None):
+    def _generate_openai_streaming_response(self, messages: List[Dict]) -> Generator[str, None, None]:
+        """Stream an OpenAI chat completion; closing the generator closes the HTTP stream"""
+        client = get_openai_client(self.openai_api_key, self.openai_base_url, self.client_options)
+        stream = client.chat.completions.create(
+            model=self.openai_model,
+            messages=messages,
+            temperature=0.3,
+            max_tokens=DEFAULT_MAX_TOKENS,
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+        finally:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+
+    def _generate_ollama_response(self, query, context=None, conversation_history=None):
         """Generate a response using an Ollama model."""
         try:
-            messages = self._build_messages(query, context)
+            messages = self._build_messages(query, context, conversation_history, max_tokens=DEFAULT_MAX_TOKENS)
             response = self.client.chat(
                 model=self.model_name,
                 messages=messages,
@@ -270,7 +409,7 @@ class LLMEngine:
                 options={
                     "temperature": 0.3,
                     "top_p": 0.9,
-                    "max_tokens": 2048
+                    "max_tokens": DEFAULT_MAX_TOKENS
                 }
             )
             return response['message']['content']
@@ -289,17 +428,9 @@ class LLMEngine:
         Returns:
             Analysis results
         """
-        analysis_prompts = {
-            "general": "Please analyze this legal document and provide a summary of key points, potential issues, and recommendations.",
-            "contract": "Analyze this contract for key terms, obligations, risks, and any unusual or problematic clauses.",
-            "litigation": "Review this litigation document and identify key legal arguments, evidence, and strategic considerations.",
-            "compliance": "Examine this document for compliance issues and regulatory requirements."
-        }
-        
-        prompt = analysis_prompts.get(analysis_type, analysis_prompts["general"])
-        full_prompt = f"{prompt}\n\nDocument:\n{document_text}"
-        
-        return self.generate_response(full_prompt)
+        return self.generate_response(
+            build_analysis_prompt(document_text, analysis_type, self.context_packer, self.legal_system_prompt)
+        )
     
     def legal_research(self, research_query: str, jurisdiction: str = "Saudi Arabia") -> str:
         """
@@ -362,7 +493,7 @@ class LLMEngine:
     def get_model_info(self) -> Dict:
         """Get information about the current model"""
         try:
-            models_response = self.client.list()
+            models_response = list_ollama_models(self.ollama_url, self.client_options)
             models = models_response.get('models', models_response) if isinstance(models_response, dict) else models_response
             current_model = None
             if isinstance(models, list):
@@ -395,23 +526,20 @@ class LLMEngine:
         model = user_settings.get('llm_model', 'gpt-3.5-turbo') if user_settings else 'gpt-3.5-turbo'
         if provider == 'openai':
             # OpenAI does not need host/port
-            return LLMEngine(model_name=model)
+            return LLMEngine(model_name=model, config=config)
         else:
             # Ollama
             host = config.get('ollama', {}).get('host', 'localhost')
             port = config.get('ollama', {}).get('port', 11434)
-            return LLMEngine(model_name=model, host=host, port=port)
+            return LLMEngine(model_name=model, host=host, port=port, config=config)
 
 
 # Utility functions
 def get_available_models(host: str = "localhost", port: int = 11434) -> List[str]:
     """Get list of available Ollama models"""
     try:
-        client = ollama.Client(host=f"http://{host}:{port}")
-        models_response = client.list()
-        # Reuse the robust extractor via a temporary engine instance
-        temp_engine = LLMEngine(host=host, port=port)
-        return temp_engine._extract_model_names(models_response)
+        models_response = list_ollama_models(f"http://{host}:{port}", get_llm_client_config())
+        return extract_model_names(models_response)
     except Exception as e:
         logger.error(f"Error getting available models: {e}")
         return []
@@ -420,8 +548,9 @@ def get_available_models(host: str = "localhost", port: int = 11434) -> List[str
 def pull_model(model_name: str, host: str = "localhost", port: int = 11434) -> bool:
     """Pull a model from Ollama registry"""
     try:
-        client = ollama.Client(host=f"http://{host}:{port}")
-        client.pull(model_name)
+        host_url = f"http://{host}:{port}"
+        get_ollama_client(host_url, get_llm_client_config()).pull(model_name)
+        invalidate_ollama_models(host_url)
         return True
     except Exception as e:
         logger.error(f"Error pulling model {model_name}: {e}")
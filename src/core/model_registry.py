@@ -0,0 +1,168 @@
+"""
+DALI Legal AI - Model Registry Module
+Process-wide, lazily loaded SentenceTransformer encoders and Chroma clients
+"""
+
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable
+
+import chromadb
+from chromadb.config import Settings
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+
+class _Registry:
+    """Thread-safe get-or-create map; each key is built at most once"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._items: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._items:
+                return self._items[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Build outside the registry lock so different keys load in parallel
+        with key_lock:
+            with self._lock:
+                if key in self._items:
+                    return self._items[key]
+            item = factory()
+            with self._lock:
+                self._items[key] = item
+            logger.info(f"Registered {self.name}: {key}")
+            return item
+
+    def peek(self, key: Hashable) -> Any:
+        """Return an already built item without creating it"""
+        with self._lock:
+            return self._items.get(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._items)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._key_locks.clear()
+
+
+_models = _Registry("embedding model")
+_chroma_clients = _Registry("Chroma client")
+_executors = _Registry("embedding executor")
+_collection_stats = _Registry("collection stats")
+
+
+def load_sentence_transformer(model_name: str) -> SentenceTransformer:
+    """Robust initialization for SentenceTransformer on CPU."""
+    last_err = None
+    candidates = [model_name]
+    # Try given name and hub-prefixed variant
+    if "/" not in model_name:
+        candidates.append(f"sentence-transformers/{model_name}")
+
+    for candidate in candidates:
+        try:
+            logger.info(f"Loading SentenceTransformer model: {candidate} on CPU")
+            model = SentenceTransformer(candidate, device='cpu')
+            # Warmup encode to materialize tensors off meta device
+            _ = model.encode("warmup", convert_to_tensor=False)
+            return model
+        except Exception as e:
+            last_err = e
+            logger.warning(f"Load failed for '{candidate}': {e}")
+
+    logger.error(f"Failed to load SentenceTransformer model '{model_name}': {last_err}")
+    raise last_err
+
+
+def load_onnx_encoder(model_name: str, quantize: bool = True, cache_dir: str = "./data/models/onnx", verify: bool = True):
+    """
+    ONNX Runtime encoder for model_name, falling back to PyTorch when
+    onnxruntime is missing, export fails or parity with PyTorch is too low.
+    """
+    from .onnx_encoder import OnnxSentenceEncoder, compare_backends, PARITY_SAMPLE_SENTENCES
+    try:
+        encoder = OnnxSentenceEncoder(model_name, cache_dir=cache_dir, quantize=quantize)
+    except Exception as e:
+        logger.warning(f"ONNX backend unavailable for '{model_name}', using PyTorch: {e}")
+        return get_embedding_model(model_name)
+    if verify:
+        # A temporary PyTorch reference; it is only kept if ONNX fails the check
+        reference = _models.peek(model_name) or load_sentence_transformer(model_name)
+        report = compare_backends(reference, encoder, PARITY_SAMPLE_SENTENCES)
+        logger.info(f"ONNX parity for '{model_name}': {report}")
+        if not report["passed"]:
+            logger.warning(
+                f"ONNX embeddings for '{model_name}' diverge from PyTorch "
+                f"(min cosine {report['min_cosine']:.4f}); using PyTorch"
+            )
+            return _models.get(model_name, lambda: reference)
+    return encoder
+
+
+def get_embedding_model(
+    model_name: str,
+    backend: str = "torch",
+    onnx_quantize: bool = True,
+    onnx_cache_dir: str = "./data/models/onnx",
+    verify: bool = True
+):
+    """
+    Shared encoder for model_name, loaded on first use
+
+    Args:
+        model_name: SentenceTransformer model name
+        backend: "torch" (SentenceTransformer) or "onnx" (ONNX Runtime)
+        onnx_quantize: Use the dynamically int8-quantised ONNX graph
+        onnx_cache_dir: Where exported ONNX models are kept
+        verify: Compare ONNX output with PyTorch once before using it
+    """
+    if backend == "onnx":
+        return _models.get(
+            (model_name, "onnx", bool(onnx_quantize)),
+            lambda: load_onnx_encoder(model_name, onnx_quantize, onnx_cache_dir, verify)
+        )
+    if backend != "torch":
+        logger.warning(f"Unknown embedding backend '{backend}', using PyTorch")
+    return _models.get(model_name, lambda: load_sentence_transformer(model_name))
+
+
+def get_chroma_client(persist_directory) -> Any:
+    """Shared PersistentClient for a directory (keyed by resolved path)"""
+    path = Path(persist_directory).resolve()
+
+    def create():
+        path.mkdir(parents=True, exist_ok=True)
+        return chromadb.PersistentClient(
+            path=str(path),
+            settings=Settings(
+                anonymized_telemetry=False,
+                allow_reset=True
+            )
+        )
+
+    return _chroma_clients.get(str(path), create)
+
+
+def get_embedding_executor(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Shared micro-batching executor for an encoder (one worker thread per key)"""
+    return _executors.get(key, factory)
+
+
+def get_shared_collection_stats(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Shared counters for a collection, so every VectorStore on it updates the same object"""
+    return _collection_stats.get(key, factory)
+
+
+def loaded_models() -> list:
+    """Names of encoders currently held in memory"""
+    return _models.keys()
@@ -0,0 +1,264 @@
+"""
+DALI Legal AI - ONNX Encoder Module
+ONNX Runtime (optionally int8 quantised) CPU backend for SentenceTransformer models
+"""
+
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+EXPORT_META_FILE = "export.json"
+
+
+def _model_dir_name(model_name: str) -> str:
+    return model_name.replace("/", "__")
+
+
+def export_sentence_transformer(model_name: str, output_dir: Union[str, Path], quantize: bool = True) -> Path:
+    """
+    Export a SentenceTransformer's transformer module to ONNX
+
+    The tokenizer, max sequence length and pooling settings are saved next to
+    the graph so later loads need neither PyTorch nor the original model.
+
+    Args:
+        model_name: SentenceTransformer model name or path
+        output_dir: Directory for model.onnx (and model.int8.onnx)
+        quantize: Also write a dynamically int8-quantised copy
+
+    Returns:
+        The output directory
+    """
+    import torch
+    from .model_registry import load_sentence_transformer
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    st_model = load_sentence_transformer(model_name)
+    transformer = st_model[0].auto_model
+    tokenizer = st_model.tokenizer
+    transformer.eval()
+
+    pooling = {"mode": "mean", "normalize": False}
+    for module in st_model:
+        name = type(module).__name__
+        if name == "Pooling":
+            config = module.get_config_dict()
+            if config.get("pooling_mode_cls_token"):
+                pooling["mode"] = "cls"
+            elif config.get("pooling_mode_max_tokens"):
+                pooling["mode"] = "max"
+        elif name == "Normalize":
+            pooling["normalize"] = True
+
+    sample = tokenizer(["export sample"], padding=True, truncation=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    onnx_path = output_dir / "model.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            str(onnx_path),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            do_constant_folding=True
+        )
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(str(onnx_path), str(output_dir / "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+    tokenizer.save_pretrained(str(output_dir))
+    meta = {
+        "model_name": model_name,
+        "max_seq_length": st_model.max_seq_length,
+        "input_names": input_names,
+        "pooling": pooling,
+        "dimension": st_model.get_sentence_embedding_dimension(),
+    }
+    (output_dir / EXPORT_META_FILE).write_text(json.dumps(meta, indent=2))
+    logger.info(f"Exported {model_name} to ONNX at {output_dir} (int8: {quantize})")
+    return output_dir
+
+
+class OnnxSentenceEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode backed by ONNX Runtime.
+
+    Uses the model's own tokenizer and pooling (mean pooling for the
+    multilingual MiniLM default), so vectors stay compatible with those from
+    the PyTorch model within quantisation tolerance.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: str = "./data/models/onnx",
+        quantize: bool = True,
+        num_threads: Optional[int] = None
+    ):
+        if not ONNX_AVAILABLE:
+            raise ImportError("onnxruntime is not installed")
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.model_dir = Path(cache_dir) / _model_dir_name(model_name)
+        graph = "model.int8.onnx" if quantize else "model.onnx"
+        if not (self.model_dir / graph).exists() or not (self.model_dir / EXPORT_META_FILE).exists():
+            export_sentence_transformer(model_name, self.model_dir, quantize=quantize)
+
+        meta = json.loads((self.model_dir / EXPORT_META_FILE).read_text())
+        self.max_seq_length = meta.get("max_seq_length") or 128
+        self.input_names = meta.get("input_names", ["input_ids", "attention_mask"])
+        self.pooling = meta.get("pooling", {"mode": "mean", "normalize": False})
+        self.dimension = meta.get("dimension")
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_dir))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        self.session = ort.InferenceSession(
+            str(self.model_dir / graph),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        logger.info(f"Loaded ONNX encoder for {model_name} ({graph})")
+
+    def get_sentence_embedding_dimension(self) -> Optional[int]:
+        return self.dimension
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        mode = self.pooling.get("mode", "mean")
+        if mode == "cls":
+            pooled = hidden[:, 0]
+        elif mode == "max":
+            pooled = np.where(mask[..., None] > 0, hidden, -1e9).max(axis=1)
+        else:
+            weights = mask[..., None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if self.pooling.get("normalize"):
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        convert_to_tensor: bool = False,
+        show_progress_bar: bool = False,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ) -> np.ndarray:
+        """Encode one sentence (1-D result) or a list (2-D result), like SentenceTransformer.encode"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+
+        # Sort by length so each batch pads to a similar size
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        pooled_batches = []
+        for start in range(0, len(texts), max(1, batch_size)):
+            batch_idx = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in batch_idx],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+            hidden = self.session.run(None, feeds)[0]
+            pooled = self._pool(hidden, encoded["attention_mask"])
+            if normalize_embeddings:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            pooled_batches.append((batch_idx, pooled))
+
+        outputs = np.zeros((len(texts), pooled_batches[0][1].shape[1]), dtype=np.float32)
+        for batch_idx, pooled in pooled_batches:
+            outputs[batch_idx] = pooled
+        return outputs[0] if single else outputs
+
+
+def compare_backends(reference, candidate, sentences: List[str], batch_size: int = 32, min_cosine: float = 0.98) -> Dict:
+    """
+    Parity and speed check between two encoders (e.g. PyTorch vs ONNX)
+
+    Args:
+        reference: Encoder producing the existing embeddings
+        candidate: Encoder under test
+        sentences: Sample texts
+        batch_size: Batch size for both encoders
+        min_cosine: Minimum per-sentence cosine similarity to pass
+
+    Returns:
+        Dict with cosine statistics, throughput of each backend, speedup and passed
+    """
+    def timed(encoder):
+        encoder.encode(sentences[:1], batch_size=batch_size, convert_to_tensor=False)  # warm-up
+        started = time.perf_counter()
+        vectors = np.asarray(encoder.encode(sentences, batch_size=batch_size, convert_to_tensor=False), dtype=np.float32)
+        return vectors, time.perf_counter() - started
+
+    ref_vectors, ref_seconds = timed(reference)
+    cand_vectors, cand_seconds = timed(candidate)
+    ref_unit = ref_vectors / np.clip(np.linalg.norm(ref_vectors, axis=1, keepdims=True), 1e-12, None)
+    cand_unit = cand_vectors / np.clip(np.linalg.norm(cand_vectors, axis=1, keepdims=True), 1e-12, None)
+    cosines = (ref_unit * cand_unit).sum(axis=1)
+    return {
+        "sentences": len(sentences),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "reference_per_sec": len(sentences) / ref_seconds if ref_seconds else None,
+        "candidate_per_sec": len(sentences) / cand_seconds if cand_seconds else None,
+        "speedup": ref_seconds / cand_seconds if cand_seconds else None,
+        "passed": bool(cosines.min() >= min_cosine),
+    }
+
+
+PARITY_SAMPLE_SENTENCES = [
+    "The tenant shall pay rent on the first day of each month.",
+    "This agreement is governed by the laws of the Kingdom of Saudi Arabia.",
+    "Either party may terminate the contract with thirty days written notice.",
+    "The employer must provide end-of-service benefits under the Labor Law.",
+    "يلتزم المستأجر بدفع الإيجار في اليوم الأول من كل شهر.",
+    "تخضع هذه الاتفاقية لأنظمة المملكة العربية السعودية.",
+    "Confidential information shall not be disclosed to third parties.",
+    "The court dismissed the claim for lack of jurisdiction.",
+]
+
+
+if __name__ == "__main__":
+    import argparse
+    from .model_registry import load_sentence_transformer
+
+    parser = argparse.ArgumentParser(description="Export a model to ONNX and compare it with PyTorch")
+    parser.add_argument("--model", default="paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--cache-dir", default="./data/models/onnx")
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--repeat", type=int, default=32, help="Repeat the sample sentences for timing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    onnx_encoder = OnnxSentenceEncoder(args.model, cache_dir=args.cache_dir, quantize=not args.no_quantize)
+    report = compare_backends(load_sentence_transformer(args.model), onnx_encoder, PARITY_SAMPLE_SENTENCES * args.repeat)
+    print(json.dumps(report, indent=2))
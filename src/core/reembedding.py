@@ -0,0 +1,427 @@
+"""
+DALI Legal AI - Re-embedding Module
+Resumable, throttled background migration of stored embeddings to a new model
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .embedding_cache import content_hash
+from .embedding_codec import encode_embedding, decode_embedding
+from .embedding_index import normalize_vectors
+from .model_registry import get_embedding_model
+
+logger = logging.getLogger(__name__)
+
+# MySQL tables re-embedded into an embedding_shadow column, in dependency order:
+# document vectors are the mean of their (already migrated) chunk vectors
+MYSQL_PHASES = ("chunk_store", "document_chunks", "documents")
+
+
+def _model_slug(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", model_name).strip("-_")[:40] or "model"
+
+
+class ReembeddingJob:
+    """
+    Re-encodes every stored embedding with target_model without downtime.
+
+    The Chroma collection is copied into a versioned shadow collection
+    ("<name>__<model>", ids recomputed for the new model) and MySQL vectors
+    are written to embedding_shadow columns, walking each source in id or
+    offset order. Progress is checkpointed to a JSON file after every batch,
+    so an interrupted job resumes where it stopped. Between batches the job
+    sleeps so it is busy at most duty_cycle of the time, leaving CPU for live
+    queries. Live reads keep using the old vectors until switch_over().
+    """
+
+    def __init__(
+        self,
+        target_model: str,
+        vector_store=None,
+        user_store=None,
+        batch_size: int = 64,
+        duty_cycle: float = 0.5,
+        checkpoint_dir: str = "./data/migrations",
+        backend: str = "torch"
+    ):
+        self.target_model = target_model
+        self.vector_store = vector_store
+        self.user_store = user_store
+        self.batch_size = max(1, int(batch_size))
+        self.duty_cycle = min(1.0, max(0.05, float(duty_cycle)))
+        self.backend = backend
+        self.checkpoint_path = Path(checkpoint_dir) / f"reembed_{_model_slug(target_model)}.json"
+        self.state = self._load_checkpoint()
+        self._encoder = None
+        self._shadow_collection = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        try:
+            state = json.loads(self.checkpoint_path.read_text())
+            if state.get("target_model") == self.target_model:
+                logger.info(f"Resuming re-embedding to {self.target_model} from {self.checkpoint_path}")
+                return state
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+        return {
+            "target_model": self.target_model,
+            "positions": {},
+            "completed": [],
+            "encoded": 0,
+            "switched": False,
+            "started_at": datetime.now().isoformat(),
+        }
+
+    def _save_checkpoint(self) -> None:
+        self.state["updated_at"] = datetime.now().isoformat()
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.state, indent=2))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def progress(self) -> Dict[str, Any]:
+        """Checkpoint contents (positions per source, completed phases, vectors encoded)"""
+        return dict(self.state)
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = get_embedding_model(self.target_model, backend=self.backend)
+        return self._encoder
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.encoder.encode(texts, batch_size=self.batch_size, convert_to_tensor=False)
+        self.state["encoded"] += len(texts)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _throttle(self, busy_seconds: float) -> None:
+        """Sleep long enough that the job is busy at most duty_cycle of the time"""
+        if self.duty_cycle < 1.0:
+            self._stop.wait(busy_seconds * (1.0 / self.duty_cycle - 1.0))
+
+    def _blob(self, vector) -> bytes:
+        return encode_embedding(vector, dtype=self.user_store.embedding_format, model_name=self.target_model)
+
+    @property
+    def shadow_collection_name(self) -> str:
+        name = f"{self.vector_store.collection_name}__{_model_slug(self.target_model)}"
+        return name[:63].rstrip("-_")
+
+    def _phases(self) -> List[str]:
+        phases = []
+        if self.vector_store is not None:
+            phases.append("chroma")
+        if self.user_store is not None:
+            phases.extend(MYSQL_PHASES)
+        return phases
+
+    def prepare(self) -> None:
+        """Create the shadow collection and shadow columns if missing"""
+        if self.vector_store is not None:
+            self._shadow_collection = self.vector_store.client.get_or_create_collection(
+                name=self.shadow_collection_name,
+                metadata={"description": "DALI Legal AI document embeddings", "embedding_model": self.target_model}
+            )
+        if self.user_store is not None:
+            conn = self.user_store._get_connection()
+            cursor = conn.cursor()
+            try:
+                shadow_columns = [(table, "embedding_shadow", "LONGBLOB NULL") for table in MYSQL_PHASES]
+                shadow_columns.append(("chunk_store", "content_hash_shadow", "CHAR(64) NULL"))
+                for table, column, definition in shadow_columns:
+                    cursor.execute(
+                        "SELECT COUNT(*) FROM information_schema.columns "
+                        "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+                        (table, column)
+                    )
+                    if not cursor.fetchone()[0]:
+                        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                        logger.info(f"Added {table}.{column}")
+                conn.commit()
+            finally:
+                cursor.close()
+                conn.close()
+
+    def _run_chroma(self, verify: bool = False) -> bool:
+        """
+        Copy the collection into the shadow collection
+
+        verify rewalks from the start and then drops shadow entries whose
+        live entry has been deleted since it was copied.
+        """
+        offset = 0 if verify else self.state["positions"].get("chroma", 0)
+        live_ids = set()
+        pages = self.vector_store._iter_collection_pages(
+            self.batch_size, include=["documents", "metadatas"], offset=offset
+        )
+        for page in pages:
+            if self._stop.is_set():
+                return False
+            started = time.perf_counter()
+            new_ids = [
+                self.vector_store._generate_document_id(text or "", metadata, self.target_model)
+                for text, metadata in zip(page["documents"], page["metadatas"])
+            ]
+            live_ids.update(new_ids)
+            existing = set(self._shadow_collection.get(ids=list(set(new_ids)), include=[])["ids"])
+            todo = {}
+            for i, new_id in enumerate(new_ids):
+                if new_id not in existing and new_id not in todo:
+                    todo[new_id] = i
+            if todo:
+                positions = list(todo.values())
+                vectors = self._encode([page["documents"][i] or "" for i in positions])
+                self._shadow_collection.add(
+                    ids=list(todo),
+                    embeddings=vectors.tolist(),
+                    documents=[page["documents"][i] for i in positions],
+                    metadatas=[
+                        {**(page["metadatas"][i] or {}), "content_hash": content_hash(page["documents"][i] or "", self.target_model)}
+                        for i in positions
+                    ]
+                )
+            offset += len(page["ids"])
+            if not verify:
+                self.state["positions"]["chroma"] = offset
+            self._save_checkpoint()
+            self._throttle(time.perf_counter() - started)
+        if verify:
+            self._prune_chroma_shadow(live_ids)
+        return True
+
+    def _prune_chroma_shadow(self, live_ids: set) -> int:
+        """Delete shadow entries not in live_ids (the shadow ids of every live entry)"""
+        stale = []
+        offset = 0
+        while True:
+            page = self._shadow_collection.get(limit=self.batch_size, offset=offset, include=[])
+            if not page["ids"]:
+                break
+            stale.extend(doc_id for doc_id in page["ids"] if doc_id not in live_ids)
+            offset += len(page["ids"])
+        for start in range(0, len(stale), self.batch_size):
+            self._shadow_collection.delete(ids=stale[start:start + self.batch_size])
+        if stale:
+            logger.info(f"Removed {len(stale)} shadow entries deleted from the live collection")
+        return len(stale)
+
+    def _fetch_rows(self, table: str, last_id: int) -> List[Dict[str, Any]]:
+        where = "id > %s"
+        if table == "document_chunks":
+            # Chunks kept in chunk_store are migrated there; only inline legacy rows here
+            where += " AND store_id IS NULL AND content IS NOT NULL"
+        return self.user_store._execute_query(
+            f"SELECT id, content FROM {table} WHERE {where} ORDER BY id LIMIT %s",
+            (last_id, self.batch_size),
+            fetch_all=True
+        ) or []
+
+    def _document_vectors(self, rows: List[Dict[str, Any]]) -> List[np.ndarray]:
+        """Mean of each document's migrated chunk vectors, or its own text encoded when it has none"""
+        doc_ids = [row["id"] for row in rows]
+        chunk_rows = self.user_store._execute_query(
+            f"SELECT c.document_id, COALESCE(c.embedding_shadow, s.embedding_shadow) AS embedding "
+            f"FROM document_chunks c LEFT JOIN chunk_store s ON s.id = c.store_id "
+            f"WHERE c.document_id IN ({', '.join(['%s'] * len(doc_ids))})",
+            tuple(doc_ids),
+            fetch_all=True
+        ) or []
+        chunk_vectors: Dict[int, List[np.ndarray]] = {}
+        for chunk in chunk_rows:
+            if chunk["embedding"] is not None:
+                chunk_vectors.setdefault(chunk["document_id"], []).append(decode_embedding(chunk["embedding"])[0])
+        missing = [row for row in rows if row["id"] not in chunk_vectors]
+        if missing:
+            for row, vector in zip(missing, self._encode([row["content"] or "" for row in missing])):
+                chunk_vectors[row["id"]] = [vector]
+        return [normalize_vectors(np.mean(chunk_vectors[doc_id], axis=0)) for doc_id in doc_ids]
+
+    def _run_mysql(self, table: str) -> bool:
+        """Fill table.embedding_shadow for rows after the checkpointed id"""
+        while not self._stop.is_set():
+            last_id = self.state["positions"].get(table, 0)
+            rows = self._fetch_rows(table, last_id)
+            if not rows:
+                return True
+            started = time.perf_counter()
+            if table == "documents":
+                vectors = self._document_vectors(rows)
+            else:
+                vectors = self._encode([row["content"] or "" for row in rows])
+            if table == "chunk_store":
+                updates = [
+                    (self._blob(vector), content_hash(row["content"] or "", self.target_model), row["id"])
+                    for row, vector in zip(rows, vectors)
+                ]
+                sql = "UPDATE chunk_store SET embedding_shadow = %s, content_hash_shadow = %s WHERE id = %s"
+            else:
+                updates = [(self._blob(vector), row["id"]) for row, vector in zip(rows, vectors)]
+                sql = f"UPDATE {table} SET embedding_shadow = %s WHERE id = %s"
+            conn = self.user_store._get_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.executemany(sql, updates)
+                conn.commit()
+            finally:
+                cursor.close()
+                conn.close()
+            self.state["positions"][table] = rows[-1]["id"]
+            self._save_checkpoint()
+            self._throttle(time.perf_counter() - started)
+        return False
+
+    def _run_phase(self, phase: str, verify: bool = False) -> bool:
+        if phase == "chroma":
+            return self._run_chroma(verify)
+        return self._run_mysql(phase)
+
+    def run(self) -> bool:
+        """
+        Run (or resume) every pending phase
+
+        Returns:
+            True when all phases are complete, False if stopped early
+        """
+        if self.state.get("switched"):
+            logger.info(f"Re-embedding to {self.target_model} already switched over")
+            return True
+        current = getattr(self.user_store or self.vector_store, "embedding_model_name", None)
+        if current == self.target_model:
+            raise ValueError(f"Stored embeddings already use {self.target_model}")
+        self.prepare()
+        for phase in self._phases():
+            if phase in self.state["completed"]:
+                continue
+            logger.info(f"Re-embedding {phase} with {self.target_model}")
+            if not self._run_phase(phase):
+                logger.info(f"Re-embedding stopped during {phase}; progress saved to {self.checkpoint_path}")
+                return False
+            self.state["completed"].append(phase)
+            self._save_checkpoint()
+        logger.info(f"Re-embedding complete: {self.state['encoded']} vectors encoded; ready to switch over")
+        return True
+
+    def start(self) -> threading.Thread:
+        """Run in a daemon thread; call stop() to pause at the next batch boundary"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="reembedding", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self, wait: bool = True) -> None:
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def switch_over(self) -> None:
+        """
+        Catch up with writes made during the migration, then make the new vectors live
+
+        MySQL shadows are swapped in a single transaction; the Chroma shadow
+        collection, pruned of entries deleted from the live one during the
+        migration, takes over the live name and the old one is kept as
+        "<name>__retired_<timestamp>". Stores passed to the job switch their
+        encoder in-process; other workers must be restarted, and then read
+        the new model from the collection's embedding_model metadata.
+        """
+        pending = [phase for phase in self._phases() if phase not in self.state["completed"]]
+        if pending:
+            raise RuntimeError(f"Re-embedding not complete; pending phases: {pending}")
+        if self.state.get("switched"):
+            return
+        self.prepare()
+        for phase in self._phases():
+            if not self._run_phase(phase, verify=True):
+                raise RuntimeError("Re-embedding stopped during catch-up")
+
+        if self.user_store is not None:
+            conn = self.user_store._get_connection()
+            cursor = conn.cursor()
+            try:
+                conn.start_transaction()
+                if self.user_store.separate_embedding_table:
+                    cursor.execute(
+                        "UPDATE document_embeddings e JOIN documents d ON d.id = e.document_id "
+                        "SET e.embedding = d.embedding_shadow WHERE d.embedding_shadow IS NOT NULL"
+                    )
+                cursor.execute(
+                    "UPDATE documents SET embedding = embedding_shadow, embedding_shadow = NULL "
+                    "WHERE embedding_shadow IS NOT NULL"
+                )
+                cursor.execute(
+                    "UPDATE document_chunks SET embedding = embedding_shadow, embedding_shadow = NULL "
+                    "WHERE embedding_shadow IS NOT NULL"
+                )
+                cursor.execute(
+                    "UPDATE chunk_store SET embedding = embedding_shadow, content_hash = content_hash_shadow, "
+                    "model_name = %s, embedding_shadow = NULL, content_hash_shadow = NULL "
+                    "WHERE embedding_shadow IS NOT NULL",
+                    (self.target_model,)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                conn.close()
+            self.user_store.switch_embedding_model(self.target_model)
+
+        if self.vector_store is not None:
+            live_name = self.vector_store.collection_name
+            self.vector_store.collection.modify(name=f"{live_name}__retired_{int(time.time())}"[:63])
+            self._shadow_collection.modify(name=live_name)
+            self.vector_store.switch_embedding_model(self.target_model)
+
+        self.state["switched"] = True
+        self.state["switched_at"] = datetime.now().isoformat()
+        self._save_checkpoint()
+        logger.info(
+            f"Switched to {self.target_model}; other workers pick it up from the collection metadata on restart "
+            f"(set chroma.embedding_model to it as well)"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+    from .vector_store import VectorStore, MySQLVectorStore
+    from ..utils.config import get_mysql_config, get_knowledge_base_config, get_reembedding_config, get_vector_store_config
+
+    parser = argparse.ArgumentParser(description="Re-embed stored vectors with a new model (resumable)")
+    parser.add_argument("--model", required=True, help="Target embedding model")
+    parser.add_argument("--switch", action="store_true", help="Switch over once every phase is complete")
+    parser.add_argument("--skip-chroma", action="store_true")
+    parser.add_argument("--skip-mysql", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Same collection and current model as the web apps' stores
+    store = VectorStore(**{**get_vector_store_config(), "micro_batching": False})
+    kb_store = None
+    if not args.skip_mysql:
+        kb_store = MySQLVectorStore(
+            get_mysql_config(),
+            embedding_model_name=store.embedding_model_name,
+            **get_knowledge_base_config()
+        )
+    if args.skip_chroma:
+        store = None
+    job = ReembeddingJob(args.model, vector_store=store, user_store=kb_store, **get_reembedding_config())
+    if job.run() and args.switch:
+        job.switch_over()
+    print(json.dumps(job.progress(), indent=2))
@@ -0,0 +1,309 @@
+"""
+DALI Legal AI - Retrieval Module
+Incremental BM25 keyword index and hybrid (BM25 + vector) retrieval with reciprocal rank fusion
+"""
+
+import re
+import math
+import time
+import heapq
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Unicode word characters, so Arabic and English text tokenise the same way
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens, dropping single characters"""
+    if not text:
+        return []
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Hashable]],
+    k: int = 60,
+    weights: Optional[Sequence[float]] = None
+) -> List[Tuple[Hashable, float]]:
+    """
+    Fuse several ranked lists of keys: score = sum(weight / (k + rank))
+
+    Args:
+        rankings: Ranked key lists, best first
+        k: RRF damping constant
+        weights: Optional per-list weights (default 1.0)
+
+    Returns:
+        (key, fused score) pairs, best first
+    """
+    fused: Dict[Hashable, float] = {}
+    for i, ranking in enumerate(rankings):
+        weight = weights[i] if weights else 1.0
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 scoring.
+
+    Only postings (term -> {key: term frequency}) and document lengths are
+    kept, never the text itself. Documents can be added and removed one at a
+    time; queries touch only the postings of their own terms.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._doc_terms: Dict[Hashable, Dict[str, int]] = {}
+        self._doc_len: Dict[Hashable, int] = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+        # (row count, max id) as seen in the backing store when loaded
+        self.signature: Tuple[int, int] = (0, 0)
+        self.checked_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._doc_len
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._doc_len)
+
+    def add(self, key: Hashable, text: str) -> None:
+        """Index (or re-index) one document"""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            if key in self._doc_len:
+                self._remove(key)
+            self._doc_terms[key] = dict(terms)
+            length = sum(terms.values())
+            self._doc_len[key] = length
+            self._total_len += length
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[key] = tf
+
+    def remove(self, keys: Iterable[Hashable]) -> int:
+        """Remove documents; returns the number removed"""
+        removed = 0
+        with self._lock:
+            for key in keys:
+                if key in self._doc_len:
+                    self._remove(key)
+                    removed += 1
+        return removed
+
+    def _remove(self, key: Hashable) -> None:
+        for term in self._doc_terms.pop(key, {}):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_len -= self._doc_len.pop(key, 0)
+
+    def search(self, query: str, top_k: int = 10, allowed_keys=None) -> List[Tuple[Hashable, float]]:
+        """Return (key, BM25 score) pairs for the best top_k documents, optionally only among allowed_keys"""
+        terms = set(tokenize(query))
+        if not terms or top_k <= 0:
+            return []
+        with self._lock:
+            n = len(self._doc_len)
+            if n == 0:
+                return []
+            avgdl = self._total_len / n or 1.0
+            scores: Dict[Hashable, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+                for key, tf in postings.items():
+                    if allowed_keys is not None and key not in allowed_keys:
+                        continue
+                    norm = self.k1 * (1.0 - self.b + self.b * self._doc_len[key] / avgdl)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1.0) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+class HybridRetriever:
+    """
+    Per-user hybrid retrieval over a document or chunk store.
+
+    BM25 indexes are built lazily from text_loader(user_id), which yields
+    (key, text) pairs, and are then kept up to date through add/remove. A
+    cheap signature_loader (row count, max id) is checked at most every
+    refresh_interval seconds to pick up writes made elsewhere. When a
+    vector_search callable is given, its ranking is fused with BM25 using
+    reciprocal rank fusion; fetch(user_id, keys) returns display rows keyed
+    by key. Filtered retrieval passes the allowed keys to vector_search as a
+    fourth argument.
+    """
+
+    def __init__(
+        self,
+        text_loader: Callable[[int], Iterable[Tuple[Hashable, str]]],
+        fetch: Callable[[int, List[Hashable]], Dict[Hashable, Dict[str, Any]]],
+        vector_search: Optional[Callable[[int, str, int], List[Tuple[Hashable, float]]]] = None,
+        signature_loader: Optional[Callable[[int], Tuple[int, int]]] = None,
+        max_users: int = 256,
+        refresh_interval: float = 2.0,
+        rrf_k: int = 60,
+        candidate_multiplier: int = 4
+    ):
+        self.text_loader = text_loader
+        self.fetch = fetch
+        self.vector_search = vector_search
+        self.signature_loader = signature_loader
+        self.max_users = max_users
+        self.refresh_interval = refresh_interval
+        self.rrf_k = rrf_k
+        self.candidate_multiplier = max(1, candidate_multiplier)
+        self._indexes: "OrderedDict[int, BM25Index]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._load_locks: Dict[int, threading.Lock] = {}
+
+    def _build(self, user_id: int) -> BM25Index:
+        started = time.perf_counter()
+        signature = None
+        if self.signature_loader is not None:
+            try:
+                signature = tuple(self.signature_loader(user_id))
+            except Exception as e:
+                logger.warning(f"Could not read keyword index signature for user {user_id}: {e}")
+        index = BM25Index()
+        for key, text in self.text_loader(user_id):
+            index.add(key, text or "")
+        if signature is not None:
+            index.signature = signature
+        logger.info(
+            f"Built keyword index for user {user_id}: {len(index)} entries "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+        return index
+
+    def _is_stale(self, user_id: int, index: BM25Index) -> bool:
+        if self.signature_loader is None:
+            return False
+        now = time.monotonic()
+        if now - index.checked_at < self.refresh_interval:
+            return False
+        index.checked_at = now
+        try:
+            return tuple(self.signature_loader(user_id)) != tuple(index.signature)
+        except Exception as e:
+            logger.warning(f"Could not verify keyword index for user {user_id}: {e}")
+            return False
+
+    def keyword_index(self, user_id: int) -> BM25Index:
+        """Return the user's BM25 index, building or rebuilding it if needed"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+            load_lock = self._load_locks.setdefault(user_id, threading.Lock())
+
+        if index is not None and not self._is_stale(user_id, index):
+            return index
+
+        with load_lock:
+            with self._lock:
+                current = self._indexes.get(user_id)
+            if current is not None and current is not index:
+                return current
+            index = self._build(user_id)
+            with self._lock:
+                self._indexes[user_id] = index
+                self._indexes.move_to_end(user_id)
+                while len(self._indexes) > self.max_users:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._load_locks.pop(evicted, None)
+            return index
+
+    def add(self, user_id: int, key: Hashable, text: str) -> None:
+        """Index a new entry for a loaded user (no-op if not loaded)"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            index.add(key, text)
+            count, max_id = index.signature
+            index.signature = (count + 1, max(max_id, key) if isinstance(key, int) else max_id)
+
+    def remove(self, user_id: int, keys: Iterable[Hashable]) -> None:
+        """Drop entries for a loaded user (no-op if not loaded)"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+        if index is not None:
+            keys = list(keys)
+            removed = index.remove(keys)
+            if removed:
+                count, max_id = index.signature
+                if max_id in keys:
+                    max_id = max((key for key in index.keys() if isinstance(key, int)), default=0)
+                index.signature = (count - removed, max_id)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """Drop one user's keyword index, or every index when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(user_id, None)
+
+    def retrieve(self, user_id: int, query: str, k: int = 5, allowed_keys=None) -> List[Dict[str, Any]]:
+        """
+        Hybrid retrieval for one user
+
+        Args:
+            user_id: Owner of the corpus
+            query: Natural language query
+            k: Number of results
+            allowed_keys: Optional keys to restrict both rankings to (a pre-filter)
+
+        Returns:
+            Rows from fetch() with bm25_score, similarity_score and rrf_score
+            added, best first (by rrf_score)
+        """
+        candidates = k * self.candidate_multiplier
+        if allowed_keys is not None:
+            allowed_keys = {key.item() if hasattr(key, 'item') else key for key in allowed_keys}
+        keyword_hits = self.keyword_index(user_id).search(query, candidates, allowed_keys)
+        vector_hits: List[Tuple[Hashable, float]] = []
+        if self.vector_search is not None:
+            try:
+                if allowed_keys is None:
+                    vector_hits = self.vector_search(user_id, query, candidates)
+                else:
+                    vector_hits = self.vector_search(user_id, query, candidates, list(allowed_keys))
+            except Exception as e:
+                logger.warning(f"Vector search failed, using keyword results only: {e}")
+
+        rankings = [[key for key, _ in keyword_hits]]
+        if vector_hits:
+            rankings.append([key for key, _ in vector_hits])
+        fused = reciprocal_rank_fusion(rankings, k=self.rrf_k)[:k]
+
+        rows = self.fetch(user_id, [key for key, _ in fused])
+        bm25_scores = dict(keyword_hits)
+        similarity_scores = dict(vector_hits)
+        results = []
+        for key, rrf_score in fused:
+            row = rows.get(key)
+            if row is None:
+                continue  # deleted since the index was built
+            row['bm25_score'] = bm25_scores.get(key, 0.0)
+            row['similarity_score'] = similarity_scores.get(key, 0.0)
+            row['rrf_score'] = rrf_score
+            results.append(row)
+        return results
@@ -9,15 +9,26 @@ os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
 os.environ.setdefault("PYTORCH_FORCE_CPU", "1")
 
 import logging
+import time
+import datetime
 import hashlib
+import asyncio
+import itertools
 from typing import List, Dict, Optional, Tuple, Any
 from pathlib import Path
-import chromadb
-from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
+from .embedding_index import EmbeddingIndexCache, UserEmbeddingIndex, normalize_vectors
+from .embedding_codec import encode_embedding, decode_embedding
+from .ann_index import AnnIndexManager
+from .retrieval import HybridRetriever
+from .embedding_cache import QueryEmbeddingCache, get_query_embedding_cache, content_hash
+from .model_registry import get_chroma_client, get_embedding_model, get_embedding_executor, get_shared_collection_stats
+from .collection_stats import CollectionStats
+from .embedding_executor import EmbeddingExecutor
+from .chunking import create_token_chunker
 try:
     import mysql.connector
     MYSQL_AVAILABLE = True
@@ -47,61 +58,89 @@ class VectorStore:
         self,
         persist_directory: str = "./data/embeddings",
         collection_name: str = "legal_documents",
-        embedding_model: str = "paraphrase-multilingual-MiniLM-L12-v2"  # Multilingual model
+        embedding_model: str = "paraphrase-multilingual-MiniLM-L12-v2",  # Multilingual model
+        embedding_batch_size: int = 32,
+        query_cache: Optional[QueryEmbeddingCache] = None,
+        query_cache_size: int = 1024,
+        query_cache_ttl: Optional[float] = None,
+        embedding_backend: str = "torch",
+        onnx_quantize: bool = True,
+        onnx_cache_dir: str = "./data/models/onnx",
+        micro_batching: bool = True,
+        micro_batch_size: int = 32,
+        micro_batch_wait_ms: float = 5.0,
+        chunking: str = "tokens",
+        chunk_overlap_tokens: int = 16
     ):
         self.persist_directory = Path(persist_directory)
         self.collection_name = collection_name
         self.embedding_model_name = embedding_model
+        self.embedding_batch_size = max(1, int(embedding_batch_size))
+        # "torch" (SentenceTransformer) or "onnx" (ONNX Runtime, optionally int8)
+        self.embedding_backend = embedding_backend
+        self.onnx_quantize = onnx_quantize
+        self.onnx_cache_dir = onnx_cache_dir
+        # Query encodes are coalesced into micro-batches on a shared worker thread
+        self.micro_batching = micro_batching
+        self.micro_batch_size = micro_batch_size
+        self.micro_batch_wait_ms = micro_batch_wait_ms
+        # Query embeddings are shared process-wide unless a cache is passed in
+        self.query_cache = query_cache if query_cache is not None else get_query_embedding_cache(query_cache_size, query_cache_ttl)
+        self.last_ingest_stats: Dict[str, Any] = {}
         
         # Create persist directory if it doesn't exist
         self.persist_directory.mkdir(parents=True, exist_ok=True)
         
-        # Initialize Chroma client
-        self.client = chromadb.PersistentClient(
-            path=str(self.persist_directory),
-            settings=Settings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
-        )
-        
-        # Initialize embedding model (force CPU to avoid device mapping issues)
-        self.embedding_model = self._init_sentence_transformer(self.embedding_model_name)
+        # Chroma client and encoder come from the process-wide registry, so every
+        # VectorStore on the same path/model shares one instance
+        self.client = get_chroma_client(self.persist_directory)
+        self._embedding_model: Optional[SentenceTransformer] = None
         
         # Get or create collection
         self.collection = self._get_or_create_collection()
-        
-        # Initialize text splitter
-        # Use larger chunk size and overlap for better Arabic context
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=2000,
-            chunk_overlap=400,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
+        self._use_collection_model()
+        # Exact counters maintained on add/delete (see get_collection_stats)
+        self.stats = get_shared_collection_stats(
+            (str(self.persist_directory.resolve()), self.collection_name), self._load_stats
         )
-    
-    def _init_sentence_transformer(self, model_name: str) -> SentenceTransformer:
-        """Robust initialization for SentenceTransformer on CPU."""
-        last_err = None
-        candidates = []
-        # Try given name and hub-prefixed variant
-        candidates.append(model_name)
-        if "/" not in model_name:
-            candidates.append(f"sentence-transformers/{model_name}")
         
-        for candidate in candidates:
-            try:
-                logger.info(f"Loading SentenceTransformer model: {candidate} on CPU")
-                model = SentenceTransformer(candidate, device='cpu')
-                # Warmup encode to materialize tensors off meta device
-                _ = model.encode("warmup", convert_to_tensor=False)
-                return model
-            except Exception as e:
-                last_err = e
-                logger.warning(f"Load failed for '{candidate}': {e}")
-        
-        logger.error(f"Failed to load SentenceTransformer model '{model_name}': {last_err}")
-        raise last_err
+        # Text splitter: "tokens" sizes chunks to the encoder window in model
+        # word-pieces; "characters" keeps the original 2000-character splitter
+        self.chunking = chunking
+        self.chunk_overlap_tokens = chunk_overlap_tokens
+        self._text_splitter = None
+    
+    @property
+    def text_splitter(self):
+        """Chunker used for ingest, built on first use from the encoder's tokenizer"""
+        if self._text_splitter is None:
+            splitter = None
+            if self.chunking == "tokens":
+                splitter = create_token_chunker(self.embedding_model, overlap_tokens=self.chunk_overlap_tokens)
+                if splitter is None:
+                    logger.warning("Encoder has no tokenizer; falling back to character chunking")
+            if splitter is None:
+                # Use larger chunk size and overlap for better Arabic context
+                splitter = RecursiveCharacterTextSplitter(
+                    chunk_size=2000,
+                    chunk_overlap=400,
+                    length_function=len,
+                    separators=["\n\n", "\n", ". ", " ", ""]
+                )
+            self._text_splitter = splitter
+        return self._text_splitter
+    
+    @property
+    def embedding_model(self) -> SentenceTransformer:
+        """Shared encoder for the configured backend, loaded on first use (CPU only)"""
+        if self._embedding_model is None:
+            self._embedding_model = get_embedding_model(
+                self.embedding_model_name,
+                backend=self.embedding_backend,
+                onnx_quantize=self.onnx_quantize,
+                onnx_cache_dir=self.onnx_cache_dir
+            )
+        return self._embedding_model
     
     def _get_or_create_collection(self):
         """Get existing collection or create new one"""
@@ -113,26 +152,242 @@ class VectorStore:
             # Create new collection
             collection = self.client.create_collection(
                 name=self.collection_name,
-                metadata={"description": "DALI Legal AI document embeddings"}
+                metadata={"description": "DALI Legal AI document embeddings", "embedding_model": self.embedding_model_name}
             )
             logger.info(f"Created new collection: {self.collection_name}")
         
         return collection
+
+    def _use_collection_model(self) -> None:
+        """Encode with the model recorded on the collection (set at creation and by a re-embedding switch-over)"""
+        collection_model = (getattr(self.collection, 'metadata', None) or {}).get('embedding_model')
+        if collection_model and collection_model != self.embedding_model_name:
+            logger.warning(
+                f"Collection {self.collection_name} holds {collection_model} vectors; "
+                f"using it instead of the configured {self.embedding_model_name}"
+            )
+            self.embedding_model_name = collection_model
     
+    def switch_embedding_model(self, model_name: str) -> None:
+        """
+        Use a new encoder and reopen the collection (after a re-embedding switch-over)
+
+        Query cache entries are keyed by model name, so old vectors are never reused.
+        """
+        self.embedding_model_name = model_name
+        self._embedding_model = None
+        self._text_splitter = None
+        self.collection = self._get_or_create_collection()
+        self.stats.rebuild(self._iter_collection_pages(include=["metadatas", "documents"]))
+        logger.info(f"Switched {self.collection_name} to embedding model {model_name}")
+
+    def _load_stats(self) -> CollectionStats:
+        """Saved counters, recounted if missing, out of step with the collection or internally inconsistent"""
+        path = self.persist_directory / f"{self.collection_name}_stats.json"
+        stats = CollectionStats.load(path)
+        count = self.collection.count()
+        if stats is None or stats.chunks != count or not stats.is_consistent():
+            stats = stats or CollectionStats(path)
+            stats.rebuild(self._iter_collection_pages(include=["metadatas", "documents"]))
+            logger.info(f"Recounted stats for {self.collection_name}: {count} entries")
+        return stats
+
+    def _iter_collection_pages(
+        self,
+        page_size: int = 1000,
+        include: Optional[List[str]] = None,
+        where: Optional[Dict] = None,
+        offset: int = 0
+    ):
+        """Yield collection.get() results one page at a time"""
+        while True:
+            page = self.collection.get(
+                limit=page_size, offset=offset, where=where, include=include or ["metadatas"]
+            )
+            if not page['ids']:
+                break
+            yield page
+            offset += len(page['ids'])
+            if len(page['ids']) < page_size:
+                break
+
     def _generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for text using SentenceTransformer"""
+        """Generate embedding for text using SentenceTransformer (cached per model and text)"""
+        try:
+            return self.query_cache.get_or_compute(self.embedding_model_name, text, self._encode_text)
+        except Exception as e:
+            logger.error(f"Error generating embedding: {e}")
+            raise
+
+    @property
+    def embedding_executor(self) -> EmbeddingExecutor:
+        """
+        Micro-batching executor shared by every VectorStore using the same encoder
+
+        The executor encodes with the registry encoder for its own key, never
+        through this instance, so it stays on its model after any store
+        switches models and does not keep the first store alive.
+        """
+        model_name, backend, quantize = self.embedding_model_name, self.embedding_backend, bool(self.onnx_quantize)
+        onnx_cache_dir, batch_size = self.onnx_cache_dir, self.embedding_batch_size
+
+        def encode_batch(texts: List[str]):
+            encoder = get_embedding_model(model_name, backend=backend, onnx_quantize=quantize, onnx_cache_dir=onnx_cache_dir)
+            return encoder.encode(texts, batch_size=batch_size, convert_to_tensor=False, show_progress_bar=False)
+
+        return get_embedding_executor(
+            (model_name, backend, quantize),
+            lambda: EmbeddingExecutor(
+                encode_batch,
+                max_batch_size=self.micro_batch_size,
+                max_wait_ms=self.micro_batch_wait_ms
+            )
+        )
+
+    def _encode_text(self, text: str):
+        if self.micro_batching:
+            return self.embedding_executor.embed(text)
+        return self.embedding_model.encode(text, convert_to_tensor=False)
+
+    def _encode_batch(self, texts: List[str]):
+        return self.embedding_model.encode(
+            texts,
+            batch_size=self.embedding_batch_size,
+            convert_to_tensor=False,
+            show_progress_bar=False
+        )
+
+    async def agenerate_embedding(self, text: str) -> List[float]:
+        """Awaitable query embedding; the encode never runs on the event loop"""
+        cached = self.query_cache.get(self.embedding_model_name, text)
+        if cached is not None:
+            return cached
         try:
-            embedding = self.embedding_model.encode(text, convert_to_tensor=False)
-            return embedding.tolist()
+            if self.micro_batching:
+                embedding = await self.embedding_executor.aembed(text)
+            else:
+                embedding = (await asyncio.to_thread(self.embedding_model.encode, text, convert_to_tensor=False)).tolist()
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             raise
+        self.query_cache.put(self.embedding_model_name, text, embedding)
+        return embedding
+    
+    def _generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for many texts with a single batched encode call"""
+        if not texts:
+            return []
+        try:
+            return self._encode_batch(texts).tolist()
+        except Exception as e:
+            logger.error(f"Error generating batch embeddings: {e}")
+            raise
+    
+    def _add_to_collection(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict]
+    ) -> int:
+        """
+        Embed and write the entries Chroma does not hold yet
+
+        Ids are per source (see _generate_document_id), so entries already in
+        the collection are skipped. New entries whose text is already stored
+        under another source reuse that embedding (found by the content_hash
+        metadata field); only unseen text is encoded. Writes are split only
+        when the client's max batch size is exceeded.
+
+        Returns:
+            Number of entries written
+        """
+        # Chroma rejects duplicate ids inside a single add
+        seen = set()
+        keep = []
+        for i, doc_id in enumerate(ids):
+            if doc_id not in seen:
+                seen.add(doc_id)
+                keep.append(i)
+        existing = set(self.collection.get(ids=list(seen), include=[])['ids']) if seen else set()
+        keep = [i for i in keep if ids[i] not in existing]
+        if not keep:
+            return 0
+        ids = [ids[i] for i in keep]
+        documents = [documents[i] for i in keep]
+        hashes = [content_hash(document, self.embedding_model_name) for document in documents]
+        metadatas = [{**(metadatas[i] or {}), 'content_hash': h} for i, h in zip(keep, hashes)]
+        embeddings = self._embeddings_for_hashes(hashes, documents)
+        
+        try:
+            max_batch = self.client.get_max_batch_size()
+        except Exception:
+            max_batch = len(ids) or 1
+        
+        for start in range(0, len(ids), max_batch):
+            end = start + max_batch
+            self.collection.add(
+                embeddings=embeddings[start:end],
+                documents=documents[start:end],
+                metadatas=metadatas[start:end],
+                ids=ids[start:end]
+            )
+            self.stats.apply(metadatas[start:end], documents[start:end])
+        return len(ids)
+
+    def _embeddings_for_hashes(self, hashes: List[str], documents: List[str]) -> List[List[float]]:
+        """Embeddings for documents, copied from stored entries with the same content hash or encoded once"""
+        known = {}
+        unique = list(set(hashes))
+        try:
+            stored = self.collection.get(
+                where={'content_hash': {'$in': unique}}, include=['embeddings', 'metadatas']
+            )
+            stored_embeddings = stored.get('embeddings')
+            for metadata, embedding in zip(stored.get('metadatas') or [], [] if stored_embeddings is None else stored_embeddings):
+                if metadata and embedding is not None:
+                    known.setdefault(metadata.get('content_hash'), np.asarray(embedding, dtype=np.float32).tolist())
+        except Exception as e:
+            logger.warning(f"Could not look up stored embeddings, encoding all new entries: {e}")
+        missing = {}
+        for h, document in zip(hashes, documents):
+            if h not in known and h not in missing:
+                missing[h] = document
+        if missing:
+            known.update(zip(missing, self._generate_embeddings(list(missing.values()))))
+        return [known[h] for h in hashes]
+    
+    def _record_ingest_stats(self, chunk_count: int, started: float) -> Dict[str, Any]:
+        """Record and log ingest throughput for the last add operation"""
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        self.last_ingest_stats = {
+            'chunks': chunk_count,
+            'seconds': round(elapsed, 4),
+            'chunks_per_sec': round(chunk_count / elapsed, 2),
+            'batch_size': self.embedding_batch_size
+        }
+        logger.info(
+            f"Ingested {chunk_count} chunks in {elapsed:.2f}s "
+            f"({self.last_ingest_stats['chunks_per_sec']} chunks/sec, batch_size={self.embedding_batch_size})"
+        )
+        return self.last_ingest_stats
     
-    def _generate_document_id(self, content: str, metadata: Dict) -> str:
-        """Generate unique ID for document based on content and metadata"""
-        content_hash = hashlib.md5(content.encode()).hexdigest()
-        source = metadata.get('source', 'unknown')
-        return f"{source}_{content_hash[:8]}"
+    def _generate_document_id(
+        self,
+        content: str,
+        metadata: Optional[Dict] = None,
+        model_name: Optional[str] = None
+    ) -> str:
+        """
+        Entry ID: SHA-256 of the normalised text and the embedding model, plus a source tag
+
+        The same text added from two sources gets two entries (sharing one
+        embedding), so deleting one source never removes the other's copy.
+        """
+        doc_id = content_hash(content, model_name or self.embedding_model_name)
+        source = (metadata or {}).get('source')
+        if source:
+            doc_id += '-' + hashlib.sha256(str(source).encode('utf-8')).hexdigest()[:16]
+        return doc_id
     
     def add_document(
         self,
@@ -155,44 +410,34 @@ class VectorStore:
             metadata = {}
         
         try:
+            started = time.perf_counter()
             if chunk_documents:
                 # Split document into chunks
                 chunks = self.text_splitter.split_text(content)
+                chunk_metadatas = []
                 document_ids = []
                 
                 for i, chunk in enumerate(chunks):
                     chunk_metadata = metadata.copy()
                     chunk_metadata['chunk_index'] = i
                     chunk_metadata['total_chunks'] = len(chunks)
-                    
-                    doc_id = self._generate_document_id(chunk, chunk_metadata)
-                    embedding = self._generate_embedding(chunk)
-                    
-                    self.collection.add(
-                        embeddings=[embedding],
-                        documents=[chunk],
-                        metadatas=[chunk_metadata],
-                        ids=[doc_id]
-                    )
-                    
-                    document_ids.append(doc_id)
+                    chunk_metadatas.append(chunk_metadata)
+                    document_ids.append(self._generate_document_id(chunk, chunk_metadata))
                 
-                logger.info(f"Added document with {len(chunks)} chunks")
+                # Encode only chunks not stored yet, in one call, and write them in one add
+                written = self._add_to_collection(document_ids, chunks, chunk_metadatas)
+                
+                self._record_ingest_stats(written, started)
+                logger.info(f"Added document with {len(chunks)} chunks ({len(chunks) - written} already stored)")
                 return document_ids
             
             else:
                 # Add entire document as single entry
                 doc_id = self._generate_document_id(content, metadata)
-                embedding = self._generate_embedding(content)
-                
-                self.collection.add(
-                    embeddings=[embedding],
-                    documents=[content],
-                    metadatas=[metadata],
-                    ids=[doc_id]
-                )
+                written = self._add_to_collection([doc_id], [content], [metadata])
                 
-                logger.info(f"Added single document: {doc_id}")
+                self._record_ingest_stats(written, started)
+                logger.info(f"Added single document: {doc_id}" + ("" if written else " (already stored)"))
                 return [doc_id]
                 
         except Exception as e:
@@ -210,35 +455,26 @@ class VectorStore:
         Args:
             documents: List of LangChain Document objects
             batch_size: Number of documents to process in each batch
+                (encoder batch size is controlled by embedding_batch_size)
             
         Returns:
             List of all document IDs that were added
         """
         all_document_ids = []
+        started = time.perf_counter()
         
         for i in range(0, len(documents), batch_size):
             batch = documents[i:i + batch_size]
-            batch_ids = []
-            batch_embeddings = []
-            batch_contents = []
-            batch_metadatas = []
-            
-            for doc in batch:
-                doc_id = self._generate_document_id(doc.page_content, doc.metadata)
-                embedding = self._generate_embedding(doc.page_content)
-                
-                batch_ids.append(doc_id)
-                batch_embeddings.append(embedding)
-                batch_contents.append(doc.page_content)
-                batch_metadatas.append(doc.metadata)
+            batch_contents = [doc.page_content for doc in batch]
+            batch_metadatas = [doc.metadata for doc in batch]
+            batch_ids = [
+                self._generate_document_id(doc.page_content, doc.metadata)
+                for doc in batch
+            ]
             
             try:
-                self.collection.add(
-                    embeddings=batch_embeddings,
-                    documents=batch_contents,
-                    metadatas=batch_metadatas,
-                    ids=batch_ids
-                )
+                # One vectorised encode (of new content only) and one write for the whole batch
+                self._add_to_collection(batch_ids, batch_contents, batch_metadatas)
                 
                 all_document_ids.extend(batch_ids)
                 logger.info(f"Added batch of {len(batch)} documents")
@@ -247,6 +483,7 @@ class VectorStore:
                 logger.error(f"Error adding document batch: {e}")
                 raise
         
+        self._record_ingest_stats(len(all_document_ids), started)
         return all_document_ids
     
     def search(
@@ -279,17 +516,7 @@ class VectorStore:
                 search_kwargs["where"] = filter_metadata
             
             results = self.collection.query(**search_kwargs)
-            
-            # Format results
-            formatted_results = []
-            for i in range(len(results['documents'][0])):
-                result = {
-                    'content': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'score': 1 - results['distances'][0][i],  # Convert distance to similarity
-                    'id': results['ids'][0][i] if 'ids' in results else None
-                }
-                formatted_results.append(result)
+            formatted_results = self._format_query_results(results, 0)
             
             logger.info(f"Found {len(formatted_results)} results for query")
             return formatted_results
@@ -298,6 +525,68 @@ class VectorStore:
             logger.error(f"Error searching documents: {e}")
             return []
     
+    def search_many(
+        self,
+        queries: List[str],
+        k: int = 5,
+        filters: Optional[Dict] = None
+    ) -> List[List[Dict]]:
+        """
+        Search for several queries at once
+        
+        All queries are embedded in one batch (cache hits reused) and sent to
+        Chroma in a single query call.
+        
+        Args:
+            queries: Search query texts
+            k: Number of results per query
+            filters: Metadata filters applied to every query
+            
+        Returns:
+            One result list per query, aligned with the input
+        """
+        if not queries:
+            return []
+        try:
+            search_kwargs = {
+                "query_embeddings": self._generate_query_embeddings(queries),
+                "n_results": k,
+                "include": ["documents", "metadatas", "distances"]
+            }
+            if filters:
+                search_kwargs["where"] = filters
+            
+            results = self.collection.query(**search_kwargs)
+            return [self._format_query_results(results, i) for i in range(len(queries))]
+            
+        except Exception as e:
+            logger.error(f"Error searching documents: {e}")
+            return [[] for _ in queries]
+    
+    def _generate_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """Embed many queries: cached ones are reused, the rest are encoded in one batch"""
+        embeddings = [self.query_cache.get(self.embedding_model_name, query) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = self._encode_batch([queries[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                embeddings[i] = vector.tolist()
+                self.query_cache.put(self.embedding_model_name, queries[i], embeddings[i])
+        return embeddings
+    
+    @staticmethod
+    def _format_query_results(results: Dict, i: int) -> List[Dict]:
+        """Format the i-th query of a Chroma query response"""
+        formatted_results = []
+        for j in range(len(results['documents'][i])):
+            formatted_results.append({
+                'content': results['documents'][i][j],
+                'metadata': results['metadatas'][i][j],
+                'score': 1 - results['distances'][i][j],  # Convert distance to similarity
+                'id': results['ids'][i][j] if 'ids' in results else None
+            })
+        return formatted_results
+    
     def search_by_document_type(
         self,
         query: str,
@@ -331,7 +620,9 @@ class VectorStore:
     def delete_document(self, document_id: str) -> bool:
         """Delete a document by ID"""
         try:
+            existing = self.collection.get(ids=[document_id], include=["metadatas", "documents"])
             self.collection.delete(ids=[document_id])
+            self.stats.apply(existing['metadatas'], existing['documents'], sign=-1)
             logger.info(f"Deleted document: {document_id}")
             return True
         except Exception as e:
@@ -343,11 +634,12 @@ class VectorStore:
         try:
             results = self.collection.get(
                 where={"source": source},
-                include=["documents"]
+                include=["documents", "metadatas"]
             )
             
             if results['ids']:
                 self.collection.delete(ids=results['ids'])
+                self.stats.apply(results['metadatas'], results['documents'], sign=-1)
                 logger.info(f"Deleted {len(results['ids'])} documents from source: {source}")
                 return len(results['ids'])
             
@@ -358,32 +650,19 @@ class VectorStore:
             return 0
     
     def get_collection_stats(self) -> Dict:
-        """Get statistics about the collection"""
+        """
+        Get statistics about the collection
+
+        Counts come from counters maintained on every add and delete, so they
+        are exact and no entries are read. total_documents counts documents
+        (first chunks); total_chunks counts every entry.
+        """
         try:
-            count = self.collection.count()
-            
-            # Get sample of metadata to analyze document types
-            sample_results = self.collection.get(
-                limit=min(100, count),
-                include=["metadatas"]
-            )
-            
-            document_types = {}
-            sources = {}
-            
-            for metadata in sample_results['metadatas']:
-                doc_type = metadata.get('document_type', 'unknown')
-                source = metadata.get('source', 'unknown')
-                
-                document_types[doc_type] = document_types.get(doc_type, 0) + 1
-                sources[source] = sources.get(source, 0) + 1
-            
             return {
-                'total_documents': count,
-                'document_types': document_types,
-                'sources': sources,
+                **self.stats.to_dict(),
                 'embedding_model': self.embedding_model_name,
-                'collection_name': self.collection_name
+                'collection_name': self.collection_name,
+                'query_cache': self.query_cache.stats()
             }
             
         except Exception as e:
@@ -406,29 +685,101 @@ class VectorStore:
             self.client.delete_collection(name=self.collection_name)
             self.collection = self.client.create_collection(
                 name=self.collection_name,
-                metadata={"description": "DALI Legal AI document embeddings"}
+                metadata={"description": "DALI Legal AI document embeddings", "embedding_model": self.embedding_model_name}
             )
+            self.stats.reset()
             logger.info(f"Reset collection: {self.collection_name}")
             return True
         except Exception as e:
             logger.error(f"Error resetting collection: {e}")
             return False
 
-    def list_all_documents(self) -> list:
-        """Return all documents and their metadata (with content preview) in the collection."""
+    @staticmethod
+    def _listing_rows(page: Dict, preview_chars: int) -> List[Dict]:
+        """Listing entries for one collection page; previews are cut only when content was fetched"""
+        documents = page.get("documents")
+        rows = []
+        for i, doc_id in enumerate(page["ids"]):
+            metadata = page["metadatas"][i] or {}
+            row = {
+                "id": doc_id,
+                "title": metadata.get("title", "-"),
+                "type": metadata.get("document_type", "-"),
+                "source": metadata.get("source", "-"),
+                "metadata": metadata,
+            }
+            if documents is not None:
+                row["content_preview"] = (documents[i] or "")[:preview_chars]
+            rows.append(row)
+        return rows
+
+    def iter_documents(
+        self,
+        page_size: int = 500,
+        include_content: bool = False,
+        where: Optional[Dict] = None,
+        preview_chars: int = 200
+    ):
+        """
+        Stream listing entries page by page
+
+        Only one page of ids and metadata is held at a time; chunk text is
+        fetched only when include_content is set, and then only kept as a
+        preview.
+
+        Args:
+            page_size: Entries fetched per collection.get() call
+            include_content: Also fetch text and add content_preview
+            where: Optional Chroma metadata filter
+            preview_chars: Preview length
+
+        Yields:
+            Dicts with id, title, type, source, metadata (and content_preview)
+        """
+        include = ["metadatas", "documents"] if include_content else ["metadatas"]
+        for page in self._iter_collection_pages(page_size, include, where):
+            yield from self._listing_rows(page, preview_chars)
+
+    def list_documents_page(
+        self,
+        offset: int = 0,
+        limit: int = 100,
+        include_content: bool = False,
+        where: Optional[Dict] = None,
+        preview_chars: int = 200
+    ) -> Dict:
+        """
+        One page of listing entries for paginated views
+
+        Returns:
+            Dict with documents, offset, next_offset (None on the last page)
+            and total (entries in the collection)
+        """
+        include = ["metadatas", "documents"] if include_content else ["metadatas"]
+        try:
+            page = self.collection.get(limit=limit, offset=offset, where=where, include=include)
+        except Exception as e:
+            logger.error(f"Error listing documents at offset {offset}: {e}")
+            return {"documents": [], "offset": offset, "next_offset": None, "total": 0}
+        rows = self._listing_rows(page, preview_chars)
+        return {
+            "documents": rows,
+            "offset": offset,
+            "next_offset": offset + len(rows) if len(rows) == limit else None,
+            "total": self.stats.to_dict()["total_chunks"],
+        }
+
+    def list_all_documents(self, limit: Optional[int] = None, page_size: int = 500) -> list:
+        """
+        Return documents and their metadata (with content preview) in the collection.
+
+        Built on iter_documents, so text is read page by page and only the
+        200-character previews are kept. Use iter_documents directly to avoid
+        holding the listing itself for very large collections.
+        """
         try:
-            results = self.collection.get(include=["documents", "metadatas"])
-            docs = []
-            for i in range(len(results["documents"])):
-                docs.append({
-                    "id": results["ids"][i] if "ids" in results else None,
-                    "title": results["metadatas"][i].get("title", "-"),
-                    "type": results["metadatas"][i].get("document_type", "-"),
-                    "source": results["metadatas"][i].get("source", "-"),
-                    "content_preview": results["documents"][i][:200],
-                    "metadata": results["metadatas"][i],
-                })
-            return docs
+            rows = self.iter_documents(page_size=page_size, include_content=True)
+            return list(itertools.islice(rows, limit)) if limit is not None else list(rows)
         except Exception as e:
             logger.error(f"Error listing all documents: {e}")
             return []
@@ -465,9 +816,54 @@ class MySQLVectorStore:
     """
     Per-user knowledge base using MySQL for document, chunk, and embedding storage.
     """
-    def __init__(self, mysql_config):
+    def __init__(self, mysql_config, use_memory_index=True, index_refresh_seconds=2.0, max_cached_users=256,
+                 separate_embedding_table=False, embedding_format='float16', embedding_model_name=None,
+                 ann_index=False, ann_directory='./data/embeddings/ann_index', ann_nprobe=8,
+                 ann_exact_threshold=2048, ann_rebuild_threshold=0.25, query_embedder=None,
+                 batch_query_embedder=None, chunk_embedder=None):
         if not MYSQL_AVAILABLE:
             raise ImportError("MySQL connector not available")
+        # Storage precision (float32/float16/int8) and model tag written into each embedding blob
+        self.embedding_format = embedding_format
+        self.embedding_model_name = embedding_model_name
+        # Per-user in-memory embedding matrices, loaded lazily on first search
+        self.use_memory_index = use_memory_index
+        # Score from a narrow (document_id, user_id, embedding) table instead of the wide documents rows
+        self.separate_embedding_table = separate_embedding_table
+        # Optional persistent IVF-flat index per user, retrained in the background as the corpus drifts
+        self.ann_manager = None
+        self.chunk_ann_manager = None
+        if ann_index:
+            ann_options = dict(
+                nprobe=ann_nprobe,
+                exact_threshold=ann_exact_threshold,
+                rebuild_threshold=ann_rebuild_threshold,
+                model_name=embedding_model_name
+            )
+            self.ann_manager = AnnIndexManager(directory=ann_directory, **ann_options)
+            self.chunk_ann_manager = AnnIndexManager(directory=os.path.join(ann_directory, 'chunks'), **ann_options)
+        self._index_cache = self._create_index_cache(
+            self._load_user_embeddings, self._user_embedding_signature,
+            self.ann_manager, max_cached_users, index_refresh_seconds
+        )
+        # Chunk-level index over document_chunks, used by search_chunks
+        self._chunk_index_cache = self._create_index_cache(
+            self._load_user_chunk_embeddings, self._user_chunk_signature,
+            self.chunk_ann_manager, max_cached_users, index_refresh_seconds
+        )
+        # Hybrid BM25 + vector retrieval over chunks; query_embedder maps text to a query vector
+        self.query_embedder = query_embedder
+        self.batch_query_embedder = batch_query_embedder
+        # Batch encoder for chunk text not yet in the shared chunk_store (see embed_chunks)
+        self.chunk_embedder = chunk_embedder
+        self.retriever = HybridRetriever(
+            text_loader=self._load_user_chunk_texts,
+            fetch=self._fetch_chunks,
+            vector_search=self._chunk_vector_search,
+            signature_loader=self._user_chunk_text_signature,
+            max_users=max_cached_users,
+            refresh_interval=index_refresh_seconds
+        )
         try:
             # Store original config for fallback connections
             self.mysql_config = mysql_config.copy()
@@ -489,6 +885,18 @@ class MySQLVectorStore:
             print(f"MySQL connection failed: {e}")
             raise
 
+    @staticmethod
+    def _create_index_cache(loader, signature_loader, ann_manager, max_users, refresh_interval):
+        return EmbeddingIndexCache(
+            loader=loader,
+            signature_loader=signature_loader,
+            max_users=max_users,
+            refresh_interval=refresh_interval,
+            builder=ann_manager.build if ann_manager else None,
+            restore=ann_manager.restore if ann_manager else None,
+            after_build=ann_manager.after_build if ann_manager else None
+        )
+
     def _get_connection(self):
         """Get a fresh connection from the pool"""
         try:
@@ -502,7 +910,7 @@ class MySQLVectorStore:
             # Fallback to creating a new connection
             return mysql.connector.connect(**self.mysql_config)
     
-    def _execute_query(self, query, params=None, fetch_one=False, fetch_all=False):
+    def _execute_query(self, query, params=None, fetch_one=False, fetch_all=False, commit=False):
         """Execute a query with proper connection handling"""
         conn = None
         cursor = None
@@ -516,6 +924,8 @@ class MySQLVectorStore:
             elif fetch_all:
                 return cursor.fetchall()
             else:
+                if commit:
+                    conn.commit()
                 return cursor.rowcount
         except Exception as e:
             print(f"Query execution error: {e}")
@@ -565,6 +975,12 @@ class MySQLVectorStore:
                 FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
             ) ENGINE=InnoDB;
         ''')
+            if self.separate_embedding_table:
+                self._ensure_embedding_table(cursor)
+            self._ensure_chunk_table(cursor)
+            self._ensure_chunk_store(cursor)
+            self._ensure_search_indexes(cursor)
+            self._ensure_stats_table(cursor)
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS shared_documents (
                 id INT AUTO_INCREMENT PRIMARY KEY,
@@ -599,6 +1015,7 @@ class MySQLVectorStore:
                     FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
                 ) ENGINE=InnoDB;
         ''')
+            self._ensure_conversation_memory(cursor)
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS user_chats (
                     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -642,6 +1059,263 @@ class MySQLVectorStore:
             if conn:
                 conn.close()
 
+    def _ensure_embedding_table(self, cursor):
+        """Create the narrow embeddings table and backfill it from documents on first use"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_embeddings (
+                document_id INT PRIMARY KEY,
+                user_id INT NOT NULL,
+                embedding LONGBLOB NOT NULL,
+                INDEX idx_document_embeddings_user (user_id, document_id),
+                FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
+            ) ENGINE=InnoDB;
+        ''')
+        cursor.execute('SELECT 1 FROM document_embeddings LIMIT 1')
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                INSERT IGNORE INTO document_embeddings (document_id, user_id, embedding)
+                SELECT id, user_id, embedding FROM documents WHERE embedding IS NOT NULL
+            ''')
+            if cursor.rowcount:
+                logger.info(f"Backfilled {cursor.rowcount} rows into document_embeddings")
+
+    def _ensure_chunk_table(self, cursor):
+        """Create document_chunks and give every unchunked document a single chunk from its own row"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_chunks (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                document_id INT NOT NULL,
+                user_id INT NOT NULL,
+                chunk_index INT NOT NULL DEFAULT 0,
+                content LONGTEXT,
+                embedding LONGBLOB,
+                INDEX idx_document_chunks_user (user_id, id),
+                INDEX idx_document_chunks_document (document_id, chunk_index),
+                FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE
+            ) ENGINE=InnoDB;
+        ''')
+        cursor.execute('''
+            INSERT INTO document_chunks (document_id, user_id, chunk_index, content, embedding)
+            SELECT d.id, d.user_id, 0, d.content, d.embedding
+            FROM documents d
+            LEFT JOIN document_chunks c ON c.document_id = d.id
+            WHERE c.id IS NULL AND d.embedding IS NOT NULL
+        ''')
+        if cursor.rowcount:
+            logger.info(f"Backfilled {cursor.rowcount} single-chunk rows into document_chunks")
+
+    def _ensure_chunk_store(self, cursor):
+        """Create the content-addressed chunk_store and link document_chunks rows to it"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_store (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                content_hash CHAR(64) NOT NULL,
+                model_name VARCHAR(255),
+                content LONGTEXT,
+                embedding LONGBLOB,
+                ref_count INT NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_chunk_store_hash (content_hash)
+            ) ENGINE=InnoDB;
+        ''')
+        cursor.execute('''
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'document_chunks' AND column_name = 'store_id'
+        ''')
+        if not cursor.fetchone()[0]:
+            cursor.execute('ALTER TABLE document_chunks ADD COLUMN store_id BIGINT NULL, '
+                           'ADD INDEX idx_document_chunks_store (store_id)')
+            logger.info("Added document_chunks.store_id")
+
+    def _ensure_conversation_memory(self, cursor):
+        """Add the rolling summary columns to conversations if missing"""
+        cursor.execute('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'conversations'
+              AND column_name IN ('summary', 'summary_through_id')
+        ''')
+        existing = {row[0] for row in cursor.fetchall()}
+        if 'summary' not in existing:
+            cursor.execute('ALTER TABLE conversations ADD COLUMN summary TEXT NULL')
+            logger.info("Added conversations.summary")
+        if 'summary_through_id' not in existing:
+            cursor.execute('ALTER TABLE conversations ADD COLUMN summary_through_id INT NOT NULL DEFAULT 0')
+            logger.info("Added conversations.summary_through_id")
+
+    # Composite indexes backing filtered knowledge base search
+    SEARCH_INDEXES = {
+        'idx_documents_user_created': '(user_id, created_at)',
+        'idx_documents_user_type_created': '(user_id, document_type, created_at)',
+        'idx_documents_user_source': '(user_id, source)',
+        'idx_documents_user_jurisdiction': '(user_id, jurisdiction, created_at)',
+    }
+
+    def _ensure_search_indexes(self, cursor):
+        """Add the jurisdiction column (backfilled from metadata) and the filter indexes if missing"""
+        cursor.execute('''
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'documents' AND column_name = 'jurisdiction'
+        ''')
+        if not cursor.fetchone()[0]:
+            cursor.execute('ALTER TABLE documents ADD COLUMN jurisdiction VARCHAR(128) NULL')
+            cursor.execute('''
+                UPDATE documents
+                SET jurisdiction = NULLIF(JSON_UNQUOTE(JSON_EXTRACT(metadata, '$.jurisdiction')), 'null')
+                WHERE JSON_VALID(metadata)
+            ''')
+            logger.info(f"Added documents.jurisdiction; backfilled {cursor.rowcount} rows from metadata")
+        cursor.execute('''
+            SELECT DISTINCT index_name FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'documents'
+        ''')
+        existing = {row[0] for row in cursor.fetchall()}
+        for name, columns in self.SEARCH_INDEXES.items():
+            if name not in existing:
+                cursor.execute(f'CREATE INDEX {name} ON documents {columns}')
+                logger.info(f"Created index {name} on documents {columns}")
+
+    # Scope used for the counters over every user's documents
+    GLOBAL_STATS_USER = 0
+
+    def _ensure_stats_table(self, cursor):
+        """Create the maintained counters table and seed it from the current documents on first use"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS knowledge_base_stats (
+                user_id INT NOT NULL,
+                dimension VARCHAR(16) NOT NULL,
+                dim_value VARCHAR(255) NOT NULL DEFAULT '',
+                documents BIGINT NOT NULL DEFAULT 0,
+                chunks BIGINT NOT NULL DEFAULT 0,
+                bytes BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, dimension, dim_value)
+            ) ENGINE=InnoDB;
+        ''')
+        # The global total row exists once seeded (even with no documents), so this runs once;
+        # the named lock keeps two starting processes from seeding at the same time
+        cursor.execute("SELECT GET_LOCK('knowledge_base_stats_seed', 30)")
+        cursor.fetchone()
+        try:
+            cursor.execute(
+                "SELECT 1 FROM knowledge_base_stats WHERE user_id = %s AND dimension = 'total' AND dim_value = ''",
+                (self.GLOBAL_STATS_USER,)
+            )
+            if cursor.fetchone() is None:
+                self._rebuild_stats(cursor)
+                logger.info("Seeded knowledge_base_stats from documents")
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('knowledge_base_stats_seed')")
+            cursor.fetchone()
+
+    def _rebuild_stats(self, cursor):
+        """Recompute every counter from documents and document_chunks"""
+        cursor.execute('DELETE FROM knowledge_base_stats')
+        per_document = '''
+            SELECT d.user_id, d.document_type, d.source, COALESCE(LENGTH(d.content), 0) AS bytes,
+                   (SELECT COUNT(*) FROM document_chunks c WHERE c.document_id = d.id) AS chunks
+            FROM documents d
+        '''
+        for scope, group_by in (('user_id', 'user_id, dim_value'), (str(self.GLOBAL_STATS_USER), 'dim_value')):
+            for dimension, column in (('total', "''"), ('document_type', "COALESCE(document_type, '')"),
+                                      ('source', "COALESCE(source, '')")):
+                cursor.execute(f'''
+                    INSERT INTO knowledge_base_stats (user_id, dimension, dim_value, documents, chunks, bytes)
+                    SELECT {scope}, '{dimension}', dim_value, COUNT(*), SUM(chunks), SUM(bytes)
+                    FROM (SELECT per_document.*, LEFT({column}, 255) AS dim_value
+                          FROM ({per_document}) AS per_document) AS grouped
+                    GROUP BY {group_by}
+                ''')
+        # Keep the global total row even with no documents; it marks the table as seeded
+        cursor.execute(
+            "INSERT IGNORE INTO knowledge_base_stats (user_id, dimension, dim_value) VALUES (%s, 'total', '')",
+            (self.GLOBAL_STATS_USER,)
+        )
+
+    def rebuild_stats(self):
+        """Recompute the maintained counters from scratch (repairs drift from writes that bypass this class)"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            conn.start_transaction()
+            self._rebuild_stats(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _bump_stats(self, cursor, user_id, document_type, source, documents=0, chunks=0, bytes=0):
+        """Apply a counter delta for one document, inside the caller's transaction"""
+        rows = []
+        for scope in (user_id, self.GLOBAL_STATS_USER):
+            for dimension, value in (('total', ''), ('document_type', document_type), ('source', source)):
+                rows.append((scope, dimension, (value or '')[:255], documents, chunks, bytes))
+        cursor.executemany('''
+            INSERT INTO knowledge_base_stats (user_id, dimension, dim_value, documents, chunks, bytes)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE documents = documents + VALUES(documents),
+                                    chunks = chunks + VALUES(chunks), bytes = bytes + VALUES(bytes)
+        ''', rows)
+        if documents < 0:
+            cursor.execute(
+                "DELETE FROM knowledge_base_stats WHERE user_id IN (%s, %s) AND dimension <> 'total' AND documents <= 0",
+                (user_id, self.GLOBAL_STATS_USER)
+            )
+
+    def adjust_stats(self, user_id, document_type, source, documents=0, chunks=0, bytes=0):
+        """Record a document written with plain SQL elsewhere, so the counters stay exact"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            conn.start_transaction()
+            self._bump_stats(cursor, user_id, document_type, source, documents, chunks, bytes)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def get_stats(self, user_id=None):
+        """
+        Exact knowledge base statistics from the maintained counters
+
+        Reads only the caller's counter rows (primary key lookup), never the
+        documents table.
+
+        Args:
+            user_id: Owner of the knowledge base, or None for all users
+
+        Returns:
+            Dict with total_documents, total_chunks, total_bytes and
+            document_types / sources as {value: document count}
+        """
+        scope = self.GLOBAL_STATS_USER if user_id is None else user_id
+        rows = self._execute_query(
+            'SELECT dimension, dim_value, documents, chunks, bytes FROM knowledge_base_stats WHERE user_id = %s',
+            (scope,),
+            fetch_all=True
+        ) or []
+        stats = {'total_documents': 0, 'total_chunks': 0, 'total_bytes': 0, 'document_types': {}, 'sources': {}}
+        for row in rows:
+            if row['dimension'] == 'total':
+                stats['total_documents'] = int(row['documents'])
+                stats['total_chunks'] = int(row['chunks'])
+                stats['total_bytes'] = int(row['bytes'])
+            elif row['dimension'] == 'document_type':
+                stats['document_types'][row['dim_value']] = int(row['documents'])
+            elif row['dimension'] == 'source':
+                stats['sources'][row['dim_value']] = int(row['documents'])
+        return stats
+
+    def _embedding_source(self):
+        """(table, id column) that holds the embeddings used for scoring"""
+        if self.separate_embedding_table:
+            return 'document_embeddings', 'document_id'
+        return 'documents', 'id'
+
     def share_document(self, document_id, shared_with_user_id, shared_by_user_id):
         cursor = self.conn.cursor()
         cursor.execute('''
@@ -650,6 +1324,10 @@ class MySQLVectorStore:
         ''', (document_id, shared_with_user_id, shared_by_user_id))
         self.conn.commit()
         cursor.close()
+        # The recipient's corpus changed; rebuild their index on next search
+        self._index_cache.invalidate(shared_with_user_id)
+        self._chunk_index_cache.invalidate(shared_with_user_id)
+        self.retriever.invalidate(shared_with_user_id)
 
     def get_shared_documents(self, user_id):
         cursor = self.conn.cursor(dictionary=True)
@@ -679,19 +1357,415 @@ class MySQLVectorStore:
         cursor.close()
         return user
 
+    def _chunk_hashes(self, texts):
+        return [content_hash(text, self.embedding_model_name) for text in texts]
+
+    def embed_chunks(self, chunks):
+        """
+        Embeddings for chunk texts, reusing those already in chunk_store
+
+        Only chunks whose content hash (normalised text + model) is unknown
+        are sent to chunk_embedder, in one batch; a repeat ingest of the same
+        regulation or page is not re-encoded.
+
+        Args:
+            chunks: Chunk texts
+
+        Returns:
+            float32 array with one row per chunk
+        """
+        chunks = list(chunks)
+        if not chunks:
+            return np.zeros((0, 0), dtype=np.float32)
+        hashes = self._chunk_hashes(chunks)
+        known = {}
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows = self._execute_query(
+                f"SELECT content_hash, embedding FROM chunk_store "
+                f"WHERE content_hash IN ({', '.join(['%s'] * len(batch))}) AND embedding IS NOT NULL",
+                tuple(batch),
+                fetch_all=True
+            ) or []
+            for row in rows:
+                try:
+                    known[row['content_hash']] = decode_embedding(row['embedding'])[0]
+                except Exception as e:
+                    logger.warning(f"Re-embedding unreadable stored chunk {row['content_hash'][:12]}: {e}")
+
+        missing = {}
+        for chunk, chunk_hash in zip(chunks, hashes):
+            if chunk_hash not in known:
+                missing.setdefault(chunk_hash, chunk)
+        if missing:
+            if self.chunk_embedder is None:
+                raise ValueError("embed_chunks needs a chunk_embedder for new content")
+            vectors = np.asarray(self.chunk_embedder(list(missing.values())), dtype=np.float32)
+            known.update(zip(missing, vectors))
+        logger.info(f"Embedded {len(missing)} of {len(chunks)} chunks; {len(chunks) - len(missing)} reused from chunk_store")
+        return np.vstack([known[chunk_hash] for chunk_hash in hashes]).astype(np.float32)
+
+    def _store_chunks(self, cursor, texts, blobs):
+        """
+        Reference chunks in chunk_store inside the caller's transaction
+
+        New content is inserted once; content already stored just gains a
+        reference. Returns the chunk_store id for each text.
+        """
+        hashes = self._chunk_hashes(texts)
+        cursor.executemany('''
+            INSERT INTO chunk_store (content_hash, model_name, content, embedding, ref_count)
+            VALUES (%s, %s, %s, %s, 1)
+            ON DUPLICATE KEY UPDATE ref_count = ref_count + 1
+        ''', [(chunk_hash, self.embedding_model_name, text, blob)
+              for chunk_hash, text, blob in zip(hashes, texts, blobs)])
+        unique = list(dict.fromkeys(hashes))
+        cursor.execute(
+            f"SELECT content_hash, id FROM chunk_store WHERE content_hash IN ({', '.join(['%s'] * len(unique))})",
+            unique
+        )
+        ids = dict(cursor.fetchall())
+        return [ids[chunk_hash] for chunk_hash in hashes]
+
+    def _release_chunks(self, cursor, document_id):
+        """Drop the document's chunk_store references, deleting content nobody references any more"""
+        cursor.execute(
+            'SELECT store_id, COUNT(*) AS n FROM document_chunks '
+            'WHERE document_id = %s AND store_id IS NOT NULL GROUP BY store_id',
+            (document_id,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        refs = [(row['n'], row['store_id']) if isinstance(row, dict) else (row[1], row[0]) for row in rows]
+        cursor.executemany('UPDATE chunk_store SET ref_count = ref_count - %s WHERE id = %s', refs)
+        store_ids = [store_id for _, store_id in refs]
+        cursor.execute(
+            f"DELETE FROM chunk_store WHERE ref_count <= 0 AND id IN ({', '.join(['%s'] * len(store_ids))})",
+            store_ids
+        )
+
     def add_document(self, user_id, title, document_type, source, content, embedding, metadata):
         import json
-        cursor = self.conn.cursor()
         metadata_str = json.dumps(metadata) if not isinstance(metadata, str) else metadata
-        cursor.execute('''
-            INSERT INTO documents (user_id, title, document_type, source, content, embedding, metadata)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', (user_id, title, document_type, source, content, embedding.tobytes(), metadata_str))
-        self.conn.commit()
-        doc_id = cursor.lastrowid
-        cursor.close()
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding_blob = self._encode_embedding(embedding)
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            conn.start_transaction()
+            cursor.execute('''
+                INSERT INTO documents (user_id, title, document_type, source, content, embedding, metadata, jurisdiction)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ''', (user_id, title, document_type, source, content, embedding_blob, metadata_str,
+                  self._metadata_jurisdiction(metadata)))
+            doc_id = cursor.lastrowid
+            if self.separate_embedding_table:
+                cursor.execute('''
+                    INSERT INTO document_embeddings (document_id, user_id, embedding) VALUES (%s, %s, %s)
+                ''', (doc_id, user_id, embedding_blob))
+            # The whole row doubles as the document's only chunk
+            store_id = self._store_chunks(cursor, [content], [embedding_blob])[0]
+            cursor.execute('''
+                INSERT INTO document_chunks (document_id, user_id, chunk_index, store_id)
+                VALUES (%s, %s, 0, %s)
+            ''', (doc_id, user_id, store_id))
+            chunk_id = cursor.lastrowid
+            self._bump_stats(cursor, user_id, document_type, source, 1, 1, len((content or '').encode('utf-8')))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+        self._index_cache.add(user_id, doc_id, embedding)
+        self._chunk_index_cache.add(user_id, chunk_id, embedding)
+        self.retriever.add(user_id, chunk_id, f"{title or ''}\n{content or ''}")
+        return doc_id
+
+    @staticmethod
+    def _metadata_jurisdiction(metadata):
+        """Jurisdiction from a metadata dict or JSON string, stored in its own indexed column"""
+        import json
+        if isinstance(metadata, str):
+            try:
+                metadata = json.loads(metadata)
+            except ValueError:
+                return None
+        value = metadata.get('jurisdiction') if isinstance(metadata, dict) else None
+        return str(value)[:128] if value else None
+
+    def add_document_chunks(self, user_id, title, document_type, source, content, chunks, chunk_embeddings, metadata):
+        """
+        Store a document together with its chunks, one embedding per chunk
+
+        The parent row keeps the full text and, for document-level search, the
+        normalised mean of the chunk embeddings.
+
+        Args:
+            user_id: Owner of the document
+            title: Document title
+            document_type: Type of document
+            source: Where the document came from
+            content: Full document text
+            chunks: Chunk texts, in document order
+            chunk_embeddings: One embedding per chunk (see embed_chunks)
+            metadata: Document metadata (dict or JSON string)
+
+        Returns:
+            The new document id
+        """
+        import json
+        if not chunks or len(chunks) != len(chunk_embeddings):
+            raise ValueError("add_document_chunks needs one embedding per chunk")
+        metadata_str = json.dumps(metadata) if not isinstance(metadata, str) else metadata
+        vectors = normalize_vectors(np.asarray(chunk_embeddings, dtype=np.float32))
+        document_embedding = normalize_vectors(vectors.mean(axis=0))
+        document_blob = self._encode_embedding(document_embedding)
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        chunk_ids = []
+        try:
+            conn.start_transaction()
+            cursor.execute('''
+                INSERT INTO documents (user_id, title, document_type, source, content, embedding, metadata, jurisdiction)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ''', (user_id, title, document_type, source, content, document_blob, metadata_str,
+                  self._metadata_jurisdiction(metadata)))
+            doc_id = cursor.lastrowid
+            if self.separate_embedding_table:
+                cursor.execute('''
+                    INSERT INTO document_embeddings (document_id, user_id, embedding) VALUES (%s, %s, %s)
+                ''', (doc_id, user_id, document_blob))
+            store_ids = self._store_chunks(cursor, chunks, [self._encode_embedding(vector) for vector in vectors])
+            for chunk_index, store_id in enumerate(store_ids):
+                cursor.execute('''
+                    INSERT INTO document_chunks (document_id, user_id, chunk_index, store_id)
+                    VALUES (%s, %s, %s, %s)
+                ''', (doc_id, user_id, chunk_index, store_id))
+                chunk_ids.append(cursor.lastrowid)
+            self._bump_stats(cursor, user_id, document_type, source, 1, len(chunks), len((content or '').encode('utf-8')))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+        self._index_cache.add(user_id, doc_id, document_embedding)
+        for chunk_id, chunk, vector in zip(chunk_ids, chunks, vectors):
+            self._chunk_index_cache.add(user_id, chunk_id, vector)
+            self.retriever.add(user_id, chunk_id, f"{title or ''}\n{chunk}")
         return doc_id
 
+    def add_documents_bulk(self, user_id, rows, batch_size=500, max_batch_bytes=None):
+        """
+        Store many single-chunk documents in one transaction
+
+        Rows are written with multi-row INSERTs (executemany) in batches of at
+        most batch_size rows and max_batch_bytes bytes, so a large ingest costs
+        a few round trips and one commit instead of one commit per row, and no
+        statement outgrows the server's max_allowed_packet.
+
+        Args:
+            user_id: Owner of the documents
+            rows: Dicts with title, document_type, source, content, embedding and metadata
+            batch_size: Rows per INSERT statement
+            max_batch_bytes: Approximate statement size limit; defaults to half
+                of the server's max_allowed_packet
+
+        Returns:
+            The new document ids, in the order of rows
+        """
+        import json
+        rows = list(rows)
+        if not rows:
+            return []
+        vectors = [np.asarray(row['embedding'], dtype=np.float32) for row in rows]
+        blobs = [self._encode_embedding(vector) for vector in vectors]
+        values = [
+            (user_id, row.get('title'), row.get('document_type'), row.get('source'), row.get('content'), blob,
+             json.dumps(row.get('metadata') or {}) if not isinstance(row.get('metadata'), str) else row['metadata'],
+             self._metadata_jurisdiction(row.get('metadata')))
+            for row, blob in zip(rows, blobs)
+        ]
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        doc_ids, chunk_ids = [], []
+        try:
+            if max_batch_bytes is None:
+                max_batch_bytes = self._max_statement_bytes(cursor)
+            conn.start_transaction()
+            for start, end in self._bulk_batches(values, batch_size, max_batch_bytes):
+                batch = rows[start:end]
+                batch_blobs = blobs[start:end]
+                cursor.executemany('''
+                    INSERT INTO documents (user_id, title, document_type, source, content, embedding, metadata, jurisdiction)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ''', values[start:end])
+                batch_doc_ids = self._bulk_inserted_ids(cursor, user_id, batch)
+                if self.separate_embedding_table:
+                    cursor.executemany('''
+                        INSERT INTO document_embeddings (document_id, user_id, embedding) VALUES (%s, %s, %s)
+                    ''', [(doc_id, user_id, blob) for doc_id, blob in zip(batch_doc_ids, batch_blobs)])
+                # Each row doubles as its document's only chunk
+                store_ids = self._store_chunks(cursor, [row.get('content') or '' for row in batch], batch_blobs)
+                cursor.executemany('''
+                    INSERT INTO document_chunks (document_id, user_id, chunk_index, store_id)
+                    VALUES (%s, %s, 0, %s)
+                ''', [(doc_id, user_id, store_id) for doc_id, store_id in zip(batch_doc_ids, store_ids)])
+                placeholders = ', '.join(['%s'] * len(batch_doc_ids))
+                cursor.execute(
+                    f'SELECT document_id, id FROM document_chunks WHERE document_id IN ({placeholders})',
+                    batch_doc_ids
+                )
+                chunk_by_doc = dict(cursor.fetchall())
+                doc_ids.extend(batch_doc_ids)
+                chunk_ids.extend(chunk_by_doc[doc_id] for doc_id in batch_doc_ids)
+
+            deltas = {}
+            for row in rows:
+                key = (row.get('document_type'), row.get('source'))
+                documents, size = deltas.get(key, (0, 0))
+                deltas[key] = (documents + 1, size + len((row.get('content') or '').encode('utf-8')))
+            for (document_type, source), (documents, size) in deltas.items():
+                self._bump_stats(cursor, user_id, document_type, source, documents, documents, size)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+        for doc_id, chunk_id, row, vector in zip(doc_ids, chunk_ids, rows, vectors):
+            self._index_cache.add(user_id, doc_id, vector)
+            self._chunk_index_cache.add(user_id, chunk_id, vector)
+            self.retriever.add(user_id, chunk_id, f"{row.get('title') or ''}\n{row.get('content') or ''}")
+        return doc_ids
+
+    # Fallback statement budget when max_allowed_packet cannot be read (MySQL default is 64MB)
+    DEFAULT_MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+    def _max_statement_bytes(self, cursor):
+        """Half of the server's max_allowed_packet, leaving room for escaping and SQL text"""
+        try:
+            cursor.execute('SELECT @@max_allowed_packet')
+            return max(1024 * 1024, int(cursor.fetchone()[0]) // 2)
+        except Exception as e:
+            logger.warning(f"Could not read max_allowed_packet, using {self.DEFAULT_MAX_BATCH_BYTES} bytes: {e}")
+            return self.DEFAULT_MAX_BATCH_BYTES
+
+    @staticmethod
+    def _bulk_batches(values, batch_size, max_batch_bytes):
+        """
+        (start, end) slices of values holding at most batch_size rows and about max_batch_bytes bytes
+
+        A single row larger than the budget still gets a batch of its own.
+        """
+        start, size = 0, 0
+        for i, row in enumerate(values):
+            # Binary values may be escaped to up to twice their length
+            row_bytes = 64 + sum(
+                2 * len(value) if isinstance(value, (bytes, bytearray))
+                else len(value.encode('utf-8')) if isinstance(value, str) else 8
+                for value in row if value is not None
+            )
+            if i > start and (i - start >= batch_size or size + row_bytes > max_batch_bytes):
+                yield start, i
+                start, size = i, 0
+            size += row_bytes
+        if start < len(values):
+            yield start, len(values)
+
+    @staticmethod
+    def _bulk_inserted_ids(cursor, user_id, batch):
+        """
+        Ids of the rows written by the last multi-row documents INSERT
+
+        InnoDB hands a multi-row INSERT a consecutive id range starting at
+        lastrowid; the range is checked against the inserted titles and sources.
+        """
+        first_id = cursor.lastrowid
+        expected = list(range(first_id, first_id + len(batch)))
+        cursor.execute(
+            'SELECT id, title, source FROM documents WHERE user_id = %s AND id BETWEEN %s AND %s ORDER BY id',
+            (user_id, expected[0], expected[-1])
+        )
+        found = cursor.fetchall()
+        def key(doc_id, title, source):
+            return doc_id, (title or '')[:255], (source or '')[:255]
+
+        if [key(*row) for row in found] != [
+            key(doc_id, row.get('title'), row.get('source')) for doc_id, row in zip(expected, batch)
+        ]:
+            raise RuntimeError("Bulk insert ids were not consecutive; retry with smaller batches")
+        return expected
+
+    def _encode_embedding(self, embedding):
+        """Pack an embedding in the configured storage format"""
+        return encode_embedding(embedding, dtype=self.embedding_format, model_name=self.embedding_model_name)
+
+    def delete_document(self, document_id, user_id):
+        """Delete one of the user's documents, update the counters and drop it from the in-memory index"""
+        conn = self._get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            conn.start_transaction()
+            cursor.execute(
+                'SELECT document_type, source, COALESCE(LENGTH(content), 0) AS bytes FROM documents '
+                'WHERE id = %s AND user_id = %s FOR UPDATE',
+                (document_id, user_id)
+            )
+            document = cursor.fetchone()
+            cursor.execute(
+                'SELECT id FROM document_chunks WHERE document_id = %s AND user_id = %s',
+                (document_id, user_id)
+            )
+            chunk_rows = cursor.fetchall()
+            if document:
+                self._release_chunks(cursor, document_id)
+            cursor.execute('DELETE FROM documents WHERE id = %s AND user_id = %s', (document_id, user_id))
+            deleted = cursor.rowcount
+            if deleted and document:
+                self._bump_stats(
+                    cursor, user_id, document['document_type'], document['source'],
+                    -1, -len(chunk_rows), -int(document['bytes'])
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+        if deleted:
+            self._index_cache.remove(user_id, [document_id])
+            chunk_ids = [row['id'] for row in chunk_rows]
+            self._chunk_index_cache.remove(user_id, chunk_ids)
+            self.retriever.remove(user_id, chunk_ids)
+        return deleted
+
+    def switch_embedding_model(self, model_name):
+        """Tag new writes with model_name and reload every index (after a re-embedding switch-over)"""
+        self.embedding_model_name = model_name
+        for manager in (self.ann_manager, self.chunk_ann_manager):
+            if manager is not None:
+                manager.model_name = model_name
+        self.invalidate_user_index()
+        logger.info(f"Knowledge base switched to embedding model {model_name}")
+
+    def invalidate_user_index(self, user_id=None):
+        """Force the user's (or every user's) embedding indexes to reload on next search"""
+        self._index_cache.invalidate(user_id)
+        self._chunk_index_cache.invalidate(user_id)
+        self.retriever.invalidate(user_id)
+
     def list_documents(self, user_id):
         import json
         cursor = self.conn.cursor(dictionary=True)
@@ -703,44 +1777,386 @@ class MySQLVectorStore:
         cursor.close()
         return docs
 
-    def search_documents(self, user_id, query_embedding, top_k=10):
-        import numpy as np
-        import json
-        cursor = self.conn.cursor(dictionary=True)
-        # Only get documents that have embeddings (not NULL)
-        cursor.execute('SELECT id, title, document_type, source, content, embedding FROM documents WHERE user_id=%s AND embedding IS NOT NULL', (user_id,))
-        docs = cursor.fetchall()
-        for doc in docs:
-            # Set empty metadata since column doesn't exist
+    def _load_user_embeddings(self, user_id):
+        """Load (ids, vectors) for every embedded document the user owns"""
+        table, id_column = self._embedding_source()
+        return self._load_embeddings(user_id, table, id_column)
+
+    def _load_user_chunk_embeddings(self, user_id):
+        """Load (chunk ids, vectors) for every embedded chunk the user owns, inline or in chunk_store"""
+        rows = self._execute_query(
+            'SELECT c.id, COALESCE(c.embedding, s.embedding) AS embedding FROM document_chunks c '
+            'LEFT JOIN chunk_store s ON s.id = c.store_id '
+            'WHERE c.user_id=%s AND (c.embedding IS NOT NULL OR s.embedding IS NOT NULL) ORDER BY c.id',
+            (user_id,),
+            fetch_all=True
+        ) or []
+        return self._decode_embedding_rows(user_id, rows)
+
+    def _load_embeddings(self, user_id, table, id_column):
+        rows = self._execute_query(
+            f'SELECT {id_column} AS id, embedding FROM {table} '
+            f'WHERE user_id=%s AND embedding IS NOT NULL ORDER BY {id_column}',
+            (user_id,),
+            fetch_all=True
+        ) or []
+        return self._decode_embedding_rows(user_id, rows)
+
+    def _decode_embedding_rows(self, user_id, rows):
+        ids, vectors = [], []
+        other_model = 0
+        for row in rows:
+            try:
+                vector, header = decode_embedding(row['embedding'])
+            except Exception as e:
+                logger.warning(f"Skipping document {row['id']}: {e}")
+                continue
+            if header.model_name and self.embedding_model_name and header.model_name != self.embedding_model_name:
+                other_model += 1
+                continue
+            ids.append(row['id'])
+            vectors.append(vector)
+        if other_model:
+            logger.warning(f"User {user_id}: skipped {other_model} embeddings from a different model")
+        return ids, vectors
+
+    def _user_embedding_signature(self, user_id):
+        """Cheap (count, max id) fingerprint used to detect writes from other workers"""
+        table, id_column = self._embedding_source()
+        return self._embedding_signature(user_id, table, id_column)
+
+    def _user_chunk_signature(self, user_id):
+        # Chunk rows referencing chunk_store keep no inline embedding, so every row counts
+        return self._embedding_signature(user_id, 'document_chunks', 'id', require_embedding=False)
+
+    def _embedding_signature(self, user_id, table, id_column, require_embedding=True):
+        embedding_filter = ' AND embedding IS NOT NULL' if require_embedding else ''
+        row = self._execute_query(
+            f'SELECT COUNT(*) AS n, COALESCE(MAX({id_column}), 0) AS max_id FROM {table} '
+            f'WHERE user_id=%s{embedding_filter}',
+            (user_id,),
+            fetch_one=True
+        )
+        return (int(row['n']), int(row['max_id'])) if row else (0, 0)
+
+    def _fetch_documents(self, user_id, doc_ids):
+        """Fetch display columns for the given ids in one query, keyed by id"""
+        if not doc_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(doc_ids))
+        rows = self._execute_query(
+            f'SELECT id, title, document_type, source, content FROM documents '
+            f'WHERE user_id=%s AND id IN ({placeholders})',
+            (user_id, *doc_ids),
+            fetch_all=True
+        ) or []
+        return {row['id']: row for row in rows}
+
+    def search_documents(self, user_id, query_embedding, top_k=10, filters=None):
+        """
+        Two-phase retrieval: score using only ids and embeddings (from the
+        in-memory index or a narrow scan), then fetch title/content for the
+        final top_k ids in a single query.
+
+        filters (see _resolve_filter_ids) are resolved in SQL first and only
+        the matching documents are scored.
+        """
+        allowed_ids = self._resolve_filter_ids(user_id, filters, level='documents')
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            return []
+        if self.use_memory_index:
+            hits = self._index_cache.get(user_id).search(query_embedding, top_k, allowed_ids)
+        else:
+            hits = self._score_embeddings_scan(user_id, query_embedding, top_k, allowed_ids=allowed_ids)
+
+        docs_by_id = self._fetch_documents(user_id, [doc_id for doc_id, _ in hits])
+        results = []
+        for doc_id, score in hits:
+            doc = docs_by_id.get(doc_id)
+            if doc is None:
+                continue  # deleted since the index was loaded
             doc['metadata'] = {}
-        cursor.close()
-        scored = []
-        for doc in docs:
+            doc['similarity_score'] = score
+            doc['score'] = score
+            results.append(doc)
+        return results
+
+    # Metadata filters accepted by the search methods, mapped to SQL columns
+    FILTER_COLUMNS = {
+        'document_type': 'd.document_type',
+        'source': 'd.source',
+        'title': 'd.title',
+        'jurisdiction': 'd.jurisdiction',
+        'document_id': 'd.id',
+    }
+    # Range filters on the upload time
+    RANGE_FILTERS = {
+        'date_from': 'd.created_at >= %s',
+        'date_to': 'd.created_at <= %s',
+    }
+    # date_to given as a bare date includes the whole of that day
+    DATE_ONLY_RANGE_FILTERS = {
+        'date_to': 'd.created_at < %s',
+    }
+
+    @staticmethod
+    def _parse_range_value(key, value):
+        """
+        Parse a date range filter value
+
+        Returns:
+            (value, date_only): a datetime.date for 'YYYY-MM-DD' or date input,
+            a datetime.datetime for an ISO datetime
+
+        Raises:
+            ValueError: If value is not a date or ISO datetime
+        """
+        if isinstance(value, datetime.datetime):
+            return value, False
+        if isinstance(value, datetime.date):
+            return value, True
+        if isinstance(value, str):
+            text = value.strip()
             try:
-                emb = np.frombuffer(doc['embedding'], dtype=np.float32)
-                
-                # Calculate cosine similarity with proper error handling
-                query_norm = np.linalg.norm(query_embedding)
-                emb_norm = np.linalg.norm(emb)
-                
-                if query_norm == 0 or emb_norm == 0:
-                    sim = 0.0
+                return datetime.date.fromisoformat(text), True
+            except ValueError:
+                pass
+            try:
+                return datetime.datetime.fromisoformat(text), False
+            except ValueError:
+                pass
+        raise ValueError(f"Invalid {key} filter: {value!r} (expected YYYY-MM-DD or an ISO datetime)")
+
+    def _filter_clause(self, filters):
+        """SQL fragment and params for {column: value or [values]} and date range filters"""
+        clauses, params = [], []
+        for key, value in (filters or {}).items():
+            if value is None:
+                continue
+            if key in self.RANGE_FILTERS:
+                value, date_only = self._parse_range_value(key, value)
+                if key in self.DATE_ONLY_RANGE_FILTERS and date_only:
+                    clauses.append(self.DATE_ONLY_RANGE_FILTERS[key])
+                    value += datetime.timedelta(days=1)
                 else:
-                    sim = np.dot(query_embedding, emb) / (query_norm * emb_norm)
-                
-                # Ensure similarity score is valid
-                if np.isnan(sim) or np.isinf(sim):
-                    sim = 0.0
-                
-                doc['similarity_score'] = float(sim)  # Add similarity score to document
-                scored.append((sim, doc))
-            except Exception as e:
-                logger.error(f"Error calculating similarity for document {doc.get('id', 'unknown')}: {str(e)}")
-                doc['similarity_score'] = 0.0
-                scored.append((0.0, doc))
-        
-        scored.sort(reverse=True, key=lambda x: x[0])
-        return [doc for sim, doc in scored[:top_k]]
+                    clauses.append(self.RANGE_FILTERS[key])
+                params.append(value)
+                continue
+            column = self.FILTER_COLUMNS.get(key)
+            if column is None:
+                raise ValueError(f"Unsupported filter: {key}")
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            if not values:
+                clauses.append('FALSE')
+                continue
+            clauses.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+        return ''.join(f' AND {clause}' for clause in clauses), params
+
+    def _resolve_filter_ids(self, user_id, filters, level='chunks'):
+        """
+        Ids matching the filters, resolved with one query on the indexed columns
+
+        The result is used as a pre-filter bitmap for the in-memory/ANN index,
+        so a narrow filter only scores the matching subset.
+
+        Args:
+            user_id: Owner of the knowledge base
+            filters: {document_type|source|title|jurisdiction|document_id: value or list,
+                      date_from|date_to: datetime or 'YYYY-MM-DD'}
+            level: 'chunks' for chunk ids, 'documents' for document ids
+
+        Returns:
+            Array of matching ids, or None when there are no filters
+        """
+        filter_sql, filter_params = self._filter_clause(filters)
+        if not filter_sql:
+            return None
+        if level == 'documents':
+            query = f'SELECT d.id FROM documents d WHERE d.user_id=%s{filter_sql}'
+        else:
+            query = (
+                f'SELECT c.id FROM document_chunks c JOIN documents d ON d.id = c.document_id '
+                f'WHERE c.user_id=%s{filter_sql}'
+            )
+        rows = self._execute_query(query, (user_id, *filter_params), fetch_all=True) or []
+        return np.fromiter((row['id'] for row in rows), dtype=np.int64, count=len(rows))
+
+    def _fetch_chunks(self, user_id, chunk_ids, filters=None):
+        """Fetch chunk text with its parent document's display columns, keyed by chunk id"""
+        if not chunk_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(chunk_ids))
+        filter_sql, filter_params = self._filter_clause(filters)
+        rows = self._execute_query(
+            f'SELECT c.id AS chunk_id, c.document_id AS id, c.chunk_index, COALESCE(c.content, s.content) AS content, '
+            f'd.title, d.document_type, d.source FROM document_chunks c '
+            f'JOIN documents d ON d.id = c.document_id '
+            f'LEFT JOIN chunk_store s ON s.id = c.store_id '
+            f'WHERE c.user_id=%s AND c.id IN ({placeholders}){filter_sql}',
+            (user_id, *chunk_ids, *filter_params),
+            fetch_all=True
+        ) or []
+        return {row['chunk_id']: row for row in rows}
+
+    # Chunks fetched per wanted document when collapsing to one result per document
+    PER_DOCUMENT_OVERFETCH = 4
+
+    def search_chunks(self, user_id, query_embedding, top_k=10, filters=None, per_document=False):
+        """
+        Return the user's best matching chunks rather than whole documents.
+
+        Each result has the parent document's id, title, document_type and
+        source, plus chunk_id, chunk_index and the chunk text as content.
+        Optional filters (see _resolve_filter_ids) restrict scoring to the
+        matching chunks. With per_document=True each document appears once,
+        represented by its best chunk, and top_k counts documents.
+        """
+        allowed_ids = self._resolve_filter_ids(user_id, filters)
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            return []
+        fetch_k = top_k * self.PER_DOCUMENT_OVERFETCH if per_document else top_k
+        hits = self._chunk_hits(user_id, query_embedding, fetch_k, allowed_ids)
+        chunks_by_id = self._fetch_chunks(user_id, [chunk_id for chunk_id, _ in hits])
+        results = []
+        seen_documents = set()
+        for chunk_id, score in hits:
+            chunk = chunks_by_id.get(chunk_id)
+            if chunk is None:
+                continue
+            if per_document:
+                # Hits are best first, so the first chunk seen is the document's best
+                if chunk['id'] in seen_documents:
+                    continue
+                seen_documents.add(chunk['id'])
+            chunk['metadata'] = {}
+            chunk['similarity_score'] = score
+            chunk['score'] = score
+            results.append(chunk)
+            if len(results) >= top_k:
+                break
+        return results
+
+    def search_many(self, user_id, queries, k=10, filters=None, query_embeddings=None):
+        """
+        Chunk search for several queries in one pass
+
+        Queries are embedded in one batch, scored against the user's chunk
+        index with a single matrix-matrix product, and all winning chunks are
+        fetched in one query.
+
+        Args:
+            user_id: Owner of the knowledge base
+            queries: Query texts
+            k: Results per query
+            filters: Optional filters (see _resolve_filter_ids)
+            query_embeddings: Precomputed embeddings (skips encoding)
+
+        Returns:
+            One list of chunk rows (as from search_chunks) per query, aligned with the input
+        """
+        if not queries and query_embeddings is None:
+            return []
+        if query_embeddings is None:
+            if self.batch_query_embedder is not None:
+                query_embeddings = self.batch_query_embedder(list(queries))
+            elif self.query_embedder is not None:
+                query_embeddings = [self.query_embedder(query) for query in queries]
+            else:
+                raise ValueError("search_many needs query_embeddings or a query embedder")
+        query_matrix = np.asarray(query_embeddings, dtype=np.float32)
+
+        allowed_ids = self._resolve_filter_ids(user_id, filters)
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            hit_lists = [[] for _ in range(len(query_matrix))]
+        elif self.use_memory_index:
+            hit_lists = self._chunk_index_cache.get(user_id).search_many(query_matrix, k, allowed_ids)
+        else:
+            ids, vectors = self._load_user_chunk_embeddings(user_id)
+            keep = [i for i, v in enumerate(vectors) if v.shape[0] == query_matrix.shape[1]]
+            if keep:
+                index = UserEmbeddingIndex([ids[i] for i in keep], np.vstack([vectors[i] for i in keep]))
+                hit_lists = index.search_many(query_matrix, k, allowed_ids)
+            else:
+                hit_lists = [[] for _ in range(len(query_matrix))]
+
+        all_ids = list({chunk_id for hits in hit_lists for chunk_id, _ in hits})
+        chunks_by_id = self._fetch_chunks(user_id, all_ids)
+        results = []
+        for hits in hit_lists:
+            rows = []
+            for chunk_id, score in hits:
+                chunk = chunks_by_id.get(chunk_id)
+                if chunk is None:
+                    continue
+                row = dict(chunk, metadata={}, similarity_score=score, score=score)
+                rows.append(row)
+                if len(rows) == k:
+                    break
+            results.append(rows)
+        return results
+
+    def _chunk_hits(self, user_id, query_embedding, top_k, allowed_ids=None):
+        """(chunk id, cosine similarity) pairs for the user's best chunks"""
+        if self.use_memory_index:
+            return self._chunk_index_cache.get(user_id).search(query_embedding, top_k, allowed_ids)
+        return self._score_embeddings_scan(
+            user_id, query_embedding, top_k, self._load_user_chunk_embeddings, allowed_ids
+        )
+
+    def _chunk_vector_search(self, user_id, query, top_k, allowed_ids=None):
+        if self.query_embedder is None:
+            return []
+        return self._chunk_hits(user_id, self.query_embedder(query), top_k, allowed_ids)
+
+    def _load_user_chunk_texts(self, user_id):
+        """(chunk id, title + chunk text) for every chunk the user owns"""
+        rows = self._execute_query(
+            'SELECT c.id, d.title, COALESCE(c.content, s.content) AS content FROM document_chunks c '
+            'JOIN documents d ON d.id = c.document_id '
+            'LEFT JOIN chunk_store s ON s.id = c.store_id WHERE c.user_id=%s',
+            (user_id,),
+            fetch_all=True
+        ) or []
+        return [(row['id'], f"{row['title'] or ''}\n{row['content'] or ''}") for row in rows]
+
+    def _user_chunk_text_signature(self, user_id):
+        return self._embedding_signature(user_id, 'document_chunks', 'id', require_embedding=False)
+
+    def retrieve(self, user_id, query, k=5, filters=None):
+        """
+        Hybrid keyword + semantic retrieval over the user's chunks
+
+        BM25 and vector rankings are fused with reciprocal rank fusion. Without
+        a query_embedder only the keyword ranking is used.
+
+        Args:
+            user_id: Owner of the knowledge base
+            query: Natural language query
+            k: Number of chunks to return
+            filters: Optional filters (see _resolve_filter_ids) applied to both rankings
+
+        Returns:
+            Chunk rows (as from search_chunks) with bm25_score,
+            similarity_score and rrf_score
+        """
+        allowed_ids = self._resolve_filter_ids(user_id, filters)
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            return []
+        results = self.retriever.retrieve(user_id, query, k, allowed_ids)
+        for row in results:
+            row['metadata'] = {}
+        return results
+
+    def _score_embeddings_scan(self, user_id, query_embedding, top_k=10, loader=None, allowed_ids=None):
+        """Score the user's embeddings without the cached index (no content is read)"""
+        ids, vectors = (loader or self._load_user_embeddings)(user_id)
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        keep = [i for i, v in enumerate(vectors) if v.shape[0] == query.shape[0]]
+        if not keep:
+            return []
+        index = UserEmbeddingIndex([ids[i] for i in keep], np.vstack([vectors[i] for i in keep]))
+        return index.search(query, top_k, allowed_ids)
 
     def create_conversation(self, user_id, title, conversation_type='legal_research'):
         """Create a new conversation"""
@@ -788,6 +2204,76 @@ class MySQLVectorStore:
         self.conn.commit()
         cursor.close()
 
+    def get_conversation_memory(self, conversation_id, max_messages, skip_latest=0):
+        """
+        Rolling summary and the newest messages not yet folded into it
+
+        Args:
+            conversation_id: Conversation to read
+            max_messages: Most unsummarized messages to return (newest kept)
+            skip_latest: Newest messages to leave out (e.g. the question just saved)
+
+        Returns:
+            {'summary', 'summary_through_id', 'messages'} with messages oldest first
+        """
+        row = self._execute_query(
+            'SELECT summary, summary_through_id FROM conversations WHERE id = %s',
+            (conversation_id,), fetch_one=True
+        ) or {}
+        through_id = row.get('summary_through_id') or 0
+        messages = self._execute_query('''
+            SELECT id, sender_type, message FROM conversation_messages
+            WHERE conversation_id = %s AND id > %s
+            ORDER BY id DESC LIMIT %s OFFSET %s
+        ''', (conversation_id, through_id, int(max_messages), int(skip_latest)), fetch_all=True) or []
+        messages.reverse()
+        return {'summary': row.get('summary') or '', 'summary_through_id': through_id, 'messages': messages}
+
+    def get_unsummarized_messages(self, conversation_id, keep_recent, limit):
+        """
+        Oldest messages that are neither in the summary nor among the newest keep_recent
+
+        Returns:
+            {'summary', 'summary_through_id', 'messages'} with at most limit messages, oldest first
+        """
+        row = self._execute_query(
+            'SELECT summary, summary_through_id FROM conversations WHERE id = %s',
+            (conversation_id,), fetch_one=True
+        ) or {}
+        through_id = row.get('summary_through_id') or 0
+        state = {'summary': row.get('summary') or '', 'summary_through_id': through_id, 'messages': []}
+        boundary = self._execute_query('''
+            SELECT id FROM conversation_messages
+            WHERE conversation_id = %s
+            ORDER BY id DESC LIMIT 1 OFFSET %s
+        ''', (conversation_id, max(int(keep_recent), 1) - 1), fetch_one=True)
+        if not boundary:
+            return state
+        state['messages'] = self._execute_query('''
+            SELECT id, sender_type, message FROM conversation_messages
+            WHERE conversation_id = %s AND id > %s AND id < %s
+            ORDER BY id ASC LIMIT %s
+        ''', (conversation_id, through_id, boundary['id'], int(limit)), fetch_all=True) or []
+        return state
+
+    def update_conversation_summary(self, conversation_id, summary, through_id, previous_through_id):
+        """
+        Store a new rolling summary covering messages up to through_id
+
+        Only applies if the summary still covers previous_through_id, so
+        concurrent updates cannot overwrite a newer summary. Leaves
+        updated_at alone so conversation lists keep their order.
+
+        Returns:
+            True if the summary was stored
+        """
+        updated = self._execute_query('''
+            UPDATE conversations
+            SET summary = %s, summary_through_id = %s, updated_at = updated_at
+            WHERE id = %s AND summary_through_id = %s
+        ''', (summary, through_id, conversation_id, previous_through_id), commit=True)
+        return updated == 1
+
     def update_conversation_title(self, conversation_id, new_title):
         """Update conversation title"""
         cursor = self.conn.cursor()
@@ -811,8 +2297,7 @@ if __name__ == "__main__":
     print("LOADING VECTOR STORE FROM:", __file__)
     vector_store = VectorStore()
     print("VectorStore methods:", dir(vector_store))
-    all_docs = vector_store.list_all_documents()
-    print(f"Found {len(all_docs)} document chunks in the collection.")
-    for doc in all_docs:
-        print(f"Title: {doc['title']}, Type: {doc['type']}, Source: {doc['source']}, Preview: {doc['content_preview'][:100]}")
+    print(f"Found {vector_store.stats.chunks} document chunks in the collection.")
+    for doc in vector_store.iter_documents(include_content=True, preview_chars=100):
+        print(f"Title: {doc['title']}, Type: {doc['type']}, Source: {doc['source']}, Preview: {doc['content_preview']}")
 
@@ -64,6 +64,8 @@ class Config:
             # Chroma settings
             'CHROMA_PERSIST_DIRECTORY': ['chroma', 'persist_directory'],
             'CHROMA_COLLECTION_NAME': ['chroma', 'collection_name'],
+            'CHROMA_EMBEDDING_BATCH_SIZE': ['chroma', 'embedding_batch_size'],
+            'CHROMA_EMBEDDING_BACKEND': ['chroma', 'embedding_backend'],
             
             # Streamlit settings
             'STREAMLIT_PORT': ['streamlit', 'port'],
@@ -108,10 +110,47 @@ class Config:
                 'temperature': 0.3,
                 'max_tokens': 2048
             },
+            'llm_clients': {
+                'max_connections': 20,
+                'max_keepalive_connections': 10,
+                'keepalive_expiry': 30.0,
+                'timeout': 120.0,
+                'connect_timeout': 10.0,
+                'max_retries': 2,
+                'model_list_ttl': 60.0,
+                'async_max_connections': 256,
+                'async_max_keepalive_connections': 64
+            },
+            'context_budget': {
+                'max_prompt_tokens': 6000,
+                'history_share': 0.35,
+                'max_chunk_tokens': 800,
+                'min_item_tokens': 48,
+                'ollama_context_window': 4096,
+                'default_context_window': 8192,
+                'model_context_windows': {}
+            },
+            'conversation_memory': {
+                'recent_messages': 6,
+                'summarize_threshold': 6,
+                'max_fold_messages': 20,
+                'summary_max_tokens': 500
+            },
             'chroma': {
                 'persist_directory': './data/embeddings',
                 'collection_name': 'legal_documents',
-                'embedding_model': 'all-MiniLM-L6-v2'
+                'embedding_model': 'paraphrase-multilingual-MiniLM-L12-v2',
+                'embedding_batch_size': 32,
+                'query_cache_size': 1024,
+                'query_cache_ttl_seconds': 0,
+                'embedding_backend': 'torch',
+                'onnx_quantize': True,
+                'onnx_cache_dir': './data/models/onnx',
+                'micro_batching': True,
+                'micro_batch_size': 32,
+                'micro_batch_wait_ms': 5.0,
+                'chunking': 'tokens',
+                'chunk_overlap_tokens': 16
             },
             'firecrawl': {
                 'api_key': None,
@@ -144,6 +183,23 @@ class Config:
                 'knowledge_base': True,
                 'conversation_history': True
             },
+            'knowledge_base': {
+                'memory_index': True,
+                'index_refresh_seconds': 2.0,
+                'max_cached_users': 256,
+                'separate_embedding_table': False,
+                'embedding_format': 'float16',
+                'ann_index': False,
+                'ann_directory': './data/embeddings/ann_index',
+                'ann_nprobe': 8,
+                'ann_exact_threshold': 2048,
+                'ann_rebuild_threshold': 0.25
+            },
+            'reembedding': {
+                'batch_size': 64,
+                'duty_cycle': 0.5,
+                'checkpoint_dir': './data/migrations'
+            },
             'mysql': {
                 'host': 'localhost',
                 'port': 3306,
@@ -347,11 +403,71 @@ ollama:
   temperature: 0.3        # Response temperature (0.0-1.0)
   max_tokens: 2048        # Maximum response tokens
 
+# Pooled OpenAI/Ollama HTTP clients shared by all LLMEngine instances
+llm_clients:
+  max_connections: 20              # Open connections per provider endpoint
+  max_keepalive_connections: 10    # Idle connections kept for reuse
+  keepalive_expiry: 30.0           # Seconds an idle connection is kept
+  timeout: 120.0                   # Read timeout per LLM call (seconds)
+  connect_timeout: 10.0
+  max_retries: 2                   # OpenAI client retries on transient errors
+  model_list_ttl: 60.0             # Seconds an Ollama model list is cached
+  async_max_connections: 256       # Concurrent in-flight calls for the async engine
+  async_max_keepalive_connections: 64
+
+# Prompt token budget (history and retrieved documents are trimmed to fit)
+context_budget:
+  max_prompt_tokens: 6000          # Cap per prompt regardless of model window (latency/cost)
+  history_share: 0.35              # Share of the free budget for conversation history
+  max_chunk_tokens: 800            # Per-document cap for retrieved context
+  min_item_tokens: 48              # Smaller leftovers drop an item instead of trimming it
+  ollama_context_window: 4096      # Ollama num_ctx
+  default_context_window: 8192     # Models not listed in context_packer.MODEL_CONTEXT_WINDOWS
+  model_context_windows: {}        # Overrides by model-name prefix, e.g. {gpt-4o: 128000}
+
+# Rolling conversation summary (older turns are folded into a stored summary)
+conversation_memory:
+  recent_messages: 6               # Messages always sent verbatim
+  summarize_threshold: 6           # Older unsummarized messages that trigger a background fold
+  max_fold_messages: 20            # Messages folded per summarization call
+  summary_max_tokens: 500          # Length limit for the summary
+
 # Chroma Vector Database Configuration
 chroma:
   persist_directory: ./data/embeddings    # Directory to store embeddings
   collection_name: legal_documents        # Collection name for documents
-  embedding_model: all-MiniLM-L6-v2     # Sentence transformer model
+  embedding_model: paraphrase-multilingual-MiniLM-L12-v2  # Sentence transformer model (change it with the re-embedding job)
+  embedding_batch_size: 32                # Chunks per encoder call during ingest
+  query_cache_size: 1024                  # Query embeddings kept in the LRU cache
+  query_cache_ttl_seconds: 0              # Expire cached query embeddings (0 = never)
+  embedding_backend: torch                # torch or onnx (ONNX Runtime, checked against torch on load)
+  onnx_quantize: true                     # Use dynamic int8 quantisation with the onnx backend
+  onnx_cache_dir: ./data/models/onnx      # Exported ONNX models
+  micro_batching: true                    # Coalesce concurrent query encodes into batches
+  micro_batch_size: 32                    # Max queries per batch
+  micro_batch_wait_ms: 5.0                # Max time the first query waits for company
+  chunking: tokens                        # tokens (fit the encoder window) or characters (2000 chars)
+  chunk_overlap_tokens: 16                # Overlap between consecutive token chunks
+
+# Per-user MySQL Knowledge Base Search
+knowledge_base:
+  memory_index: true               # Keep per-user embedding matrices in memory
+  index_refresh_seconds: 2.0       # How often a cached index is checked against MySQL
+  max_cached_users: 256            # Users whose indexes stay resident
+  separate_embedding_table: false  # Score from the narrow document_embeddings table
+  embedding_format: float16        # Stored embedding precision (float32, float16, int8)
+  ann_index: false                 # Persistent IVF-flat index per user (large knowledge bases)
+  ann_directory: ./data/embeddings/ann_index
+  ann_nprobe: 8                    # Lists probed per query (higher = better recall, slower)
+  ann_exact_threshold: 2048        # Below this many vectors search is exact
+  ann_rebuild_threshold: 0.25      # Retrain when changes exceed this fraction of the trained size
+
+# Background re-embedding after an embedding model change
+# (python -m src.core.reembedding --model NEW_MODEL [--switch])
+reembedding:
+  batch_size: 64                   # Texts encoded per batch (and per checkpoint)
+  duty_cycle: 0.5                  # Fraction of time the job may be busy; it sleeps the rest
+  checkpoint_dir: ./data/migrations
 
 # Firecrawl Web Scraping Configuration
 firecrawl:
@@ -417,6 +533,103 @@ def get_mysql_config():
     }
 
 
+def get_knowledge_base_config():
+    """Keyword arguments for MySQLVectorStore search/index behaviour"""
+    config = load_config()
+    kb_cfg = config.get('knowledge_base', {})
+    return {
+        'use_memory_index': kb_cfg.get('memory_index', True),
+        'index_refresh_seconds': float(kb_cfg.get('index_refresh_seconds', 2.0)),
+        'max_cached_users': int(kb_cfg.get('max_cached_users', 256)),
+        'separate_embedding_table': kb_cfg.get('separate_embedding_table', False),
+        'embedding_format': kb_cfg.get('embedding_format', 'float16'),
+        'ann_index': kb_cfg.get('ann_index', False),
+        'ann_directory': kb_cfg.get('ann_directory', './data/embeddings/ann_index'),
+        'ann_nprobe': int(kb_cfg.get('ann_nprobe', 8)),
+        'ann_exact_threshold': int(kb_cfg.get('ann_exact_threshold', 2048)),
+        'ann_rebuild_threshold': float(kb_cfg.get('ann_rebuild_threshold', 0.25))
+    }
+
+
+
+def get_vector_store_config():
+    """Keyword arguments for VectorStore (collection, encoder and query batching) from the chroma section"""
+    config = load_config()
+    chroma_cfg = config.get('chroma', {})
+    return {
+        'persist_directory': chroma_cfg.get('persist_directory', './data/embeddings'),
+        'collection_name': chroma_cfg.get('collection_name', 'legal_documents'),
+        'embedding_model': chroma_cfg.get('embedding_model', 'paraphrase-multilingual-MiniLM-L12-v2'),
+        'embedding_batch_size': int(chroma_cfg.get('embedding_batch_size', 32)),
+        'query_cache_size': int(chroma_cfg.get('query_cache_size', 1024)),
+        'query_cache_ttl': chroma_cfg.get('query_cache_ttl_seconds') or None,
+        'embedding_backend': chroma_cfg.get('embedding_backend', 'torch'),
+        'onnx_quantize': chroma_cfg.get('onnx_quantize', True),
+        'onnx_cache_dir': chroma_cfg.get('onnx_cache_dir', './data/models/onnx'),
+        'micro_batching': chroma_cfg.get('micro_batching', True),
+        'micro_batch_size': int(chroma_cfg.get('micro_batch_size', 32)),
+        'micro_batch_wait_ms': float(chroma_cfg.get('micro_batch_wait_ms', 5.0)),
+        'chunking': chroma_cfg.get('chunking', 'tokens'),
+        'chunk_overlap_tokens': int(chroma_cfg.get('chunk_overlap_tokens', 16))
+    }
+
+
+def get_llm_client_config():
+    """Connection pool and cache settings for the shared LLM clients"""
+    config = load_config()
+    llm_cfg = config.get('llm_clients', {})
+    return {
+        'max_connections': int(llm_cfg.get('max_connections', 20)),
+        'max_keepalive_connections': int(llm_cfg.get('max_keepalive_connections', 10)),
+        'keepalive_expiry': float(llm_cfg.get('keepalive_expiry', 30.0)),
+        'timeout': float(llm_cfg.get('timeout', 120.0)),
+        'connect_timeout': float(llm_cfg.get('connect_timeout', 10.0)),
+        'max_retries': int(llm_cfg.get('max_retries', 2)),
+        'model_list_ttl': float(llm_cfg.get('model_list_ttl', 60.0)),
+        'async_max_connections': int(llm_cfg.get('async_max_connections', 256)),
+        'async_max_keepalive_connections': int(llm_cfg.get('async_max_keepalive_connections', 64))
+    }
+
+
+def get_context_budget_config():
+    """Token budget settings for ContextPacker"""
+    config = load_config()
+    budget_cfg = config.get('context_budget', {})
+    return {
+        'max_prompt_tokens': int(budget_cfg.get('max_prompt_tokens', 6000)),
+        'history_share': float(budget_cfg.get('history_share', 0.35)),
+        'max_chunk_tokens': int(budget_cfg.get('max_chunk_tokens', 800)),
+        'min_item_tokens': int(budget_cfg.get('min_item_tokens', 48)),
+        'ollama_context_window': int(budget_cfg.get('ollama_context_window', 4096)),
+        'default_context_window': int(budget_cfg.get('default_context_window', 8192)),
+        'model_context_windows': {str(k): int(v) for k, v in (budget_cfg.get('model_context_windows') or {}).items()}
+    }
+
+
+def get_conversation_memory_config():
+    """Keyword arguments for ConversationMemory"""
+    config = load_config()
+    memory_cfg = config.get('conversation_memory', {})
+    return {
+        'recent_messages': int(memory_cfg.get('recent_messages', 6)),
+        'summarize_threshold': int(memory_cfg.get('summarize_threshold', 6)),
+        'max_fold_messages': int(memory_cfg.get('max_fold_messages', 20)),
+        'summary_max_tokens': int(memory_cfg.get('summary_max_tokens', 500))
+    }
+
+
+def get_reembedding_config():
+    """Keyword arguments for ReembeddingJob throttling and checkpoints"""
+    config = load_config()
+    re_cfg = config.get('reembedding', {})
+    return {
+        'batch_size': int(re_cfg.get('batch_size', 64)),
+        'duty_cycle': float(re_cfg.get('duty_cycle', 0.5)),
+        'checkpoint_dir': re_cfg.get('checkpoint_dir', './data/migrations'),
+        'backend': config.get('chroma', {}).get('embedding_backend', 'torch')
+    }
+
+
 if __name__ == "__main__":
     # Example usage
     config = get_config()
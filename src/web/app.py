@@ -16,7 +16,7 @@ import requests
 import numpy as np
 import mysql.connector
 from fastapi import FastAPI, Request, Depends, HTTPException, status, Form, Body, UploadFile
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
@@ -29,9 +29,11 @@ import asyncio
 sys.path.append(str(Path(__file__).parent.parent))
 
 from core.llm_engine import LLMEngine
+from core.llm_clients import close_llm_clients
+from core.conversation_memory import ConversationMemory
 from core.vector_store import VectorStore, MySQLVectorStore, create_legal_document_metadata
 from utils.document_processor import DocumentProcessor
-from utils.config import load_config, get_mysql_config
+from utils.config import load_config, get_mysql_config, get_knowledge_base_config, get_conversation_memory_config, get_vector_store_config
 from scrapers.firecrawl_scraper import FirecrawlScraper
 
 app = FastAPI(debug=True)
@@ -41,11 +43,21 @@ app.add_middleware(SessionMiddleware, secret_key="dali-legal-ai-super-secret-key
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Same collection, model and encoder settings as DALIApp and the re-embedding job
+vector_store = VectorStore(**get_vector_store_config())
 # Initialize MySQL user store
-user_store = MySQLVectorStore(get_mysql_config())
+user_store = MySQLVectorStore(
+    get_mysql_config(),
+    embedding_model_name=vector_store.embedding_model_name,
+    query_embedder=vector_store._generate_embedding,
+    batch_query_embedder=vector_store._generate_query_embeddings,
+    chunk_embedder=vector_store._generate_embeddings,
+    **get_knowledge_base_config()
+)
 MYSQL_AVAILABLE = True
+# Rolling summary + recent turns for legal research conversations
+conversation_memory = ConversationMemory(user_store, **get_conversation_memory_config())
 doc_processor = DocumentProcessor()
-vector_store = VectorStore()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -1284,12 +1296,7 @@ class DALIApp:
                 port=self.config.get('ollama', {}).get('port', 11434)
             )
             # VectorStore should always use a valid local embedding model, never the selected LLM model
-            embedding_model = self.config.get('chroma', {}).get('embedding_model', 'paraphrase-multilingual-MiniLM-L12-v2')
-            self.vector_store = VectorStore(
-                persist_directory=self.config.get('chroma', {}).get('persist_directory', './data/embeddings'),
-                collection_name=self.config.get('chroma', {}).get('collection_name', 'legal_documents'),
-                embedding_model=embedding_model
-            )
+            self.vector_store = VectorStore(**get_vector_store_config())
             
             # Initialize Web Scraper
             firecrawl_api_key = self.config.get('firecrawl', {}).get('api_key')
@@ -1302,7 +1309,14 @@ class DALIApp:
             
             # Initialize MySQL Vector Store with error handling
             try:
-                self.mysql_vector_store = MySQLVectorStore(get_mysql_config())
+                self.mysql_vector_store = MySQLVectorStore(
+                    get_mysql_config(),
+                    embedding_model_name=self.vector_store.embedding_model_name,
+                    query_embedder=self.vector_store._generate_embedding,
+                    batch_query_embedder=self.vector_store._generate_query_embeddings,
+                    chunk_embedder=self.vector_store._generate_embeddings,
+                    **get_knowledge_base_config()
+                )
             except Exception as e:
                 logger.warning(f"MySQL Vector Store not available: {e}")
                 self.mysql_vector_store = None
@@ -1591,12 +1605,9 @@ class DALIApp:
             # Generate embedding for the query
             query_embedding = self.vector_store._generate_embedding(message)
             kb_results = self.mysql_vector_store.search_documents(user_id, query_embedding, top_k=20)
-            context = ""
-            if kb_results:
-                context = "\n\n".join([
-                    f"Document: {r['title']}\n{r['content'][:500]}..." for r in kb_results
-                ])
-            print("=== LLM CONTEXT (MySQL) ===\n", context)
+            # Ranked documents; the engine trims them to the model's token budget
+            context = [f"Document: {r['title']}\n{r['content']}" for r in kb_results]
+            print("=== LLM CONTEXT (MySQL) ===\n", f"{len(context)} documents")
             response = self.llm_engine.generate_response(
                 query=llm_message,
                 context=context if context else None
@@ -2609,16 +2620,20 @@ def get_current_user(request: Request):
     
     return user
 
+def get_knowledge_base_stats(user_id=None):
+    """Knowledge base counters for one user (or all users), with zeros if MySQL is unavailable"""
+    try:
+        if MYSQL_AVAILABLE and user_store:
+            return user_store.get_stats(user_id)
+    except Exception as e:
+        print(f"Knowledge base stats unavailable: {e}")
+    return {"total_documents": 0, "total_chunks": 0, "total_bytes": 0, "document_types": {}, "sources": {}}
+
 @app.get("/dashboard", response_class=HTMLResponse)
 def dashboard(request: Request, user: dict = Depends(get_current_user)):
     # Calculate actual stats for the current user
     user_id = user["id"]
-    result = safe_mysql_query(
-        "SELECT COUNT(*) as total_documents FROM documents WHERE user_id = %s", 
-        (user_id,), 
-        fetch_one=True
-    )
-    total_documents = result['total_documents'] if result else 0
+    total_documents = get_knowledge_base_stats(user_id)["total_documents"]
     
     stats = {"total_documents": total_documents, "conversations": 0}
     return templates.TemplateResponse(
@@ -2644,8 +2659,7 @@ def admin_dashboard(request: Request, user: dict = Depends(get_current_user)):
     new_users_week = cursor.fetchone()["total"]
     
     # Total documents
-    cursor.execute("SELECT COUNT(*) as total FROM documents")
-    total_documents = cursor.fetchone()["total"]
+    total_documents = get_knowledge_base_stats()["total_documents"]
     
     # Recent activities (placeholder)
     recent_activities = [
@@ -2818,6 +2832,87 @@ def get_current_user_api(request: Request):
         "session_data": session_data
     }
 
+def _legal_research_context(user, query, conversation_id):
+    """
+    Shared first half of a legal research turn: LLM engine, history and KB context
+
+    Args:
+        user: Session user dict
+        query: The research question (already saved to the conversation)
+        conversation_id: Conversation the question belongs to
+
+    Returns:
+        (llm_engine, doc_context, conversation_history, kb_results)
+    """
+    # Get user settings or use defaults
+    user_settings = user.get('settings', {})
+    if not user_settings:
+        # Set default settings if none exist
+        user_settings = {
+            'llm_provider': 'openai',
+            'llm_model': 'gpt-3.5-turbo'
+        }
+    
+    llm_engine = LLMEngine.from_user_settings(user_settings)
+    
+    # Conversation summary plus recent turns, excluding the current user message
+    conversation_history = conversation_memory.history(conversation_id, skip_latest=1)
+    
+    # Try to find relevant documents in the user's knowledge base using vector search
+    doc_context = None
+    kb_results = []
+    if query and MYSQL_AVAILABLE and user_store:
+        try:
+            # Hybrid keyword + vector retrieval over the user's knowledge base chunks
+            kb_results = user_store.retrieve(user["id"], query, k=5)
+            
+            print(f"DEBUG: Found {len(kb_results)} documents in knowledge base")
+            for i, result in enumerate(kb_results):
+                print(f"DEBUG: Result {i+1}: {result.get('title', 'Untitled')} - RRF: {result.get('rrf_score', 0):.4f}, "
+                      f"similarity: {result.get('similarity_score', 0):.3f}, BM25: {result.get('bm25_score', 0):.3f}")
+            
+            if kb_results:
+                # Keep keyword matches and semantically close chunks (similarity threshold of 0.3)
+                relevant_results = [r for r in kb_results if r.get('bm25_score', 0) > 0 or r.get('similarity_score', 0) >= 0.3]
+                print(f"DEBUG: {len(relevant_results)} results above threshold 0.3")
+                if relevant_results:
+                    doc_context = [
+                        f"Document: {r.get('title', 'Untitled')} (section {r.get('chunk_index', 0) + 1})\nRelevance Score: {r.get('similarity_score', 0):.3f}\nContent: {r.get('content', '')}"
+                        for r in relevant_results[:3]  # Limit to top 3 most relevant
+                    ]
+        except Exception as kb_error:
+            print(f"Knowledge base search failed: {kb_error}")
+            # Fallback to simple title matching
+            try:
+                cursor = user_store._get_connection().cursor(dictionary=True)
+                cursor.execute("SELECT title, content FROM documents WHERE user_id = %s", (user["id"],))
+                docs = cursor.fetchall()
+                cursor.close()
+                for doc in docs:
+                    if any(keyword.lower() in doc["title"].lower() or keyword.lower() in doc["content"].lower() 
+                           for keyword in query.lower().split()):
+                        doc_context = [f"Document: {doc['title']}\nContent: {doc['content']}"]
+                        break
+            except Exception as fallback_error:
+                print(f"Fallback search also failed: {fallback_error}")
+    
+    # If still no context found, try global vector search as last resort
+    if not doc_context:
+        try:
+            kb_results = vector_store.search(query, n_results=3)
+            if kb_results:
+                doc_context = [f"Document: {r['metadata']['title']}\n{r['content']}" for r in kb_results]
+        except Exception as global_error:
+            print(f"Global vector search failed: {global_error}")
+    
+    return llm_engine, doc_context, conversation_history, kb_results
+
+
+def _sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.post("/legal-research", response_class=HTMLResponse)
 def legal_research_post(request: Request, query: str = Form(...), jurisdiction: str = Form(...), include_web_search: str = Form(None), conversation_id: int = Form(None)):
     print(f"DEBUG: Legal research endpoint called with query: {query}")
@@ -2848,79 +2943,14 @@ def legal_research_post(request: Request, query: str = Form(...), jurisdiction:
         # Add user message to conversation
         user_store.add_message_to_conversation(current_conversation_id, "user", query)
         
-        # Get user settings or use defaults
-        user_settings = user.get('settings', {})
-        if not user_settings:
-            # Set default settings if none exist
-            user_settings = {
-                'llm_provider': 'openai',
-                'llm_model': 'gpt-3.5-turbo'
-            }
-        
-        llm_engine = LLMEngine.from_user_settings(user_settings)
-        
-        # Get conversation history for context
-        conversation_messages = user_store.get_conversation_messages(current_conversation_id)
-        conversation_history = []
-        for msg in conversation_messages[:-1]:  # Exclude the current user message
-            conversation_history.append({
-                "role": msg["sender_type"],
-                "content": msg["message"]
-            })
-        
-        # Try to find relevant documents in the user's knowledge base using vector search
-        doc_context = None
-        kb_results = []
-        if query and MYSQL_AVAILABLE and user_store:
-            try:
-                # Use vector search to find relevant documents from user's knowledge base
-                query_embedding = vector_store._generate_embedding(query)
-                kb_results = user_store.search_documents(user["id"], query_embedding, top_k=5)
-                
-                print(f"DEBUG: Found {len(kb_results)} documents in knowledge base")
-                for i, result in enumerate(kb_results):
-                    print(f"DEBUG: Result {i+1}: {result.get('title', 'Untitled')} - Score: {result.get('score', 0):.3f}")
-                
-                if kb_results:
-                    # Filter results by relevance score (threshold of 0.3)
-                    relevant_results = [r for r in kb_results if r.get('score', 0) >= 0.3]
-                    print(f"DEBUG: {len(relevant_results)} results above threshold 0.3")
-                    if relevant_results:
-                        doc_context = "=== KNOWLEDGE BASE DOCUMENTS ===\n\n"
-                        doc_context += "\n\n".join([
-                            f"Document: {r.get('title', 'Untitled')}\nRelevance Score: {r.get('score', 0):.3f}\nContent: {r.get('content', '')[:1500]}..."
-                            for r in relevant_results[:3]  # Limit to top 3 most relevant
-                        ])
-                        doc_context += "\n\n=== END KNOWLEDGE BASE ===\n\n"
-            except Exception as kb_error:
-                print(f"Knowledge base search failed: {kb_error}")
-                # Fallback to simple title matching
-                try:
-                    cursor = user_store._get_connection().cursor(dictionary=True)
-                    cursor.execute("SELECT title, content FROM documents WHERE user_id = %s", (user["id"],))
-                    docs = cursor.fetchall()
-                    cursor.close()
-                    for doc in docs:
-                        if any(keyword.lower() in doc["title"].lower() or keyword.lower() in doc["content"].lower() 
-                               for keyword in query.lower().split()):
-                            doc_context = f"=== KNOWLEDGE BASE DOCUMENTS ===\n\nDocument: {doc['title']}\nContent: {doc['content'][:2000]}...\n\n=== END KNOWLEDGE BASE ===\n\n"
-                            break
-                except Exception as fallback_error:
-                    print(f"Fallback search also failed: {fallback_error}")
-        
-        # If still no context found, try global vector search as last resort
-        if not doc_context:
-            try:
-                kb_results = vector_store.search(query, n_results=3)
-                if kb_results:
-                    doc_context = "\n\n".join([f"Document: {r['metadata']['title']}\n{r['content'][:1000]}..." for r in kb_results])
-            except Exception as global_error:
-                print(f"Global vector search failed: {global_error}")
+        llm_engine, doc_context, conversation_history, kb_results = _legal_research_context(
+            user, query, current_conversation_id
+        )
         
         # Generate response with conversation context
         print(f"DEBUG: Document context found: {bool(doc_context)}")
         if doc_context:
-            print(f"DEBUG: Context preview: {doc_context[:200]}...")
+            print(f"DEBUG: Context documents: {len(doc_context)}")
         
         print(f"DEBUG: Generating response for query: {query}")
         try:
@@ -2936,6 +2966,7 @@ def legal_research_post(request: Request, query: str = Form(...), jurisdiction:
         
         # Add AI response to conversation
         user_store.add_message_to_conversation(current_conversation_id, "assistant", research_result)
+        conversation_memory.schedule(current_conversation_id, llm_engine)
         
         # Web research (placeholder)
         if include_web_search:
@@ -2965,6 +2996,72 @@ def legal_research_post(request: Request, query: str = Form(...), jurisdiction:
         }
     )
 
+@app.post("/legal-research/stream")
+def legal_research_stream(request: Request, query: str = Form(...), jurisdiction: str = Form(...), include_web_search: str = Form(None), conversation_id: int = Form(None)):
+    """
+    Legal research answer streamed as Server-Sent Events
+
+    Retrieval runs first and is reported in a "meta" event; the answer then
+    arrives as "token" events while the LLM generates it. The full answer is
+    saved to the conversation before the final "done" event (a partial answer
+    is saved if the client disconnects).
+    """
+    user = request.session.get("user")
+    if not user:
+        return JSONResponse({"error": "Not authenticated"}, status_code=401)
+
+    if not conversation_id:
+        title = query[:50] + "..." if len(query) > 50 else query
+        conversation_id = user_store.create_conversation(user["id"], title, "legal_research")
+    user_store.add_message_to_conversation(conversation_id, "user", query)
+
+    try:
+        llm_engine, doc_context, conversation_history, kb_results = _legal_research_context(user, query, conversation_id)
+    except Exception as e:
+        logger.error(f"Legal research retrieval failed: {e}")
+        user_store.add_message_to_conversation(conversation_id, "assistant", f"Error: {e}")
+        return JSONResponse({"error": str(e), "conversation_id": conversation_id}, status_code=500)
+
+    sources = [
+        {
+            "title": r.get('title') or (r.get('metadata') or {}).get('title', 'Untitled'),
+            "score": float(r.get('similarity_score', 0) or 0),
+            "bm25_score": float(r.get('bm25_score', 0) or 0),
+            "rrf_score": float(r.get('rrf_score', 0) or 0)
+        }
+        for r in kb_results
+    ]
+
+    def events():
+        parts = []
+        saved = False
+        try:
+            yield _sse_event("meta", {"conversation_id": conversation_id, "sources": sources})
+            for token in llm_engine.stream_response(query, context=doc_context, conversation_history=conversation_history):
+                parts.append(token)
+                yield _sse_event("token", {"text": token})
+            answer = "".join(parts)
+            user_store.add_message_to_conversation(conversation_id, "assistant", answer)
+            saved = True
+            conversation_memory.schedule(conversation_id, llm_engine)
+            yield _sse_event("done", {"conversation_id": conversation_id, "length": len(answer)})
+        except Exception as e:
+            logger.error(f"Streaming legal research failed: {e}")
+            if not saved:
+                user_store.add_message_to_conversation(conversation_id, "assistant", "".join(parts) or f"Error: {e}")
+                saved = True
+            yield _sse_event("error", {"error": str(e), "conversation_id": conversation_id})
+        finally:
+            # Client went away mid-answer: keep what was generated
+            if not saved and parts:
+                user_store.add_message_to_conversation(conversation_id, "assistant", "".join(parts))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/document-analysis", response_class=HTMLResponse)
 def document_analysis_post(request: Request, user: dict = Depends(get_current_user), document: UploadFile = Form(...), analysis_type: str = Form(...), add_to_kb: str = Form(None)):
     stats = {"total_documents": 0, "conversations": 0}
@@ -2993,8 +3090,11 @@ def document_analysis_post(request: Request, user: dict = Depends(get_current_us
             # Add to KB if requested
             if add_to_kb:
                 metadata = create_legal_document_metadata(title=filename, document_type=analysis_type, source="uploaded_document")
-                embedding = vector_store._generate_embedding(document_text)
-                user_store.add_document(user_id=user["id"], title=filename, document_type=analysis_type, source="uploaded_document", content=document_text, embedding=np.array(embedding, dtype=np.float32), metadata=metadata)
+                # One embedding per chunk; a single whole-document embedding would be truncated by the model
+                chunks = vector_store.text_splitter.split_text(document_text)
+                # Chunks already in the shared chunk store are not re-encoded
+                chunk_embeddings = user_store.embed_chunks(chunks)
+                user_store.add_document_chunks(user_id=user["id"], title=filename, document_type=analysis_type, source="uploaded_document", content=document_text, chunks=chunks, chunk_embeddings=chunk_embeddings, metadata=metadata)
                 kb_success = True
                 log_activity(user["id"], "document_upload", {"filename": filename, "analysis_type": analysis_type})
         else:
@@ -3016,66 +3116,74 @@ def document_analysis_post(request: Request, user: dict = Depends(get_current_us
     )
 
 @app.post("/knowledge-base", response_class=HTMLResponse)
-def knowledge_base_post(request: Request, user: dict = Depends(get_current_user), search_query: str = Form(...), num_results: int = Form(...), min_score: float = Form(...)):
-    # Calculate actual stats for the current user
+def knowledge_base_post(request: Request, user: dict = Depends(get_current_user), search_query: str = Form(...), num_results: int = Form(...), min_score: float = Form(...), document_type: str = Form(None), source: str = Form(None), jurisdiction: str = Form(None), date_from: str = Form(None), date_to: str = Form(None)):
+    # Maintained per-user counters (one primary key lookup)
     user_id = user["id"]
-    
-    # Get document count
-    result = safe_mysql_query(
-        "SELECT COUNT(*) as total FROM documents WHERE user_id = %s", 
-        (user_id,), 
-        fetch_one=True
-    )
-    total_documents = result['total'] if result else 0
-    
-    # Get document types
-    document_types_result = safe_mysql_query(
-        "SELECT DISTINCT document_type FROM documents WHERE user_id = %s", 
-        (user_id,), 
-        fetch_all=True
-    )
-    document_types = [row["document_type"] for row in document_types_result] if document_types_result else []
-    
-    # Get sources
-    sources_result = safe_mysql_query(
-        "SELECT DISTINCT source FROM documents WHERE user_id = %s", 
-        (user_id,), 
-        fetch_all=True
-    )
-    sources = [row["source"] for row in sources_result] if sources_result else []
-    
-    stats = {"total_documents": total_documents, "conversations": 0, "document_types": document_types, "sources": sources}
+    kb_stats = get_knowledge_base_stats(user_id)
+    stats = {
+        "total_documents": kb_stats["total_documents"],
+        "conversations": 0,
+        "document_types": list(kb_stats["document_types"]),
+        "sources": list(kb_stats["sources"]),
+    }
     error = None
     results = []
     ai_analysis = None
+
+    # Optional filters, pushed down into SQL and the in-memory index
+    filters = {
+        key: value for key, value in {
+            "document_type": document_type,
+            "source": source,
+            "jurisdiction": jurisdiction,
+            "date_from": date_from,
+            "date_to": date_to,
+        }.items() if value
+    }
+    # ChromaDB fallback can only filter on exact metadata matches
+    chroma_where = [{key: filters[key]} for key in ("document_type", "source", "jurisdiction") if key in filters]
+    chroma_filter = None
+    if len(chroma_where) == 1:
+        chroma_filter = chroma_where[0]
+    elif chroma_where:
+        chroma_filter = {"$and": chroma_where}
     
     try:
         # Try MySQL vector store for user-specific search first
         if MYSQL_AVAILABLE and user_store:
             try:
                 query_embedding = vector_store._generate_embedding(search_query)
-                results = user_store.search_documents(user_id, query_embedding, top_k=num_results)
+                # One result per document (its best-matching section), so min_score applies per document
+                results = user_store.search_chunks(user_id, query_embedding, top_k=num_results, filters=filters, per_document=True)
                 # Filter by score threshold
                 results = [r for r in results if r.get('score', 0) >= min_score]
+            except ValueError:
+                # Invalid filter values (e.g. a malformed date) are reported, not retried without filters
+                raise
             except Exception as mysql_error:
                 print(f"MySQL search failed, falling back to ChromaDB: {mysql_error}")
                 # Fallback to ChromaDB global search
-                results = vector_store.search(search_query, n_results=num_results)
+                results = vector_store.search(search_query, n_results=num_results, filter_metadata=chroma_filter)
                 # Filter by score threshold
                 results = [r for r in results if r.get('score', 0) >= min_score]
         else:
             print("MySQL not available, using ChromaDB global search")
             # Use ChromaDB global search
-            results = vector_store.search(search_query, n_results=num_results)
+            results = vector_store.search(search_query, n_results=num_results, filter_metadata=chroma_filter)
             # Filter by score threshold
             results = [r for r in results if r.get('score', 0) >= min_score]
         
         # Generate AI analysis if we have results
         if results and len(results) > 0:
             try:
-                # Combine top results for analysis
-                combined_content = "\n\n".join([f"Document: {r.get('title', 'Untitled')}\nContent: {r.get('content', '')[:1000]}" for r in results[:3]])
-                ai_analysis = LLMEngine.from_user_settings(user.get('settings', {})).analyze_document(combined_content, "knowledge_base_search")
+                # Combine top results for analysis, each trimmed to its share of the token budget
+                analysis_engine = LLMEngine.from_user_settings(user.get('settings', {}))
+                packed = analysis_engine.context_packer.pack(
+                    "",
+                    system_prompt=analysis_engine.legal_system_prompt,
+                    chunks=[f"Document: {r.get('title', 'Untitled')}\nContent: {r.get('content', '')}" for r in results[:3]]
+                )
+                ai_analysis = analysis_engine.analyze_document(packed.context, "knowledge_base_search")
             except Exception as analysis_error:
                 print(f"Error generating AI analysis: {analysis_error}")
                 ai_analysis = f"Analysis temporarily unavailable: {str(analysis_error)}"
@@ -3131,27 +3239,25 @@ def web_research_post(request: Request, user: dict = Depends(get_current_user),
                 if add_to_kb:
                     # Split content into chunks for better processing
                     chunks = vector_store.text_splitter.split_text(result.content)
-                    success_count = 0
-                    
-                    for i, chunk in enumerate(chunks):
-                        metadata = create_legal_document_metadata(
-                            title=f"{result.title or url} - Part {i+1}",
-                            document_type="web_research",
-                            source=url,
-                            date_created=datetime.now().isoformat()
-                        )
-                        
-                        embedding = vector_store._generate_embedding(chunk)
-                        user_store.add_document(
-                            user_id=user["id"],
-                            title=f"{result.title or url} - Part {i+1}",
-                            document_type="web_research",
-                            source=url,
-                            content=chunk,
-                            embedding=np.array(embedding, dtype=np.float32),
-                            metadata=metadata
-                        )
-                        success_count += 1
+                    # One batched encode of unseen parts, then one transaction for every part
+                    embeddings = user_store.embed_chunks(chunks)
+                    rows = []
+                    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+                        title = f"{result.title or url} - Part {i+1}"
+                        rows.append({
+                            "title": title,
+                            "document_type": "web_research",
+                            "source": url,
+                            "content": chunk,
+                            "embedding": embedding,
+                            "metadata": create_legal_document_metadata(
+                                title=title,
+                                document_type="web_research",
+                                source=url,
+                                date_created=datetime.now().isoformat()
+                            )
+                        })
+                    success_count = len(user_store.add_documents_bulk(user["id"], rows))
                     
                     if success_count > 0:
                         log_activity(user["id"], "web_research_added", {"url": url, "chunks": success_count})
@@ -3232,6 +3338,12 @@ def ensure_admin_user():
         user_store.conn.commit()
         cursor.close()
 
+@app.on_event("shutdown")
+def close_pooled_llm_clients():
+    # Release keep-alive connections held by the shared OpenAI/Ollama clients
+    conversation_memory.close()
+    close_llm_clients()
+
 @app.get("/api/users/search")
 def api_users_search(request: Request, q: str = ""):
     user = request.session.get("user")
@@ -3657,10 +3769,7 @@ def api_delete_document(request: Request, document_id: int):
         return {"error": "Not authenticated"}
     
     try:
-        result = safe_mysql_query(
-            "DELETE FROM documents WHERE id = %s AND user_id = %s",
-            (document_id, user["id"])
-        )
+        result = user_store.delete_document(document_id, user["id"])
         
         if result > 0:
             return {"success": True}
@@ -3710,6 +3819,7 @@ def api_share_document(request: Request):
             "INSERT INTO shared_documents (document_id, shared_with_user_id, shared_by_user_id) VALUES (%s, %s, %s)",
             (document_id, recipient["id"], user["id"])
         )
+        user_store.invalidate_user_index(recipient["id"])
         
         return {"success": True}
     except Exception as e:
@@ -4189,6 +4299,8 @@ def api_share_document_analysis(request: Request):
         )
         
         if result > 0:
+            user_store.adjust_stats(recipient["id"], "analysis", "shared_analysis", documents=1,
+                                    bytes=len(analysis_text.encode("utf-8")))
             return {"success": True}
         else:
             return {"error": "Failed to share analysis"}
@@ -4228,6 +4340,8 @@ def api_add_analysis_to_kb(request: Request):
         )
         
         if result > 0:
+            user_store.adjust_stats(user["id"], document_type, source, documents=1,
+                                    bytes=len(content.encode("utf-8")))
             return {"success": True}
         else:
             return {"error": "Failed to add to knowledge base"}